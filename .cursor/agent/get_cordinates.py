@@ -1,61 +1,284 @@
-import pyautogui
-import keyboard
+import argparse
+import json
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image
 from termcolor import cprint
-from pynput import mouse
 
 # Constants
 RUNNING = True
 TARGET_WIDTH = 1280
 TARGET_HEIGHT = 800
-SCREEN_WIDTH, SCREEN_HEIGHT = pyautogui.size()
+TEMPLATE_DIR = Path(__file__).resolve().parent / "templates"
 
-def scale_coordinates(x: int, y: int) -> tuple[int, int]:
+def scale_coordinates(x: int, y: int, screen_size: Optional[tuple[int, int]] = None) -> tuple[int, int]:
     """Scale coordinates from actual screen resolution to target resolution"""
-    scaled_x = int((x / SCREEN_WIDTH) * TARGET_WIDTH)
-    scaled_y = int((y / SCREEN_HEIGHT) * TARGET_HEIGHT) 
+    if screen_size is None:
+        import pyautogui
+        screen_size = pyautogui.size()
+    screen_width, screen_height = screen_size
+    scaled_x = int((x / screen_width) * TARGET_WIDTH)
+    scaled_y = int((y / screen_height) * TARGET_HEIGHT)
     return scaled_x, scaled_y
 
-def get_coordinates():
+@dataclass(frozen=True)
+class TemplateMatch:
+    """Location of a template on screen (physical pixels of the click point) and its NCC score"""
+    name: str
+    x: int
+    y: int
+    score: float
+    elapsed_ms: float
+    cached: bool = False
+
+def _block_mean(image: np.ndarray, factor: int) -> np.ndarray:
+    """Downscale a grayscale array by averaging factor x factor blocks"""
+    height, width = image.shape[0] // factor * factor, image.shape[1] // factor * factor
+    return image[:height, :width].reshape(height // factor, factor, width // factor, factor).mean(axis=(1, 3))
+
+def _ncc_map(image: np.ndarray, template: np.ndarray) -> np.ndarray:
+    """
+    Normalized cross-correlation of template at every position of image
+
+    The correlation is computed with FFTs and the window statistics with
+    integral images, so the cost does not depend on the template size.
+    """
+    image = image.astype(np.float64)
+    template_height, template_width = template.shape
+    count = template_height * template_width
+    template = template.astype(np.float64) - template.mean()
+    template_norm = np.sqrt((template ** 2).sum())
+    if template_norm == 0:
+        raise ValueError("Template has no contrast")
+
+    shape = (image.shape[0] + template_height, image.shape[1] + template_width)
+    correlation = np.fft.irfft2(np.fft.rfft2(image, shape) * np.conj(np.fft.rfft2(template, shape)), shape)
+    correlation = correlation[:image.shape[0] - template_height + 1, :image.shape[1] - template_width + 1]
+
+    def window_sums(values: np.ndarray) -> np.ndarray:
+        integral = np.pad(values.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+        return (integral[template_height:, template_width:] - integral[:-template_height, template_width:]
+                - integral[template_height:, :-template_width] + integral[:-template_height, :-template_width])
+
+    sums = window_sums(image)
+    variance = window_sums(image ** 2) - sums ** 2 / count
+    # Flat windows (under one gray level of deviation) cannot match a template with contrast
+    flat = variance < count
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = correlation / (np.sqrt(np.where(flat, 1.0, variance)) * template_norm)
+    scores[flat] = 0.0
+    return scores
+
+class TemplateLocator:
+    """
+    Finds reference templates (small screen crops) on new frames
+
+    Templates are captured with `capture` (or `python get_cordinates.py --save NAME`)
+    and stored as grayscale PNGs with the click point inside the crop. `locate`
+    searches a pyramid: a full NCC search on a `factor` times downscaled frame,
+    then a refinement at full resolution around the best coarse candidates.
+    Results are cached per screen resolution; a cached location is re-scored
+    on each call and searched again once the score drops below `min_score`.
+    """
+    def __init__(self, directory: str | Path = TEMPLATE_DIR, factor: int = 4, min_score: float = 0.8,
+                 candidates: int = 3):
+        self.directory = Path(directory)
+        self.factor = factor
+        self.min_score = min_score
+        self.candidates = candidates
+        self._cache_path = self.directory / "locations.json"
+        self._cache: Dict[str, Dict[str, float]] = {}
+        if self._cache_path.exists():
+            self._cache = json.loads(self._cache_path.read_text(encoding="utf-8"))
+
+    def capture(self, name: str, x: int, y: int, image: Optional[Image.Image] = None,
+                size: tuple[int, int] = (160, 64)) -> Path:
+        """Store the area around physical point (x, y) as template name"""
+        if image is None:
+            import pyautogui
+            image = pyautogui.screenshot()
+        width, height = size
+        left = min(max(x - width // 2, 0), image.width - width)
+        top = min(max(y - height // 2, 0), image.height - height)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        image.convert("L").crop((left, top, left + width, top + height)).save(self.directory / f"{name}.png")
+        metadata = {"offset": [x - left, y - top], "screen_size": list(image.size),
+                    "captured": datetime.now().isoformat(timespec="seconds")}
+        (self.directory / f"{name}.json").write_text(json.dumps(metadata, indent=2), encoding="utf-8")
+        self._forget(name)
+        return self.directory / f"{name}.png"
+
+    def has_template(self, name: str) -> bool:
+        return (self.directory / f"{name}.png").exists()
+
+    def locate(self, name: str, image: Optional[Image.Image] = None) -> Optional[TemplateMatch]:
+        """Click point of template name on image (default: a new screenshot), or None if not found"""
+        start = time.perf_counter()
+        if image is None:
+            import pyautogui
+            image = pyautogui.screenshot()
+        screen = np.asarray(image.convert("L"), dtype=np.float32)
+        template, offset = self._load(name, image.size)
+        cache_key = f"{name}@{image.width}x{image.height}"
+
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            left, top = int(cached["left"]), int(cached["top"])
+            score = self._score_at(screen, template, left, top)
+            if score >= self.min_score:
+                return TemplateMatch(name, left + offset[0], top + offset[1], round(score, 3),
+                                     (time.perf_counter() - start) * 1000, cached=True)
+            self._forget(name)
+
+        found = self._search(screen, template)
+        if found is None or found[2] < self.min_score:
+            return None
+        left, top, score = found
+        self._cache[cache_key] = {"left": left, "top": top, "score": round(score, 3)}
+        self._save_cache()
+        return TemplateMatch(name, left + offset[0], top + offset[1], round(score, 3),
+                             (time.perf_counter() - start) * 1000)
+
+    def _load(self, name: str, screen_size: tuple[int, int]) -> tuple[np.ndarray, tuple[int, int]]:
+        """Template pixels and click offset, rescaled if captured at another resolution"""
+        path = self.directory / f"{name}.png"
+        if not path.exists():
+            raise FileNotFoundError(f"No template {name!r} in {self.directory}")
+        metadata = json.loads((self.directory / f"{name}.json").read_text(encoding="utf-8"))
+        template = Image.open(path).convert("L")
+        offset_x, offset_y = metadata["offset"]
+        captured_width, captured_height = metadata["screen_size"]
+        if (captured_width, captured_height) != tuple(screen_size):
+            scale_x, scale_y = screen_size[0] / captured_width, screen_size[1] / captured_height
+            template = template.resize((max(1, round(template.width * scale_x)), max(1, round(template.height * scale_y))),
+                                       Image.Resampling.BOX)
+            offset_x, offset_y = offset_x * scale_x, offset_y * scale_y
+        return np.asarray(template, dtype=np.float32), (int(offset_x), int(offset_y))
+
+    def _search(self, screen: np.ndarray, template: np.ndarray) -> Optional[tuple[int, int, float]]:
+        """Best (left, top, score): coarse search on the downscaled frame, refined at full size"""
+        factor = self.factor if min(template.shape) >= 4 * self.factor else 1
+        coarse = _ncc_map(_block_mean(screen, factor), _block_mean(template, factor))
+        if coarse.size == 0:
+            return None
+        best = None
+        flat = coarse.ravel()
+        count = min(self.candidates, flat.size)
+        for index in np.argpartition(flat, -count)[-count:]:
+            top, left = np.unravel_index(index, coarse.shape)
+            found = self._refine(screen, template, int(left) * factor, int(top) * factor, radius=2 * factor)
+            if found is not None and (best is None or found[2] > best[2]):
+                best = found
+        return best
+
+    def _refine(self, screen: np.ndarray, template: np.ndarray, left: int, top: int,
+                radius: int) -> Optional[tuple[int, int, float]]:
+        """Full-resolution NCC search within radius pixels of (left, top)"""
+        height, width = template.shape
+        region_left, region_top = max(left - radius, 0), max(top - radius, 0)
+        region = screen[region_top:top + radius + height, region_left:left + radius + width]
+        if region.shape[0] < height or region.shape[1] < width:
+            return None
+        scores = _ncc_map(region, template)
+        row, column = np.unravel_index(int(np.argmax(scores)), scores.shape)
+        return region_left + int(column), region_top + int(row), float(scores[row, column])
+
+    def _score_at(self, screen: np.ndarray, template: np.ndarray, left: int, top: int) -> float:
+        """NCC score of template at exactly (left, top)"""
+        height, width = template.shape
+        window = screen[top:top + height, left:left + width]
+        if window.shape != template.shape:
+            return 0.0
+        window = window - window.mean()
+        centered = template - template.mean()
+        denominator = np.sqrt((window ** 2).sum() * (centered ** 2).sum())
+        return float((window * centered).sum() / denominator) if denominator else 0.0
+
+    def _forget(self, name: str):
+        """Drop cached locations of template name (all resolutions)"""
+        stale = [key for key in self._cache if key.split("@")[0] == name]
+        for key in stale:
+            del self._cache[key]
+        if stale:
+            self._save_cache()
+
+    def _save_cache(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._cache_path.write_text(json.dumps(self._cache, indent=2), encoding="utf-8")
+
+def get_coordinates(save_as: Optional[str] = None):
+    """Print the coordinates of every click; with save_as, store the clicked area as a template"""
+    import keyboard
+    import pyautogui
+    from pynput import mouse
+
     try:
+        screen_size = pyautogui.size()
+        locator = TemplateLocator()
         cprint("Starting coordinate tracker...", "cyan")
         cprint(f"Scaling coordinates to {TARGET_WIDTH}x{TARGET_HEIGHT} resolution", "cyan")
         cprint("Press 'q' to quit", "yellow")
         cprint("Click anywhere to get coordinates", "green")
-        
+        if save_as:
+            cprint(f"The clicked area will be saved as template '{save_as}'", "green")
+
         global RUNNING
         RUNNING = True
-        
+
         # Mouse listener callback
         def on_click(x, y, button, pressed):
-            if pressed and RUNNING:
-                scaled_x, scaled_y = scale_coordinates(x, y)
+            if not RUNNING:
+                return False
+            if pressed:
+                x, y = int(x), int(y)
+                scaled_x, scaled_y = scale_coordinates(x, y, screen_size)
                 cprint(f"Original coordinates: x={x}, y={y}", "white")
                 cprint(f"Scaled coordinates: x={scaled_x}, y={scaled_y}", "green")
-                
-                # Try to get any UI element at those coordinates
-                try:
-                    element = pyautogui.locateOnScreen(None, region=(x-5, y-5, 10, 10))
-                    if element:
-                        cprint("Clickable element detected at this position", "blue")
-                except Exception as e:
-                    cprint(f"Could not check for UI element: {str(e)}", "yellow")
+
+                if save_as:
+                    try:
+                        path = locator.capture(save_as, x, y)
+                        cprint(f"Saved template '{save_as}' to {path}", "blue")
+                    except Exception as e:
+                        cprint(f"Could not save template: {str(e)}", "yellow")
 
         def stop_listener():
             global RUNNING
             RUNNING = False
             cprint("Stopping coordinate tracker...", "red")
-            
-        # Register quit hotkey
-        keyboard.on_press_key('q', lambda _: stop_listener())
-        
-        # Start mouse listener
+            listener.stop()
+
+        # Start mouse listener and register quit hotkey
         with mouse.Listener(on_click=on_click) as listener:
+            keyboard.on_press_key('q', lambda _: stop_listener())
             listener.join()
-                
+
     except Exception as e:
         cprint(f"An error occurred: {str(e)}", "red")
     finally:
         cprint("Coordinate tracker stopped", "yellow")
 
+def main():
+    parser = argparse.ArgumentParser(description="Show click coordinates, save and locate screen templates")
+    parser.add_argument("--save", metavar="NAME", help="Save the clicked area as template NAME")
+    parser.add_argument("--locate", metavar="NAME", help="Find template NAME on the current screen")
+    args = parser.parse_args()
+
+    if args.locate:
+        match = TemplateLocator().locate(args.locate)
+        if match is None:
+            cprint(f"Template '{args.locate}' not found on screen", "red")
+            return
+        scaled_x, scaled_y = scale_coordinates(match.x, match.y)
+        cprint(f"Found '{match.name}' at x={match.x}, y={match.y} (scaled x={scaled_x}, y={scaled_y}), "
+               f"score {match.score:.2f}, {match.elapsed_ms:.0f} ms{' (cached)' if match.cached else ''}", "green")
+        return
+    get_coordinates(args.save)
+
 if __name__ == "__main__":
-    get_coordinates()
+    main()
@@ -0,0 +1,368 @@
+# Offline benchmarks of the use_yourself agent loop with a scripted model and a fake screen
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from anthropic.types.beta import BetaMessage
+from termcolor import cprint
+
+from use_yourself import (ActionPolicy, ClientConfig, ComputerControlAPI, ComputerTool, ConversationHistory,
+                          FakeDisplayBackend, ImageBlobStore, Tracer, close_shared_clients)
+
+AGENT_DIR = Path(__file__).resolve().parent
+RESULTS_DIR = AGENT_DIR / "benchmark_results"
+
+# A scripted turn is the list of content blocks the fake model answers with
+Turn = List[Dict[str, Any]]
+
+def _jsonable(value: Any) -> Any:
+    """json.dumps fallback for SDK models in the message list"""
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return str(value)
+
+class ScriptedClient:
+    """
+    Stand-in for the AsyncAnthropic client used by ComputerControlAPI
+
+    Answers each request with the next scripted turn (a final text block once
+    the script is exhausted), after an optional simulated model latency.
+    Records the serialized size of every request.
+    """
+    def __init__(self, turns: List[Turn], latency: float = 0.0):
+        self.turns = list(turns)
+        self.latency = latency
+        self.request_bytes: List[int] = []
+        self.message_bytes: List[int] = []
+        self.beta = SimpleNamespace(messages=SimpleNamespace(
+            with_raw_response=SimpleNamespace(create=self._create)
+        ))
+
+    async def _create(self, **request) -> SimpleNamespace:
+        message = BetaMessage.model_validate(await self.reply(request))
+
+        async def parse() -> BetaMessage:
+            return message
+
+        return SimpleNamespace(headers={}, parse=parse)
+
+    async def reply(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Record the request size and return the next scripted message (as API JSON)"""
+        messages = json.dumps(request["messages"], default=_jsonable)
+        self.message_bytes.append(len(messages))
+        self.request_bytes.append(len(messages) + len(json.dumps(request["system"]))
+                                  + len(json.dumps(request["tools"])))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = self.turns.pop(0) if self.turns else [{"type": "text", "text": "Done."}]
+        content = [
+            {**block, "id": block.get("id") or f"toolu_{uuid.uuid4().hex[:12]}"} if block["type"] == "tool_use" else block
+            for block in content
+        ]
+        return {
+            "id": f"msg_{uuid.uuid4().hex[:12]}",
+            "type": "message",
+            "role": "assistant",
+            "model": request["model"],
+            "content": content,
+            "stop_reason": "tool_use" if any(block["type"] == "tool_use" for block in content) else "end_turn",
+            "usage": {
+                "input_tokens": sum(ConversationHistory.estimate_tokens(m) for m in request["messages"]),
+                "output_tokens": 20 * len(content),
+            },
+        }
+
+class FakeMessagesServer:
+    """
+    Local HTTP server answering POST /v1/messages with a ScriptedClient's turns
+    
+    Lets a ComputerControlAPI use the real shared SDK client (ClientConfig
+    base_url) without network access, so the HTTP transport, connection
+    pooling and rate limit headers are part of the measurement. Only plain
+    (non-streaming) requests are supported.
+    """
+    def __init__(self, script: ScriptedClient):
+        self.script = script
+        self.requests = 0
+        self.connections = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._handlers: Set[asyncio.Task] = set()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def __aenter__(self) -> "FakeMessagesServer":
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._server.close()
+        # Keep-alive connections of the client are still open; end their handlers too
+        for handler in self._handlers:
+            handler.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve keep-alive HTTP/1.1 requests on one connection"""
+        self.connections += 1
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                method, path = request_line.decode("latin-1").split()[:2]
+                if method == "POST" and path.split("?")[0] == "/v1/messages":
+                    self.requests += 1
+                    status, payload = "200 OK", await self.script.reply(json.loads(body))
+                else:
+                    status, payload = "404 Not Found", {"type": "error", "error": {"type": "not_found_error",
+                                                                                  "message": path}}
+                data = json.dumps(payload).encode()
+                writer.write((f"HTTP/1.1 {status}\r\ncontent-type: application/json\r\n"
+                              f"content-length: {len(data)}\r\n"
+                              "anthropic-ratelimit-requests-remaining: 1000\r\n\r\n").encode() + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+def _computer(action: str, **kwargs) -> Dict[str, Any]:
+    return {"type": "tool_use", "name": "computer", "input": {"action": action, **kwargs}}
+
+def _edit(command: str, **kwargs) -> Dict[str, Any]:
+    return {"type": "tool_use", "name": "str_replace_editor", "input": {"command": command, **kwargs}}
+
+def _text(text: str) -> Dict[str, Any]:
+    return {"type": "text", "text": text}
+
+def short_session(workdir: Path) -> List[Turn]:
+    """A few click and type turns, like a single chat message"""
+    return [
+        [_text("Taking a screenshot first."), _computer("screenshot")],
+        [_computer("mouse_move", coordinate=[490, 500]), _computer("left_click")],
+        [_computer("type", text="Write a hello world script"), _computer("key", text="enter")],
+        [_text("Checking the result."), _computer("screenshot")],
+    ]
+
+def long_session(workdir: Path, steps: int = 200) -> List[Turn]:
+    """steps single-action turns cycling through pointer and text actions"""
+    turns = []
+    for step in range(steps):
+        x, y = 40 + (step * 37) % 1200, 40 + (step * 53) % 720
+        kind = step % 4
+        if kind == 0:
+            turns.append([_text(f"Step {step}: moving."), _computer("mouse_move", coordinate=[x, y])])
+        elif kind == 1:
+            turns.append([_computer("left_click")])
+        elif kind == 2:
+            turns.append([_computer("type", text=f"benchmark text {step}")])
+        else:
+            turns.append([_computer("screenshot")])
+    return turns
+
+def big_file_edits(workdir: Path, lines: int = 50_000, edits: int = 50) -> List[Turn]:
+    """Views and edits of a large file through the edit tool"""
+    path = workdir / "big_file.py"
+    path.write_text("".join(f"value_{i} = {i}  # generated line\n" for i in range(lines)), encoding="utf-8")
+    turns: List[Turn] = [[_edit("view", path=str(path), view_range=[1, 100])]]
+    for edit in range(edits):
+        line = (edit * 997) % lines
+        turns.append([_edit("view", path=str(path), view_range=[line + 1, line + 40])])
+        turns.append([_edit("str_replace", path=str(path),
+                            old_str=f"value_{line} = {line}  #", new_str=f"value_{line} = {line * 2}  #")])
+        if edit % 10 == 0:
+            turns.append([_edit("insert", path=str(path), insert_line=line, new_str=f"# note {edit}")])
+    turns.append([_edit("view", path=str(path), view_range=[1, 100])])
+    return turns
+
+def parallel_views(workdir: Path, files: int = 8, lines: int = 200_000, turns: int = 5) -> List[Turn]:
+    """Turns that view several large files at once (dispatched concurrently)"""
+    paths = []
+    for number in range(files):
+        path = workdir / f"module_{number}.py"
+        path.write_text("".join(f"item_{i} = {i}\n" for i in range(lines)), encoding="utf-8")
+        paths.append(path)
+    return [
+        [_edit("view", path=str(path), view_range=[turn * 1000 + 1, turn * 1000 + 50]) for path in paths]
+        for turn in range(turns)
+    ]
+
+SCENARIOS: Dict[str, Callable[[Path], List[Turn]]] = {
+    "short_session": short_session,
+    "long_session": long_session,
+    "big_file_edits": big_file_edits,
+    "parallel_views": parallel_views,
+}
+
+@dataclass
+class BenchmarkResult:
+    """Measurements of one scenario run"""
+    scenario: str
+    turns: int
+    steps: int
+    wall_s: float
+    step_overhead_ms: float
+    peak_messages_bytes: int
+    avg_request_bytes: float
+    max_request_bytes: int
+    total_request_bytes: int
+    peak_memory_bytes: Optional[int] = None
+    phases: Dict[str, Dict[str, float]] = field(default_factory=dict)
+
+async def run_scenario(name: str, model_latency: float = 0.0, settle: bool = False,
+                       trace_memory: bool = False, verbose: bool = False, blob_store: bool = False,
+                       http: bool = False) -> BenchmarkResult:
+    """
+    Run one scenario end to end through ComputerControlAPI._run_turn
+    
+    With http, requests go through the real SDK client to a FakeMessagesServer.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        turns = SCENARIOS[name](Path(workdir))
+        client = ScriptedClient(turns, latency=model_latency)
+        async with contextlib.AsyncExitStack() as stack:
+            config = None
+            if http:
+                server = await stack.enter_async_context(FakeMessagesServer(client))
+                config = ClientConfig(base_url=server.url, max_retries=0)
+            tool = ComputerTool(backend=FakeDisplayBackend(), adaptive_settle=settle, action_policy=ActionPolicy(wait=None))
+            tool._screenshot_delay = 0.0
+            api = ComputerControlAPI(api_key="benchmark", computer_tool=tool, tool_call_delay=0.0, tracer=Tracer(),
+                                     client_config=config,
+                                     blob_store=ImageBlobStore(Path(workdir) / "blobs") if blob_store else None)
+            if not http:
+                api.client = client
+            log = cprint if verbose else (lambda *args, **kwargs: None)
+            messages: List[Any] = [{"role": "user", "content": [{"type": "text", "text": f"Benchmark {name}"}]}]
+
+            if trace_memory:
+                tracemalloc.start()
+            steps = 0
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+                while True:
+                    response, tool_calls, tool_results = await api._run_turn(messages, log)
+                    messages.append({"role": "assistant", "content": response.content})
+                    if not tool_calls:
+                        break
+                    steps += len(tool_calls)
+                    messages.append({"role": "user", "content": tool_results})
+            wall = time.perf_counter() - start
+            peak_memory = None
+            if trace_memory:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+    model_time = model_latency * len(client.request_bytes)
+    return BenchmarkResult(
+        scenario=name,
+        turns=len(client.request_bytes),
+        steps=steps,
+        wall_s=round(wall, 3),
+        step_overhead_ms=round((wall - model_time) / max(steps, 1) * 1000, 2),
+        peak_messages_bytes=max(client.message_bytes),
+        avg_request_bytes=round(sum(client.request_bytes) / len(client.request_bytes), 1),
+        max_request_bytes=max(client.request_bytes),
+        total_request_bytes=sum(client.request_bytes),
+        peak_memory_bytes=peak_memory,
+        phases=api.tracer.summary(),
+    )
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]):
+    """Print the change of the headline numbers against a previous run"""
+    cprint(f"\nCompared with {previous['created']}:", "cyan")
+    for name, result in current["results"].items():
+        before = previous["results"].get(name)
+        if before is None:
+            continue
+        changes = []
+        for metric in ("wall_s", "step_overhead_ms", "peak_messages_bytes", "avg_request_bytes"):
+            if before.get(metric):
+                change = (result[metric] - before[metric]) / before[metric]
+                changes.append(f"{metric} {change:+.1%}")
+        print(f"  {name}: {', '.join(changes)}")
+
+def print_result(result: BenchmarkResult):
+    cprint(f"\n{result.scenario}", "green")
+    print(f"  turns={result.turns} steps={result.steps} wall={result.wall_s:.2f}s "
+          f"overhead/step={result.step_overhead_ms:.1f}ms")
+    print(f"  peak messages={result.peak_messages_bytes / 1024:.0f} KB "
+          f"request avg={result.avg_request_bytes / 1024:.0f} KB max={result.max_request_bytes / 1024:.0f} KB "
+          f"total={result.total_request_bytes / 1024 / 1024:.1f} MB")
+    if result.peak_memory_bytes is not None:
+        print(f"  peak traced memory={result.peak_memory_bytes / 1024 / 1024:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the agent loop (no API calls, no real screen)")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--model-latency", type=float, default=0.0, help="Simulated seconds per model request")
+    parser.add_argument("--settle", action="store_true", help="Use adaptive settle detection after actions")
+    parser.add_argument("--memory", action="store_true", help="Measure peak memory with tracemalloc (slower)")
+    parser.add_argument("--blob-store", action="store_true", help="Keep screenshots in an on-disk blob store")
+    parser.add_argument("--http", action="store_true",
+                        help="Send requests through the real SDK client to a local fake API server")
+    parser.add_argument("--output", type=Path, help="Where to save the results (default: benchmark_results/)")
+    parser.add_argument("--compare", type=Path, help="Results file to compare with (default: latest saved run)")
+    parser.add_argument("--verbose", action="store_true", help="Show the agent output")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    names = args.scenarios or list(SCENARIOS)
+
+    async def run() -> List[BenchmarkResult]:
+        try:
+            return [await run_scenario(name, args.model_latency, args.settle, args.memory, args.verbose,
+                                       args.blob_store, args.http)
+                    for name in names]
+        finally:
+            await close_shared_clients()
+
+    results = asyncio.run(run())
+    for result in results:
+        print_result(result)
+
+    previous_path = args.compare
+    if previous_path is None and RESULTS_DIR.exists():
+        saved = sorted(RESULTS_DIR.glob("*.json"))
+        previous_path = saved[-1] if saved else None
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "settings": {"model_latency": args.model_latency, "settle": args.settle, "blob_store": args.blob_store,
+                     "http": args.http, "python": sys.version.split()[0]},
+        "results": {result.scenario: asdict(result) for result in results},
+    }
+    output = args.output or RESULTS_DIR / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    cprint(f"\nSaved results to {output}", "cyan")
+    if previous_path is not None and previous_path.exists():
+        compare(report, json.loads(previous_path.read_text(encoding="utf-8")))
+
+if __name__ == "__main__":
+    main()
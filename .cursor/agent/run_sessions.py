@@ -0,0 +1,255 @@
+# Run several use_yourself sessions in parallel, each on its own (virtual) X display
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Literal, Optional
+
+from termcolor import cprint
+
+AGENT_DIR = Path(__file__).resolve().parent
+
+# Child process entry point: runs one job with the given keyword arguments and
+# exits with 1 unless the session finished (use_yourself reports errors instead of raising)
+CHILD_SCRIPT = (
+    "import asyncio, json, sys, use_yourself; "
+    "sys.exit(0 if asyncio.run(use_yourself.use_yourself(**json.loads(sys.argv[1]))) else 1)"
+)
+
+JobStatus = Literal["queued", "running", "done", "failed"]
+
+@dataclass(frozen=True)
+class SessionConfig:
+    """
+    One computer-use session bound to an X display
+
+    Each session runs its jobs in separate processes with DISPLAY set, so every
+    job gets its own ComputerTool with the resolution of that display.
+    """
+    display: str
+    width: int = 1920
+    height: int = 1080
+    target: str = "WXGA"
+    backend: str = "auto"
+    max_concurrent_jobs: int = 1
+    start_xvfb: bool = True
+
+@dataclass
+class Job:
+    """Instructions queued for any available session, with their progress"""
+    instructions: str
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+    status: JobStatus = "queued"
+    display: Optional[str] = None
+    returncode: Optional[int] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    output_tail: deque = field(default_factory=lambda: deque(maxlen=20))
+
+    @property
+    def duration(self) -> Optional[float]:
+        """Run time in seconds, once started"""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+class SessionOrchestrator:
+    """
+    Runs queued instructions across several concurrent sessions
+
+    Handles:
+    - Starting an Xvfb server per session (optional)
+    - A shared job queue consumed by all sessions
+    - Per-session concurrency limits
+    - Aggregate progress reporting
+    """
+    def __init__(self, sessions: List[SessionConfig], wait_time: Optional[float] = None,
+                 stream: bool = False, python: str = sys.executable,
+                 progress_interval: float = 10.0,
+                 on_progress: Optional[Callable[[Dict[str, int]], None]] = None):
+        if not sessions:
+            raise ValueError("At least one session is required")
+        self.sessions = sessions
+        self.wait_time = wait_time
+        self.stream = stream
+        self.python = python
+        self.progress_interval = progress_interval
+        self.on_progress = on_progress
+        self.jobs: List[Job] = []
+        self._queue: asyncio.Queue[Job] = asyncio.Queue()
+        self._xvfb: Dict[str, asyncio.subprocess.Process] = {}
+
+    def submit(self, instructions: str) -> Job:
+        """Queue instructions for the next free session"""
+        job = Job(instructions=instructions)
+        self.jobs.append(job)
+        self._queue.put_nowait(job)
+        return job
+
+    def progress(self) -> Dict[str, int]:
+        """Number of jobs per status"""
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        for job in self.jobs:
+            counts[job.status] += 1
+        return counts
+
+    async def run(self) -> List[Job]:
+        """Process the queue with all sessions until it is empty and return the jobs"""
+        workers: List[asyncio.Task] = []
+        reporter = asyncio.create_task(self._report_progress())
+        try:
+            for session in self.sessions:
+                if session.start_xvfb:
+                    await self._start_xvfb(session)
+                workers.extend(
+                    asyncio.create_task(self._worker(session))
+                    for _ in range(session.max_concurrent_jobs)
+                )
+            await self._queue.join()
+        finally:
+            for task in workers + [reporter]:
+                task.cancel()
+            await asyncio.gather(*workers, reporter, return_exceptions=True)
+            await self._stop_xvfb()
+        self._print_progress()
+        return self.jobs
+
+    async def _worker(self, session: SessionConfig):
+        """Take jobs from the shared queue and run them on session's display"""
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run_job(session, job)
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, session: SessionConfig, job: Job):
+        """Run one job in a child process bound to the session display"""
+        job.status = "running"
+        job.display = session.display
+        job.started_at = time.time()
+        cprint(f"[{session.display}] Starting job {job.job_id}", "cyan")
+        arguments = {
+            "instructions": job.instructions,
+            "wait_time": self.wait_time,
+            "stream": self.stream,
+            "target": session.target,
+            "backend": session.backend,
+        }
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.python, "-c", CHILD_SCRIPT, json.dumps(arguments),
+                cwd=AGENT_DIR,
+                env={**os.environ, "DISPLAY": session.display, "PYTHONUNBUFFERED": "1"},
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+            try:
+                async for line in process.stdout:
+                    text = line.decode(errors="replace").rstrip()
+                    job.output_tail.append(text)
+                    if text:
+                        print(f"[{session.display} {job.job_id}] {text}")
+                job.returncode = await process.wait()
+            except asyncio.CancelledError:
+                process.terminate()
+                raise
+            job.status = "done" if job.returncode == 0 else "failed"
+        except OSError as e:
+            job.output_tail.append(str(e))
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+        color = "green" if job.status == "done" else "red"
+        cprint(f"[{session.display}] Job {job.job_id} {job.status} in {job.duration:.1f}s", color)
+
+    async def _start_xvfb(self, session: SessionConfig):
+        """Start a virtual X server for session and wait until it accepts connections"""
+        if shutil.which("Xvfb") is None:
+            raise RuntimeError("Xvfb not found; install it or use start_xvfb=False with an existing display")
+        process = await asyncio.create_subprocess_exec(
+            "Xvfb", session.display, "-screen", "0", f"{session.width}x{session.height}x24", "-nolisten", "tcp",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        self._xvfb[session.display] = process
+        socket_path = Path(f"/tmp/.X11-unix/X{session.display.lstrip(':').split('.')[0]}")
+        for _ in range(50):
+            if socket_path.exists():
+                cprint(f"Started Xvfb on {session.display} ({session.width}x{session.height})", "cyan")
+                return
+            if process.returncode is not None:
+                break
+            await asyncio.sleep(0.1)
+        raise RuntimeError(f"Xvfb did not start on {session.display}")
+
+    async def _stop_xvfb(self):
+        """Terminate the virtual X servers started by this orchestrator"""
+        for process in self._xvfb.values():
+            if process.returncode is None:
+                process.terminate()
+                await process.wait()
+        self._xvfb.clear()
+
+    async def _report_progress(self):
+        """Periodically print aggregate progress"""
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self._print_progress()
+
+    def _print_progress(self):
+        """Print (and forward) the current job counts"""
+        counts = self.progress()
+        cprint(
+            f"Progress: {counts['done']} done, {counts['failed']} failed, "
+            f"{counts['running']} running, {counts['queued']} queued",
+            "blue",
+        )
+        if self.on_progress:
+            self.on_progress(counts)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run use_yourself jobs on several displays in parallel")
+    parser.add_argument("instructions", nargs="*", help="Instructions, one job each")
+    parser.add_argument("--jobs-file", type=Path, help="File with one instruction per line")
+    parser.add_argument("--displays", nargs="+", default=[":1", ":2"], help="X displays, one session each")
+    parser.add_argument("--resolution", default="1920x1080", help="Screen size of started Xvfb servers")
+    parser.add_argument("--target", default="WXGA", help="Virtual resolution used by the model")
+    parser.add_argument("--backend", default="auto", help="Display backend: auto, mss, pyautogui or fake")
+    parser.add_argument("--jobs-per-session", type=int, default=1, help="Concurrent jobs per display")
+    parser.add_argument("--no-xvfb", action="store_true", help="Use already running displays")
+    parser.add_argument("--wait-time", type=float, default=None, help="Delay before each action")
+    parser.add_argument("--stream", action="store_true", help="Stream model responses")
+    args = parser.parse_args()
+
+    instructions = list(args.instructions)
+    if args.jobs_file:
+        instructions += [line.strip() for line in args.jobs_file.read_text().splitlines() if line.strip()]
+    if not instructions:
+        parser.error("no instructions given")
+
+    width, height = (int(value) for value in args.resolution.lower().split("x"))
+    sessions = [
+        SessionConfig(display=display, width=width, height=height, target=args.target, backend=args.backend,
+                      max_concurrent_jobs=args.jobs_per_session, start_xvfb=not args.no_xvfb)
+        for display in args.displays
+    ]
+
+    async def run():
+        orchestrator = SessionOrchestrator(sessions, wait_time=args.wait_time, stream=args.stream)
+        for text in instructions:
+            orchestrator.submit(text)
+        jobs = await orchestrator.run()
+        return all(job.status == "done" for job in jobs)
+
+    sys.exit(0 if asyncio.run(run()) else 1)
+
+if __name__ == "__main__":
+    main()
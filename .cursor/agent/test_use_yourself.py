@@ -0,0 +1,108 @@
+"""Regression tests for the computer-use agent (run with: python -m pytest .cursor/agent)"""
+import asyncio
+import copy
+
+import pytest
+
+import use_yourself
+from use_yourself import ComputerTool, ConversationHistory, EditTool, FakeDisplayBackend, TurnCache
+
+
+def _numbered_file(tmp_path, count: int):
+    path = tmp_path / "numbers.txt"
+    path.write_text("".join(f"line {i}\n" for i in range(1, count + 1)), encoding="utf-8")
+    return path
+
+
+def test_edit_deleting_last_lines_reports_existing_lines(tmp_path):
+    path = _numbered_file(tmp_path, 32)
+    tool = EditTool()
+
+    output = tool.run("str_replace", str(path), old_str="line 32\n", new_str="").output
+
+    assert "lines removed at the end of the file" in output
+    assert "file now has 31 lines" in output
+    assert "line 32" not in output
+    assert "view_range" not in output
+    # The reported lines can be viewed
+    assert "line 31" in tool.run("view", str(path), view_range=[27, 31]).output
+
+
+def test_edit_in_the_middle_reports_changed_line(tmp_path):
+    path = _numbered_file(tmp_path, 10)
+
+    output = EditTool().run("str_replace", str(path), old_str="line 5\n", new_str="five\n").output
+
+    assert "line 5 changed" in output
+
+
+def test_requested_keyframe_is_sent_for_unchanged_screen():
+    tool = ComputerTool(backend=FakeDisplayBackend(), delta_mode=True, adaptive_settle=False)
+
+    async def verify():
+        return await tool._take_screenshot(verification=True)
+
+    assert asyncio.run(verify()).base64_image
+    assert "unchanged" in asyncio.run(verify()).output
+    tool.request_keyframe()
+    assert asyncio.run(verify()).base64_image
+
+
+def _turn(step: int, screenshot: list):
+    tool_use = {"type": "tool_use", "id": f"toolu_{step}", "name": "computer", "input": {"action": "left_click"}}
+    tool_result = {"type": "tool_result", "tool_use_id": f"toolu_{step}", "content": screenshot}
+    return [{"role": "assistant", "content": [tool_use]}, {"role": "user", "content": [tool_result]}]
+
+
+def test_dropping_turns_keeps_the_keyframe_of_remaining_deltas():
+    image = {"type": "image", "source": {"type": "blob", "width": 1280, "height": 800}}
+    delta = [{"type": "text", "text": f"{ComputerTool.DELTA_PREFIX}: 1 changed region(s) since step 2."}, image]
+    messages = [{"role": "user", "content": "Do the task"}]
+    for step in range(1, 9):
+        messages += _turn(step, [image] if step == 2 else delta)
+    history = ConversationHistory(max_images=None, token_budget=5000, keep_recent_turns=2)
+
+    history.compact(messages)
+    first_compaction = history.turns_summarized
+    messages += _turn(9, delta)
+    history.compact(messages)
+
+    assert history.turns_summarized > first_compaction > 0
+
+    assert {"toolu_2", "toolu_9"} <= {block.get("id") for message in messages for block in message["content"]
+                                       if isinstance(block, dict)}
+    summary = messages[0]["content"][-1]["text"]
+    assert summary.count(ConversationHistory.SUMMARY_HEADER) == 1
+
+
+def test_turn_cache_key_does_not_change_with_compaction():
+    image = {"type": "image", "source": {"type": "blob", "width": 1280, "height": 800}}
+    messages = [{"role": "user", "content": "Do the task"}]
+    for step in range(1, 9):
+        messages += _turn(step, [image])
+    compacted = copy.deepcopy(messages)
+    history = ConversationHistory(max_images=None, token_budget=5000, keep_recent_turns=2)
+
+    history.compact(compacted)
+
+    assert history.turns_summarized
+    assert TurnCache.key(compacted, history.dropped_actions) == TurnCache.key(messages)
+
+
+def test_pasted_text_presses_enter_for_every_newline():
+    backend = FakeDisplayBackend()
+    tool = ComputerTool(backend=backend, paste_threshold=40)
+
+    tool._type("first line of a long message\nsecond line of it\n")
+
+    assert backend.events[-4:] == [("paste", "first line of a long message"), ("key", "enter"),
+                                   ("paste", "second line of it"), ("key", "enter")]
+
+
+def test_deprecated_wait_before_action_sets_the_default_policy(monkeypatch):
+    monkeypatch.setattr(use_yourself, "WAIT_BEFORE_ACTION", 1.5)
+
+    with pytest.warns(DeprecationWarning):
+        tool = ComputerTool(backend=FakeDisplayBackend())
+
+    assert tool.action_policy.wait == 1.5
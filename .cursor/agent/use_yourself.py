@@ -1,33 +1,101 @@
 # Import necessary libraries for async operations, data handling, GUI automation, and system interaction
+from __future__ import annotations
+
+import abc
 import asyncio
 import base64
+import contextvars
+import hashlib
+import importlib
+import json
+import mmap
 import os
-from dataclasses import dataclass, fields, replace
+import threading
+import time
+import warnings
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields, replace
 from enum import StrEnum
 from pathlib import Path
-from typing import Any, Literal, Optional, TypedDict, List, Dict, cast
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Literal, Optional, TypedDict, List, Dict, cast
 from datetime import datetime
-import anthropic
-from anthropic.types import MessageParam
-import pyautogui
 from io import BytesIO
-import keyboard
-from PIL import Image
 import platform
 from termcolor import cprint
 
+if TYPE_CHECKING:
+    from anthropic.types import MessageParam
+
+class _LazyModule:
+    """
+    Module imported on first attribute access
+
+    anthropic, numpy and PIL take most of the import time of this file, and
+    pyautogui and keyboard probe the display and input devices when imported.
+    Keeping them behind this proxy lets callers that only need the edit tool
+    or the helper types import use_yourself without paying for (or failing on)
+    them. `configure` runs once, right after the real import.
+    """
+    def __init__(self, name: str, configure: Optional[Callable[[Any], None]] = None):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_configure", configure)
+        object.__setattr__(self, "_module", None)
+
+    def _load(self) -> Any:
+        module = self._module
+        if module is None:
+            module = importlib.import_module(self._name)
+            if self._configure is not None:
+                self._configure(module)
+            object.__setattr__(self, "_module", module)
+        return module
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self._load(), name, value)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+def _configure_pyautogui(module: Any):
+    """PyAutoGUI safety features, applied as soon as it is imported"""
+    module.FAILSAFE = True  # Enables fail-safe corner movement to stop execution
+    module.PAUSE = 0.1  # Sets minimum delay between actions
+
+anthropic = _LazyModule("anthropic")
+pyautogui = _LazyModule("pyautogui", _configure_pyautogui)
+keyboard = _LazyModule("keyboard")
+np = _LazyModule("numpy")
+Image = _LazyModule("PIL.Image")
+ImageChops = _LazyModule("PIL.ImageChops")
+ImageDraw = _LazyModule("PIL.ImageDraw")
+
+# Fallback coordinates of the Cursor composer input box, used when its template
+# (saved with `python get_cordinates.py --save composer`) is not found on screen
 COORDINATES = "x=736, y=673"
+INPUT_TEMPLATE = "composer"
 
-# Display warning message about script safety
-print("""NOTE: Please be very careful running this script!! this runs locally on your machine(NO SANDBOX) There is an artificial delay in script before each action so you can review them(default 5 seconds). KEEP A WATCHFUL EYE ON IT! AND STOP THE SCRIPT DURING WAIT TIME IF IT TRIES TO DO SOMETHING YOU DONT WANT. BY RUNNING THIS SCRIPT YOU ASSUME THE RESPONSIBILITY OF THE OUTCOMES""")
+# Shown when a session (or the daemon) starts
+SAFETY_NOTICE = """NOTE: Please be very careful running this script!! this runs locally on your machine(NO SANDBOX) 
+        There is an artificial delay in script before each action so you can review them. 
+        KEEP A WATCHFUL EYE ON IT! AND STOP THE SCRIPT DURING WAIT TIME IF IT TRIES TO DO SOMETHING YOU DONT WANT. 
+        BY RUNNING THIS SCRIPT YOU ASSUME THE RESPONSIBILITY OF THE OUTCOMES"""
 
-# Global configuration for action confirmation delay
-# Can be disabled by setting to None, or adjusted to different duration in seconds
-WAIT_BEFORE_ACTION: Optional[float] = 5.0
+# Default review delay (seconds) before risky actions, see ActionPolicy
+DEFAULT_WAIT_BEFORE_ACTION: Optional[float] = 5.0
+# Deprecated: pass ActionPolicy(wait=...) or use_yourself(wait_time=...) instead. Still used as the
+# wait of a ComputerTool created without an action_policy, for callers that set it
+WAIT_BEFORE_ACTION: Optional[float] = DEFAULT_WAIT_BEFORE_ACTION
 
-# Configure PyAutoGUI safety features
-pyautogui.FAILSAFE = True  # Enables fail-safe corner movement to stop execution
-pyautogui.PAUSE = 0.1  # Sets minimum delay between actions
+# Cumulative import time of this module (ms) allowed by `--check-startup`
+STARTUP_BUDGET_MS = 150.0
 
 # Define core type literals for actions and commands
 # Actions represent physical interactions with the computer
@@ -44,6 +112,101 @@ Action = Literal[
     "cursor_position",  # Get cursor coordinates
 ]
 
+# Input actions that can be combined into a single computer_batch call
+BATCH_ACTIONS = (
+    "key", "type", "mouse_move", "left_click", "left_click_drag",
+    "right_click", "middle_click", "double_click",
+)
+
+class ScreenshotPolicy(StrEnum):
+    """When ComputerTool captures verification screenshots"""
+    ALWAYS = "always"  # After every action and at the end of every batch
+    END_OF_BATCH = "end_of_batch"  # Only at the end of batches
+    ON_REQUEST = "on_request"  # Only for explicit screenshot actions or requests
+
+class ActionRisk(StrEnum):
+    """Risk class of a computer action, from harmless to irreversible"""
+    READ_ONLY = "read_only"  # screenshot, cursor_position
+    POINTER = "pointer"  # Mouse moves, clicks and drags
+    TEXT_ENTRY = "text_entry"  # Typing and key combinations
+    SUBMIT = "submit"  # Enter/Return keys and text containing a newline
+
+RISK_ORDER = list(ActionRisk)
+SUBMIT_KEYS = ("enter", "return", "kp_enter")
+
+@dataclass
+class ActionPolicy:
+    """
+    Per-session rules for reviewing computer actions before they run
+    
+    Actions of the classes in `gated` wait `wait` seconds so the user can
+    review them (Ctrl+C aborts); other classes run immediately. For classes in
+    `keypress_confirm`, pressing `confirm_key` ends the wait at once.
+    """
+    wait: Optional[float] = DEFAULT_WAIT_BEFORE_ACTION
+    gated: frozenset[ActionRisk] = frozenset({ActionRisk.POINTER, ActionRisk.TEXT_ENTRY, ActionRisk.SUBMIT})
+    keypress_confirm: frozenset[ActionRisk] = frozenset()
+    confirm_key: str = "space"
+
+    @staticmethod
+    def classify(action: str, text: Optional[str] = None) -> ActionRisk:
+        """Risk class of a single action"""
+        if action in ("screenshot", "cursor_position"):
+            return ActionRisk.READ_ONLY
+        if action == "key":
+            keys = (text or "").lower().replace(" ", "").split("+")
+            return ActionRisk.SUBMIT if keys[-1] in SUBMIT_KEYS else ActionRisk.TEXT_ENTRY
+        if action == "type":
+            # Any newline is typed as Enter, which can submit a form or run a command mid-text
+            return ActionRisk.SUBMIT if "\n" in (text or "") else ActionRisk.TEXT_ENTRY
+        return ActionRisk.POINTER
+
+    @classmethod
+    def classify_all(cls, actions: List[tuple[str, Optional[str]]]) -> ActionRisk:
+        """Highest risk class of several actions (a batch)"""
+        return max((cls.classify(action, text) for action, text in actions), key=RISK_ORDER.index)
+
+    async def confirm(self, risk: ActionRisk) -> bool:
+        """
+        Wait before an action of class risk if it is gated
+        
+        Returns True if the wait was ended early by the confirmation key.
+        """
+        if not self.wait or risk not in self.gated:
+            return False
+        if risk not in self.keypress_confirm:
+            print(f"Waiting {self.wait} seconds before executing {risk} action. Press Ctrl+C to abort...")
+            await asyncio.sleep(self.wait)
+            return False
+
+        loop = asyncio.get_running_loop()
+        confirmed = asyncio.Event()
+        try:
+            hook = keyboard.on_press_key(self.confirm_key, lambda _: loop.call_soon_threadsafe(confirmed.set))
+        except Exception as e:  # keyboard hooks need extra permissions on some systems
+            print(f"Key confirmation unavailable ({str(e)}); waiting {self.wait} seconds...")
+            await asyncio.sleep(self.wait)
+            return False
+        print(f"Waiting {self.wait} seconds before executing {risk} action. "
+              f"Press {self.confirm_key} to run it now, Ctrl+C to abort...")
+        try:
+            await asyncio.wait_for(confirmed.wait(), self.wait)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            keyboard.unhook(hook)
+
+    def describe(self) -> str:
+        """One-line description of the policy"""
+        if not self.wait or not self.gated:
+            return "No wait"
+        gated = ", ".join(risk for risk in ActionRisk if risk in self.gated)
+        text = f"{self.wait}s before {gated} actions"
+        if self.keypress_confirm:
+            text += f" ({self.confirm_key} confirms {', '.join(risk for risk in ActionRisk if risk in self.keypress_confirm)})"
+        return text
+
 # Commands represent file operations
 Command = Literal[
     "view",  # View file contents
@@ -65,6 +228,16 @@ MAX_SCALING_TARGETS: dict[str, Resolution] = {
     "FWXGA": Resolution(width=1366, height=768),  # Widescreen ~16:9
 }
 
+# Screenshot encodings and resampling filters supported by ScreenshotEncoder
+ImageFormat = Literal[
+    "png",  # Optimized PNG (smallest lossless, the default)
+    "png_fast",  # Lowest zlib level: faster to encode, larger to send
+    "jpeg",  # Lossy, quality controlled
+    "webp",  # Lossy, quality controlled
+]
+
+ResampleFilter = Literal["nearest", "box", "bilinear", "hamming", "bicubic", "lanczos"]
+
 @dataclass(frozen=True)
 class ToolResult:
     """
@@ -73,7 +246,8 @@ class ToolResult:
     This immutable dataclass encapsulates various types of output that can be produced:
     - text output (output)
     - error messages (error) 
-    - image data (base64_image)
+    - image data (base64_image) and its media type (media_type)
+    - changed screen regions of a delta screenshot (regions)
     - system messages (system)
     
     The class supports boolean evaluation and field replacement.
@@ -82,6 +256,8 @@ class ToolResult:
     error: Optional[str] = None
     base64_image: Optional[str] = None
     system: Optional[str] = None
+    media_type: Optional[str] = None
+    regions: Optional[tuple["FrameRegion", ...]] = None
 
     def __bool__(self):
         """Returns True if any field has a non-None value"""
@@ -97,6 +273,682 @@ class ToolError(Exception):
         self.message = message
         super().__init__(message)
 
+@dataclass(frozen=True)
+class FrameFingerprint:
+    """
+    Compact fingerprint of a captured frame
+    
+    Holds an exact digest of the frame pixels and a grayscale block-mean
+    thumbnail used for near-duplicate detection.
+    """
+    digest: str
+    thumbnail: bytes
+    grid: tuple[int, int]
+
+class FrameHasher:
+    """
+    Detects identical or nearly identical screenshots
+    
+    Frames are reduced to a small grid of grayscale block means. Two frames
+    are considered the same when their exact digests match, or when no more
+    than `max_changed_blocks` blocks differ by more than `block_tolerance`
+    gray levels. The default grid (128x80 blocks of 10x10 px at WXGA) is fine
+    enough that a single typed character changes at least one block.
+    """
+    def __init__(self, grid: tuple[int, int] = (128, 80), block_tolerance: int = 12,
+                 max_changed_blocks: int = 0):
+        self.grid = grid
+        self.block_tolerance = block_tolerance
+        self.max_changed_blocks = max_changed_blocks
+        # Lookup table that maps per-block differences to changed (255) / unchanged (0)
+        self._threshold_lut = [255 if value > block_tolerance else 0 for value in range(256)]
+
+    def fingerprint(self, image: Image.Image) -> FrameFingerprint:
+        """Compute the fingerprint of a frame"""
+        digest = hashlib.blake2b(image.tobytes(), digest_size=16).hexdigest()
+        thumbnail = image.convert("L").resize(self.grid, Image.Resampling.BOX)
+        return FrameFingerprint(digest=digest, thumbnail=thumbnail.tobytes(), grid=self.grid)
+
+    def is_similar(self, first: FrameFingerprint, second: FrameFingerprint) -> bool:
+        """Return True if two fingerprints describe the same (or nearly the same) frame"""
+        if first.digest == second.digest:
+            return True
+        if first.grid != second.grid:
+            return False
+        diff = ImageChops.difference(
+            Image.frombytes("L", first.grid, first.thumbnail),
+            Image.frombytes("L", second.grid, second.thumbnail),
+        )
+        changed_blocks = diff.point(self._threshold_lut).histogram()[255]
+        return changed_blocks <= self.max_changed_blocks
+
+@dataclass(frozen=True)
+class ScreenshotEncoder:
+    """
+    Configurable resize and encode stage for screenshots
+    
+    Supports:
+    - png: optimized PNG, the smallest lossless encoding (default)
+    - png_fast: PNG at the lowest zlib level; encodes about 2-3x faster but
+      is several times larger, so it only pays off when the model is reached
+      over a fast link and encode time dominates the step
+    - jpeg / webp: lossy encodings at the given quality (1-100)
+    
+    The resampling filter is used when scaling frames to the virtual resolution.
+    Both steps are CPU bound and are run off the event loop by ComputerTool.
+    """
+    format: ImageFormat = "png"
+    quality: int = 80
+    resample: ResampleFilter = "lanczos"
+
+    @property
+    def media_type(self) -> str:
+        """MIME type of the encoded images"""
+        return {
+            "png": "image/png",
+            "png_fast": "image/png",
+            "jpeg": "image/jpeg",
+            "webp": "image/webp",
+        }[self.format]
+
+    def resize(self, image: Image.Image, size: tuple[int, int]) -> Image.Image:
+        """Scale image to size with the configured resampling filter"""
+        if image.size == size:
+            return image
+        return image.resize(size, Image.Resampling[self.resample.upper()])
+
+    def encode(self, image: Image.Image) -> bytes:
+        """Encode image in the configured format"""
+        buffered = BytesIO()
+        if self.format == "png":
+            image.save(buffered, format="PNG", optimize=True)
+        elif self.format == "png_fast":
+            image.save(buffered, format="PNG", compress_level=1)
+        elif self.format == "jpeg":
+            image.convert("RGB").save(buffered, format="JPEG", quality=self.quality)
+        elif self.format == "webp":
+            image.save(buffered, format="WEBP", quality=self.quality)
+        else:
+            raise ToolError(f"Unsupported screenshot format: {self.format}")
+        return buffered.getvalue()
+
+@dataclass(frozen=True)
+class FrameRegion:
+    """Cropped changed area of a delta screenshot, positioned in virtual (WXGA) coordinates"""
+    x: int
+    y: int
+    width: int
+    height: int
+    base64_image: str
+    media_type: str
+
+class FrameRingBuffer:
+    """
+    Memory-bounded ring buffer of recent frames stored as NumPy arrays
+    
+    Frames are evicted oldest first once either `max_frames` or `max_bytes`
+    is exceeded; the most recent frame is always kept.
+    """
+    def __init__(self, max_frames: int = 4, max_bytes: int = 64 * 1024 * 1024):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._frames: deque[tuple[int, np.ndarray]] = deque()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def push(self, step: int, frame: np.ndarray):
+        """Add a frame captured at step, evicting old frames over the limits"""
+        self._frames.append((step, frame))
+        self.nbytes += frame.nbytes
+        while len(self._frames) > 1 and (len(self._frames) > self.max_frames or self.nbytes > self.max_bytes):
+            _, evicted = self._frames.popleft()
+            self.nbytes -= evicted.nbytes
+
+    def latest(self) -> Optional[tuple[int, np.ndarray]]:
+        """Return (step, frame) of the most recent frame, if any"""
+        return self._frames[-1] if self._frames else None
+
+    def clear(self):
+        """Drop all stored frames"""
+        self._frames.clear()
+        self.nbytes = 0
+
+def find_changed_regions(previous: np.ndarray, current: np.ndarray, block_size: int = 16,
+                         tolerance: int = 24, padding: int = 4,
+                         max_regions: int = 6) -> List[tuple[int, int, int, int]]:
+    """
+    Compute bounding boxes of the areas that differ between two frames
+    
+    Frames are compared per pixel (max channel difference), reduced to a grid of
+    block_size blocks, and adjacent changed blocks are grouped into boxes.
+    Boxes are returned as (left, top, right, bottom) pixel coordinates, padded
+    and clipped to the frame. When more than max_regions boxes are found they
+    are merged into their common bounding box.
+    """
+    height, width = current.shape[:2]
+    diff = np.abs(current.astype(np.int16) - previous.astype(np.int16))
+    if diff.ndim == 3:
+        diff = diff.max(axis=2)
+
+    rows, cols = -(-height // block_size), -(-width // block_size)
+    padded = np.zeros((rows * block_size, cols * block_size), dtype=diff.dtype)
+    padded[:height, :width] = diff
+    changed = padded.reshape(rows, block_size, cols, block_size).max(axis=(1, 3)) > tolerance
+
+    # Group changed blocks into 8-connected components
+    boxes = []
+    seen = np.zeros_like(changed)
+    for row, col in zip(*np.nonzero(changed)):
+        if seen[row, col]:
+            continue
+        seen[row, col] = True
+        stack = [(row, col)]
+        top, left, bottom, right = row, col, row, col
+        while stack:
+            r, c = stack.pop()
+            top, left, bottom, right = min(top, r), min(left, c), max(bottom, r), max(right, c)
+            for nr in range(max(r - 1, 0), min(r + 2, rows)):
+                for nc in range(max(c - 1, 0), min(c + 2, cols)):
+                    if changed[nr, nc] and not seen[nr, nc]:
+                        seen[nr, nc] = True
+                        stack.append((nr, nc))
+        boxes.append((
+            max(int(left) * block_size - padding, 0),
+            max(int(top) * block_size - padding, 0),
+            min((int(right) + 1) * block_size + padding, width),
+            min((int(bottom) + 1) * block_size + padding, height),
+        ))
+
+    if len(boxes) > max_regions:
+        boxes = [(
+            min(box[0] for box in boxes),
+            min(box[1] for box in boxes),
+            max(box[2] for box in boxes),
+            max(box[3] for box in boxes),
+        )]
+    return boxes
+
+def _percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank q-quantile of an ascending, non-empty list"""
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+@dataclass(frozen=True)
+class SettleResult:
+    """How long the screen took to settle after an action"""
+    action: str
+    settled: bool
+    elapsed_ms: float
+    samples: int
+
+class SettleDetector:
+    """
+    Waits until the screen stops changing after an action
+    
+    Frames are sampled every `interval` seconds and fingerprinted at
+    1/`reduce_factor` resolution in the capture thread. Once the screen has
+    changed, the wait ends when it has not changed for `stable_window`
+    seconds; a screen that has not changed since the first sample only needs
+    `static_window` seconds (by default one interval, i.e. two matching
+    frames), so actions without a visible effect cost little. The wait ends
+    after `timeout` seconds in any case. Each wait is recorded per action so
+    the parameters can be tuned from real sessions; set static_window to
+    stable_window for actions whose effect starts late.
+    """
+    def __init__(self, interval: float = 0.05, stable_window: float = 0.3, timeout: float = 5.0,
+                 reduce_factor: int = 8, hasher: Optional[FrameHasher] = None, history_size: int = 500,
+                 static_window: Optional[float] = None):
+        self.interval = interval
+        self.stable_window = stable_window
+        self.static_window = interval if static_window is None else static_window
+        self.timeout = timeout
+        self.reduce_factor = reduce_factor
+        self.hasher = hasher or FrameHasher(grid=(64, 40), block_tolerance=6)
+        self.records: deque[SettleResult] = deque(maxlen=history_size)
+
+    async def wait(self, grab: Callable[[], Image.Image], action: str) -> tuple[SettleResult, Image.Image]:
+        """
+        Sample frames with grab until the screen is stable
+        
+        Returns the settle record and the last full-resolution frame, which
+        callers can reuse instead of capturing the screen again.
+        """
+        def sample() -> tuple[Image.Image, FrameFingerprint]:
+            image = grab()
+            return image, self.hasher.fingerprint(image.reduce(self.reduce_factor))
+
+        start = time.perf_counter()
+        samples = 0
+        previous = None
+        changed = False
+        last_change = start
+        while True:
+            image, fingerprint = await asyncio.to_thread(sample)
+            samples += 1
+            now = time.perf_counter()
+            if previous is None:
+                last_change = now
+            elif not self.hasher.is_similar(previous, fingerprint):
+                changed = True
+                last_change = now
+            previous = fingerprint
+            window = self.stable_window if changed else self.static_window
+            settled = samples > 1 and now - last_change >= window
+            if settled or now - start >= self.timeout:
+                break
+            await asyncio.sleep(self.interval)
+        result = SettleResult(
+            action=action, settled=settled,
+            elapsed_ms=(time.perf_counter() - start) * 1000, samples=samples,
+        )
+        self.records.append(result)
+        return result, image
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Settle time statistics (count, mean, p95, max, timeouts) per action"""
+        by_action: Dict[str, List[SettleResult]] = {}
+        for record in self.records:
+            by_action.setdefault(record.action, []).append(record)
+        summary = {}
+        for action, records in by_action.items():
+            times = sorted(record.elapsed_ms for record in records)
+            summary[action] = {
+                "count": len(times),
+                "mean_ms": round(sum(times) / len(times), 1),
+                "p95_ms": round(_percentile(times, 0.95), 1),
+                "max_ms": round(times[-1], 1),
+                "timeouts": sum(1 for record in records if not record.settled),
+            }
+        return summary
+
+@dataclass(frozen=True)
+class FrameStats:
+    """Timing (milliseconds) and size (bytes) of one processed screenshot"""
+    step: int
+    format: str
+    capture_ms: float
+    resize_ms: float
+    encode_ms: float
+    encoded_bytes: int
+    skipped: bool = False
+
+@dataclass
+class Span:
+    """One timed phase of the agent loop"""
+    name: str
+    span_id: int
+    parent_id: Optional[int]
+    start: float
+    duration_ms: float = 0.0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+class Tracer:
+    """
+    Structured timing spans for the agent loop
+    
+    Spans nest per asyncio task (a tool call inside a turn gets the turn as
+    parent). Finished spans are kept in memory (at most `max_spans`) and, when
+    `path` is set, appended to a JSONL trace file as they complete.
+    `format_summary()` gives percentiles of the duration per phase.
+    """
+    def __init__(self, path: Optional[str | Path] = None, session_id: Optional[str] = None, max_spans: int = 20000):
+        self.path = Path(path) if path else None
+        self.session_id = session_id or datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.spans: deque[Span] = deque(maxlen=max_spans)
+        self._next_id = 0
+        self._current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+        self._file = None
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time the enclosed block; the yielded span's attributes can be extended inside it"""
+        parent = self._current.get()
+        self._next_id += 1
+        span = Span(name=name, span_id=self._next_id, parent_id=parent.span_id if parent else None,
+                    start=time.time(), attributes=attributes)
+        token = self._current.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.attributes["error"] = type(e).__name__
+            raise
+        finally:
+            span.duration_ms = (time.perf_counter() - start) * 1000
+            self._current.reset(token)
+            self._finish(span)
+
+    def record(self, name: str, duration_ms: float, **attributes):
+        """Add a span measured elsewhere (e.g. in a worker thread)"""
+        parent = self._current.get()
+        self._next_id += 1
+        self._finish(Span(name=name, span_id=self._next_id, parent_id=parent.span_id if parent else None,
+                          start=time.time() - duration_ms / 1000, duration_ms=duration_ms, attributes=attributes))
+
+    def _finish(self, span: Span):
+        self.spans.append(span)
+        if self.path is None:
+            return
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        record = {"session": self.session_id, "name": span.name, "span_id": span.span_id,
+                  "parent_id": span.parent_id, "start": round(span.start, 6),
+                  "duration_ms": round(span.duration_ms, 3), **span.attributes}
+        self._file.write(json.dumps(record, default=str) + "\n")
+        self._file.flush()
+
+    def close(self):
+        """Close the trace file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, total and percentiles (ms) of span durations per phase"""
+        durations: Dict[str, List[float]] = {}
+        for span in self.spans:
+            durations.setdefault(span.name, []).append(span.duration_ms)
+        result = {}
+        for name, values in durations.items():
+            values.sort()
+            result[name] = {"count": len(values), "total_s": round(sum(values) / 1000, 2),
+                            "p50": round(_percentile(values, 0.5), 1), "p90": round(_percentile(values, 0.9), 1),
+                            "p99": round(_percentile(values, 0.99), 1),
+                            "max": round(values[-1], 1)}
+        return result
+
+    def format_summary(self) -> str:
+        """Table of phase percentiles, slowest phases first"""
+        rows = sorted(self.summary().items(), key=lambda item: item[1]["total_s"], reverse=True)
+        lines = [f"{'phase':<16}{'count':>7}{'total s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for name, stats in rows:
+            lines.append(f"{name:<16}{stats['count']:>7}{stats['total_s']:>10.2f}{stats['p50']:>10.1f}"
+                         f"{stats['p90']:>10.1f}{stats['p99']:>10.1f}{stats['max']:>10.1f}")
+        return "\n".join(lines)
+
+class DisplayBackend(abc.ABC):
+    """
+    Screen capture and input primitives used by ComputerTool
+    
+    Subclasses implement `_grab` and the abstract input methods. Every capture is timed
+    so backends can be compared with `capture_summary()`.
+    """
+    name = "base"
+
+    def __init__(self, display: Optional[str] = None, latency_window: int = 200):
+        self.display = display
+        self.capture_ms: deque[float] = deque(maxlen=latency_window)
+
+    def grab(self) -> Image.Image:
+        """Capture the full screen (blocking) and record the latency"""
+        start = time.perf_counter()
+        image = self._grab()
+        self.capture_ms.append((time.perf_counter() - start) * 1000)
+        return image
+
+    def capture_summary(self) -> Dict[str, Any]:
+        """Capture count and latency percentiles in milliseconds"""
+        latencies = sorted(self.capture_ms)
+        if not latencies:
+            return {"backend": self.name, "captures": 0}
+        return {
+            "backend": self.name,
+            "captures": len(latencies),
+            "avg_ms": round(sum(latencies) / len(latencies), 2),
+            "p50_ms": round(_percentile(latencies, 0.5), 2),
+            "p95_ms": round(_percentile(latencies, 0.95), 2),
+        }
+
+    @abc.abstractmethod
+    def _grab(self) -> Image.Image:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def size(self) -> tuple[int, int]:
+        raise NotImplementedError
+
+    def set_pause(self, seconds: float):
+        """Delay applied after each input primitive"""
+
+    def close(self):
+        """Release capture resources (display connections); safe to call more than once"""
+
+    @abc.abstractmethod
+    def move(self, x: int, y: int):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def drag(self, x: int, y: int):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def click(self, button: str = "left"):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def double_click(self):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def key(self, keys: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def type_text(self, text: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def paste_text(self, text: str):
+        """Insert text at the focus in one step (e.g. through the clipboard)"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def read_focused_text(self) -> str:
+        """Text of the focused input field, used to verify pasted text"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def position(self) -> tuple[int, int]:
+        raise NotImplementedError
+
+class PyAutoGUIBackend(DisplayBackend):
+    """Capture and input through pyautogui (and `keyboard` for key combos)"""
+    name = "pyautogui"
+
+    def _grab(self) -> Image.Image:
+        return pyautogui.screenshot()
+
+    def size(self) -> tuple[int, int]:
+        width, height = pyautogui.size()
+        return width, height
+
+    def set_pause(self, seconds: float):
+        pyautogui.PAUSE = seconds
+
+    def move(self, x: int, y: int):
+        pyautogui.moveTo(x, y)
+
+    def drag(self, x: int, y: int):
+        pyautogui.dragTo(x, y, button='left')
+
+    def click(self, button: str = "left"):
+        pyautogui.click(button=button)
+
+    def double_click(self):
+        pyautogui.doubleClick()
+
+    def key(self, keys: str):
+        keyboard.send(keys)
+
+    def type_text(self, text: str):
+        pyautogui.write(text, interval=0.01)
+
+    @property
+    def _modifier(self) -> str:
+        return "command" if platform.system() == "Darwin" else "ctrl"
+
+    def paste_text(self, text: str):
+        """Paste text through the clipboard, restoring the previous clipboard content"""
+        import pyperclip
+        previous = pyperclip.paste()
+        pyperclip.copy(text)
+        try:
+            pyautogui.hotkey(self._modifier, "v")
+            time.sleep(0.05)  # the target reads the clipboard asynchronously
+        finally:
+            pyperclip.copy(previous)
+
+    def read_focused_text(self) -> str:
+        """Select and copy the focused field, then move the caret back to the end"""
+        import pyperclip
+        previous = pyperclip.paste()
+        try:
+            pyautogui.hotkey(self._modifier, "a")
+            pyautogui.hotkey(self._modifier, "c")
+            time.sleep(0.05)
+            return pyperclip.paste()
+        finally:
+            pyautogui.press("end")
+            pyperclip.copy(previous)
+
+    def position(self) -> tuple[int, int]:
+        x, y = pyautogui.position()
+        return x, y
+
+class MSSBackend(PyAutoGUIBackend):
+    """
+    Fast capture with MSS (XShm/XGetImage on Linux, BitBlt on Windows)
+    
+    Frames are grabbed straight into a BGRA buffer and wrapped without a
+    PNG round trip. Input still goes through pyautogui. Needs the `mss` package.
+    """
+    name = "mss"
+
+    def __init__(self, display: Optional[str] = None, latency_window: int = 200):
+        super().__init__(display, latency_window)
+        try:
+            import mss
+        except ImportError as e:
+            raise ToolError("The mss backend needs the mss package (pip install mss)") from e
+        self._mss = mss
+        # An MSS handle (an X connection on Linux) must stay on the thread that opened it, while
+        # captures are requested from arbitrary worker threads: one capture thread owns the only handle
+        self._capture_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mss-capture")
+        self._sct = None
+
+    def _on_capture_thread(self, fn: Callable[[Any], Any]) -> Any:
+        return self._capture_thread.submit(lambda: fn(self._screen())).result()
+
+    def _screen(self):
+        if self._sct is None:
+            kwargs = {"display": self.display} if self.display and platform.system() == "Linux" else {}
+            self._sct = self._mss.mss(**kwargs)
+        return self._sct
+
+    def _grab(self) -> Image.Image:
+        def grab(sct) -> Image.Image:
+            shot = sct.grab(sct.monitors[1])
+            return Image.frombuffer("RGB", shot.size, shot.bgra, "raw", "BGRX")
+        return self._on_capture_thread(grab)
+
+    def size(self) -> tuple[int, int]:
+        monitor = self._on_capture_thread(lambda sct: sct.monitors[1])
+        return monitor["width"], monitor["height"]
+
+    def close(self):
+        def close_handle():
+            if self._sct is not None:
+                self._sct.close()
+                self._sct = None
+        try:
+            self._capture_thread.submit(close_handle).result()
+        except RuntimeError:
+            return  # already closed
+        self._capture_thread.shutdown()
+
+class FakeDisplayBackend(DisplayBackend):
+    """
+    In-memory screen for tests and benchmarks
+    
+    Input is recorded in `events` and drawn onto the screen image (a dot for
+    clicks, the text for typing) so consecutive frames differ like a real UI.
+    """
+    name = "fake"
+
+    def __init__(self, display: Optional[str] = None, latency_window: int = 200,
+                 screen_size: tuple[int, int] = (1920, 1080), image: Optional[Image.Image] = None):
+        super().__init__(display, latency_window)
+        self.image = image.convert("RGB") if image is not None else Image.new("RGB", screen_size, "white")
+        self.events: List[tuple] = []
+        self.field_text = ""
+        self._position = (0, 0)
+        self._text_line = 0
+
+    def _grab(self) -> Image.Image:
+        return self.image.copy()
+
+    def size(self) -> tuple[int, int]:
+        return self.image.size
+
+    def move(self, x: int, y: int):
+        self._position = (x, y)
+        self.events.append(("move", x, y))
+
+    def drag(self, x: int, y: int):
+        draw = ImageDraw.Draw(self.image)
+        draw.line([self._position, (x, y)], fill="blue", width=3)
+        self._position = (x, y)
+        self.events.append(("drag", x, y))
+
+    def click(self, button: str = "left"):
+        x, y = self._position
+        ImageDraw.Draw(self.image).ellipse([x - 4, y - 4, x + 4, y + 4], fill="red")
+        self.events.append(("click", button, x, y))
+
+    def double_click(self):
+        self.click()
+        self.events[-1] = ("double_click", *self._position)
+
+    def key(self, keys: str):
+        self.events.append(("key", keys))
+
+    def type_text(self, text: str):
+        ImageDraw.Draw(self.image).text((10, 10 + 12 * (self._text_line % 80)), text[:200], fill="black")
+        self._text_line += 1
+        self.field_text += text
+        self.events.append(("type", text))
+
+    def paste_text(self, text: str):
+        self.type_text(text)
+        self.events[-1] = ("paste", text)
+
+    def read_focused_text(self) -> str:
+        return self.field_text
+
+    def position(self) -> tuple[int, int]:
+        return self._position
+
+DISPLAY_BACKENDS: Dict[str, type[DisplayBackend]] = {
+    "pyautogui": PyAutoGUIBackend,
+    "mss": MSSBackend,
+    "fake": FakeDisplayBackend,
+}
+
+def make_display_backend(name: str = "auto", display: Optional[str] = None, **kwargs) -> DisplayBackend:
+    """Create a display backend by name; "auto" prefers mss and falls back to pyautogui"""
+    if name == "auto":
+        try:
+            backend = MSSBackend(display, **kwargs)
+            backend.size()  # connects to the display
+            return backend
+        except Exception:  # mss missing or unable to open the display
+            return PyAutoGUIBackend(display, **kwargs)
+    if name not in DISPLAY_BACKENDS:
+        raise ToolError(f"Unknown display backend: {name} (choose from auto, {', '.join(DISPLAY_BACKENDS)})")
+    return DISPLAY_BACKENDS[name](display, **kwargs)
+
 class ComputerTool:
     """
     Provides interface for computer interaction through mouse and keyboard
@@ -110,22 +962,108 @@ class ComputerTool:
     
     The tool operates in a virtual resolution space (default WXGA) and scales
     coordinates to match the actual screen resolution.
+    
+    Capture and input go through a DisplayBackend ("auto" uses MSS capture
+    when installed, otherwise pyautogui; "fake" is an in-memory screen).
+    
+    Before an action runs, `action_policy` decides from its risk class whether
+    the user gets time to review it.
+    
+    Text of at least `paste_threshold` characters (or with non-ASCII
+    characters) is pasted in one step instead of typed; if pasting fails it is
+    typed in chunks of `type_chunk_size`. With verify_paste=True the focused
+    field is read back after pasting.
+    
+    Verification screenshots taken after an action are fingerprinted; when the
+    screen did not change since the last image sent to the model, a short text
+    result is returned instead of a new image.
+    
+    Capture, resizing and encoding run in a worker thread so the event loop is
+    not blocked; per-frame timings and sizes are kept in `frame_stats`.
+    
+    In delta mode, verification screenshots only contain the regions that
+    changed since the last frame sent to the model. A full keyframe is sent
+    every `keyframe_interval` steps, for explicit screenshot actions, when the
+    change covers more than `delta_max_area` of the screen, or after
+    request_keyframe().
+    
+    After an action, the verification screenshot is taken once the screen has
+    settled (see SettleDetector); with adaptive_settle=False a fixed
+    `_screenshot_delay` is used instead.
     """
     name = "computer"
     api_type = "computer_20241022"
     _screenshot_delay = 1.0
+    # Start of the output of delta screenshots, also used by ConversationHistory to recognize them
+    DELTA_PREFIX = "Delta screenshot"
     
-    def __init__(self):
-        """Initialize with screen resolution detection and scaling setup"""
-        self.screen_width, self.screen_height = pyautogui.size()
-        print(f"Actual screen resolution: {self.screen_width}x{self.screen_height}")
+    def __init__(self, skip_unchanged_frames: bool = True, frame_hasher: Optional[FrameHasher] = None,
+                 encoder: Optional[ScreenshotEncoder] = None, frame_stats_size: int = 200,
+                 delta_mode: bool = False, keyframe_interval: int = 10, delta_max_area: float = 0.5,
+                 frame_buffer: Optional[FrameRingBuffer] = None, target: str = "WXGA",
+                 display: Optional[str] = None, screen_size: Optional[tuple[int, int]] = None,
+                 screenshot_policy: ScreenshotPolicy = ScreenshotPolicy.ALWAYS,
+                 adaptive_settle: bool = True, settle_detector: Optional[SettleDetector] = None,
+                 input_pause: float = 0.1, backend: DisplayBackend | str = "auto",
+                 tracer: Optional[Tracer] = None, paste_threshold: Optional[int] = 40,
+                 type_chunk_size: int = 200, verify_paste: bool = False,
+                 action_policy: Optional[ActionPolicy] = None):
+        """
+        Initialize with screen resolution detection and scaling setup
+        
+        target selects the virtual resolution from MAX_SCALING_TARGETS. display is
+        the X display this tool drives (defaults to $DISPLAY) and screen_size
+        overrides the detected physical resolution. backend is a DisplayBackend
+        or the name of one (see make_display_backend).
+        """
+        if target not in MAX_SCALING_TARGETS:
+            raise ToolError(f"Unknown target resolution: {target}")
+        self.screenshot_policy = ScreenshotPolicy(screenshot_policy)
+        self.settle_detector = (settle_detector or SettleDetector()) if adaptive_settle else None
+        self.input_pause = input_pause
+        if action_policy is None:
+            if WAIT_BEFORE_ACTION != DEFAULT_WAIT_BEFORE_ACTION:
+                warnings.warn("WAIT_BEFORE_ACTION is deprecated; pass action_policy=ActionPolicy(wait=...)",
+                              DeprecationWarning, stacklevel=2)
+            action_policy = ActionPolicy(wait=WAIT_BEFORE_ACTION)
+        self.action_policy = action_policy
+        self.paste_threshold = paste_threshold
+        self.type_chunk_size = type_chunk_size
+        self.verify_paste = verify_paste
+        self.display = display or os.environ.get("DISPLAY")
+        self.backend = make_display_backend(backend, self.display) if isinstance(backend, str) else backend
+        self.tracer = tracer or Tracer()
+        self.skip_unchanged_frames = skip_unchanged_frames
+        self.frame_hasher = frame_hasher or FrameHasher()
+        self.encoder = encoder or ScreenshotEncoder()
+        self.frame_stats: deque[FrameStats] = deque(maxlen=frame_stats_size)
+        self.delta_mode = delta_mode
+        self.keyframe_interval = keyframe_interval
+        self.delta_max_area = delta_max_area
+        self.frame_buffer = frame_buffer or FrameRingBuffer()
+        self._step = 0
+        self._last_sent_fingerprint: Optional[FrameFingerprint] = None
+        self._last_sent_step = 0
+        self._last_keyframe_step = 0
+        self._keyframe_requested = False
+        self.screen_width, self.screen_height = screen_size or self.backend.size()
+        print(f"Actual screen resolution: {self.screen_width}x{self.screen_height} ({self.backend.name} backend)")
         
         # Configure target resolution for coordinate scaling
-        target_res = MAX_SCALING_TARGETS["WXGA"]
+        self.target = target
+        target_res = MAX_SCALING_TARGETS[target]
         self.width = target_res["width"]
         self.height = target_res["height"]
         print(f"Target resolution for scaling: {self.width}x{self.height}")
         
+    @property
+    def display_number(self) -> int:
+        """X display number parsed from the display name (":2.0" -> 2), 1 if unknown"""
+        try:
+            return int(self.display.split(":")[-1].split(".")[0])
+        except (AttributeError, ValueError):
+            return 1
+        
     def to_params(self):
         """Return tool parameters for API configuration"""
         return {
@@ -133,7 +1071,7 @@ class ComputerTool:
             "name": self.name,
             "display_width_px": self.width,
             "display_height_px": self.height,
-            "display_number": 1,
+            "display_number": self.display_number,
         }
 
     async def __call__(self, action: Action, text: Optional[str] = None,
@@ -146,88 +1084,199 @@ class ComputerTool:
         2. Applies safety delays and confirmations
         3. Scales coordinates if needed
         4. Executes the requested action
-        5. Captures verification screenshot
+        5. Captures verification screenshot (depending on the screenshot policy)
         6. Returns results or error information
         
         Actions are executed with safety checks and user confirmation delays.
         Screenshots are taken after most actions to verify results.
         """
+        self._step += 1
         try:
             # Get action description for user feedback
             action_desc = self._get_action_description(action, text, coordinate)
             print(f"\nPending Action: {action_desc}")
             
-            # Apply safety delay if configured
-            if WAIT_BEFORE_ACTION is not None:
-                print(f"Waiting {WAIT_BEFORE_ACTION} seconds before executing action. Press Ctrl+C to abort...")
-                await asyncio.sleep(WAIT_BEFORE_ACTION)
-
-            # Process coordinates
-            if isinstance(coordinate, list) and len(coordinate) == 2:
-                coordinate = tuple(coordinate)
-
-            # Scale coordinates to physical screen space
-            if coordinate:
-                if not isinstance(coordinate, tuple) or len(coordinate) != 2:
-                    raise ToolError(f"Invalid coordinate format: {coordinate}")
-                try:
-                    x, y = int(coordinate[0]), int(coordinate[1])
-                    x, y = self._scale_coordinates(x, y)
-                    coordinate = (x, y)
-                except (ValueError, TypeError):
-                    raise ToolError(f"Invalid coordinate values: {coordinate}")
-
-            # Execute requested action based on type
-            if action in ("mouse_move", "left_click_drag"):
-                if not coordinate:
-                    raise ToolError(f"coordinate required for {action}")
-                x, y = coordinate
-                print(f"Moving to scaled coordinates: ({x}, {y})")
-                if action == "mouse_move":
-                    pyautogui.moveTo(x, y)
-                else:
-                    pyautogui.dragTo(x, y, button='left')
-                
-            elif action in ("key", "type"):
-                if not text:
-                    raise ToolError(f"text required for {action}")
-                print(f"Sending text: {text}")
-                if action == "key":
-                    keyboard.send(text)
-                else:
-                    pyautogui.write(text, interval=0.01)
-                
-            elif action in ("left_click", "right_click", "middle_click", "double_click"):
-                print(f"Performing {action}")
-                click_map = {
-                    "left_click": lambda: pyautogui.click(button='left'),
-                    "right_click": lambda: pyautogui.click(button='right'),
-                    "middle_click": lambda: pyautogui.click(button='middle'),
-                    "double_click": lambda: pyautogui.doubleClick()
-                }
-                click_map[action]()
-                
-            elif action == "cursor_position":
-                x, y = pyautogui.position()
-                scaled_x, scaled_y = self._inverse_scale_coordinates(x, y)
-                return ToolResult(output=f"X={scaled_x},Y={scaled_y}")
-            
-            elif action == "screenshot":
-                return await self._take_screenshot()
+            # Apply safety delay if the policy gates this kind of action
+            await self._confirm_delay([(action, text)])
 
-            # Capture verification screenshot after action
-            if action != "cursor_position":
-                await asyncio.sleep(self._screenshot_delay)
-                result = await self._take_screenshot()
-                if result.error:
-                    raise ToolError(result.error)
+            with self.tracer.span("action", action=action, step=self._step):
+                result = await self._perform(action, text, coordinate)
+            if result is not None:
                 return result
+
+            # Capture verification screenshot after action
+            if self.screenshot_policy != ScreenshotPolicy.ALWAYS:
+                return ToolResult(output=f"{action} done")
+            return await self._verify(action)
             
         except Exception as e:
             error_msg = f"Action failed: {str(e)}"
             print(f"\nError: {error_msg}")
             return ToolResult(error=error_msg)
 
+    async def run_batch(self, actions: List[Dict[str, Any]], screenshot: Optional[bool] = None) -> ToolResult:
+        """
+        Execute a list of primitive input actions back to back
+        
+        The safety delay is applied once for the whole batch, and a single
+        verification screenshot is captured after the last action. screenshot
+        overrides whether it is taken; by default it is skipped only under the
+        on_request policy. A failing step stops the batch and reports how many
+        steps completed.
+        """
+        self._step += 1
+        if not actions:
+            return ToolResult(error="Batch requires at least one action")
+        invalid = [item.get("action") for item in actions if item.get("action") not in BATCH_ACTIONS]
+        if invalid:
+            return ToolResult(error=f"Actions not allowed in a batch: {invalid}")
+        
+        print(f"\nPending Batch ({len(actions)} actions):")
+        for index, item in enumerate(actions, 1):
+            print(f"  {index}. {self._get_action_description(item['action'], item.get('text'), item.get('coordinate'))}")
+        await self._confirm_delay([(item["action"], item.get("text")) for item in actions])
+
+        for index, item in enumerate(actions, 1):
+            try:
+                with self.tracer.span("action", action=item["action"], step=self._step, batch_index=index):
+                    await self._perform(item["action"], item.get("text"), item.get("coordinate"))
+            except Exception as e:
+                error_msg = f"Batch step {index} ({item['action']}) failed after {index - 1} completed step(s): {str(e)}"
+                print(f"\nError: {error_msg}")
+                return ToolResult(error=error_msg)
+
+        summary = f"Batch of {len(actions)} action(s) completed."
+        if screenshot is None:
+            screenshot = self.screenshot_policy != ScreenshotPolicy.ON_REQUEST
+        if not screenshot:
+            return ToolResult(output=summary)
+        try:
+            result = await self._verify("batch")
+        except Exception as e:
+            return ToolResult(error=f"{summary} {str(e)}")
+        return result.replace(output=f"{summary} {result.output}" if result.output else summary)
+
+    async def _confirm_delay(self, actions: List[tuple[str, Optional[str]]]):
+        """Let the user review the actions if the action policy gates their risk class"""
+        risk = self.action_policy.classify_all(actions)
+        if not self.action_policy.wait or risk not in self.action_policy.gated:
+            return
+        with self.tracer.span("confirm_delay", step=self._step, risk=str(risk)) as span:
+            span.attributes["confirmed_by_key"] = await self.action_policy.confirm(risk)
+
+    async def _verify(self, action: str) -> ToolResult:
+        """Let the UI update, then capture the verification screenshot"""
+        image = None
+        with self.tracer.span("settle", step=self._step, action=action) as span:
+            if self.settle_detector is not None:
+                settle, image = await self.settle_detector.wait(self.backend.grab, action)
+                state = "Settled" if settle.settled else "Still changing"
+                print(f"{state} after {settle.elapsed_ms:.0f} ms ({settle.samples} samples)")
+                span.attributes.update(settled=settle.settled, samples=settle.samples)
+            else:
+                await asyncio.sleep(self._screenshot_delay)
+        result = await self._take_screenshot(verification=True, image=image)
+        if result.error:
+            raise ToolError(result.error)
+        return result
+
+    async def _perform(self, action: Action, text: Optional[str] = None,
+                       coordinate: Optional[tuple[int, int] | List[int]] = None) -> Optional[ToolResult]:
+        """
+        Execute a single primitive action
+        
+        Returns a ToolResult for actions that produce output on their own
+        (cursor_position, screenshot) and None for input actions.
+        """
+        # Process coordinates
+        if isinstance(coordinate, list) and len(coordinate) == 2:
+            coordinate = tuple(coordinate)
+
+        # Scale coordinates to physical screen space
+        if coordinate:
+            if not isinstance(coordinate, tuple) or len(coordinate) != 2:
+                raise ToolError(f"Invalid coordinate format: {coordinate}")
+            try:
+                x, y = int(coordinate[0]), int(coordinate[1])
+                x, y = self._scale_coordinates(x, y)
+                coordinate = (x, y)
+            except (ValueError, TypeError):
+                raise ToolError(f"Invalid coordinate values: {coordinate}")
+
+        # Execute requested action based on type
+        self.backend.set_pause(self.input_pause)
+        if action in ("mouse_move", "left_click_drag"):
+            if not coordinate:
+                raise ToolError(f"coordinate required for {action}")
+            x, y = coordinate
+            print(f"Moving to scaled coordinates: ({x}, {y})")
+            if action == "mouse_move":
+                self.backend.move(x, y)
+            else:
+                self.backend.drag(x, y)
+            
+        elif action in ("key", "type"):
+            if not text:
+                raise ToolError(f"text required for {action}")
+            print(f"Sending text: {text}")
+            if action == "key":
+                self.backend.key(text)
+            else:
+                self._type(text)
+            
+        elif action in ("left_click", "right_click", "middle_click", "double_click"):
+            print(f"Performing {action}")
+            click_map = {
+                "left_click": lambda: self.backend.click('left'),
+                "right_click": lambda: self.backend.click('right'),
+                "middle_click": lambda: self.backend.click('middle'),
+                "double_click": self.backend.double_click
+            }
+            click_map[action]()
+            
+        elif action == "cursor_position":
+            x, y = self.backend.position()
+            scaled_x, scaled_y = self._inverse_scale_coordinates(x, y)
+            return ToolResult(output=f"X={scaled_x},Y={scaled_y}")
+        
+        elif action == "screenshot":
+            return await self._take_screenshot()
+
+        else:
+            raise ToolError(f"Invalid action: {action}")
+        return None
+
+    def _type(self, text: str):
+        """
+        Paste long or non-ASCII text in one step, type the rest in chunks
+        
+        Every newline is an Enter key press on both paths, as typing does:
+        pasted text is split at newlines and Enter is sent between the pieces
+        (a pasted newline would be inserted as text in most fields).
+        """
+        if self.paste_threshold is not None and (len(text) >= self.paste_threshold or not text.isascii()):
+            lines = text.replace("\r\n", "\n").split("\n")
+            try:
+                if lines[0]:
+                    self.backend.paste_text(lines[0])
+            except Exception as e:
+                print(f"Paste failed ({str(e) or type(e).__name__}), typing instead")
+            else:
+                self._verify_paste(lines[0])
+                for line in lines[1:]:
+                    self.backend.key("enter")
+                    if line:
+                        self.backend.paste_text(line)
+                        self._verify_paste(line)
+                return
+        for start in range(0, len(text), self.type_chunk_size):
+            self.backend.type_text(text[start:start + self.type_chunk_size])
+
+    def _verify_paste(self, text: str):
+        """With verify_paste, check that pasted text arrived in the focused field"""
+        if self.verify_paste and text.strip() and text.strip() not in self.backend.read_focused_text():
+            raise ToolError("Pasted text was not found in the focused field; check it before continuing")
+
     def _scale_coordinates(self, x: int, y: int) -> tuple[int, int]:
         """Convert virtual coordinates to physical screen coordinates"""
         scaled_x = int(x * (self.screen_width / self.width))
@@ -240,29 +1289,160 @@ class ComputerTool:
         scaled_y = int(y * (self.height / self.screen_height))
         return scaled_x, scaled_y
 
-    async def _take_screenshot(self) -> ToolResult:
+    def request_keyframe(self):
+        """Force the next verification screenshot to be a full frame, even if the screen did not change"""
+        self._keyframe_requested = True
+
+    def forget_frames(self):
+        """
+        Forget what was sent to the model, for a new conversation
+        
+        Without this, "screen unchanged" answers and delta crops would refer to
+        frames of a conversation the model never saw.
+        """
+        self._step = 0
+        self._last_sent_fingerprint = None
+        self._last_sent_step = 0
+        self._last_keyframe_step = 0
+        self.frame_buffer.clear()
+        self.request_keyframe()
+
+    async def _take_screenshot(self, verification: bool = False, image: Optional[Image.Image] = None) -> ToolResult:
         """
         Capture and process screenshot
         
-        Captures screen, resizes to virtual resolution,
-        converts to base64 for transmission
+        Captures screen (or uses an already captured image), resizes to
+        virtual resolution, converts to base64 for transmission.
+        
+        Verification screenshots (taken after an action) that match the last
+        image sent to the model are reported as text instead of being encoded
+        again; in delta mode they only carry the changed regions.
         """
         try:
-            screenshot = pyautogui.screenshot()
-            if screenshot.size != (self.width, self.height):
-                screenshot = screenshot.resize(
-                    (self.width, self.height), 
-                    Image.Resampling.LANCZOS
-                )
+            encoder = self.encoder
+            screenshot, fingerprint, frame, capture_ms, resize_ms = await asyncio.to_thread(self._capture_frame, image)
+            
+            def unchanged() -> ToolResult:
+                self._record_frame(FrameStats(
+                    step=self._step, format=encoder.format, capture_ms=capture_ms,
+                    resize_ms=resize_ms, encode_ms=0.0, encoded_bytes=0, skipped=True
+                ))
+                return ToolResult(output=f"Screen unchanged since step {self._last_sent_step}")
+            
+            if (verification and self.skip_unchanged_frames and not self._keyframe_requested
+                    and self._last_sent_fingerprint is not None
+                    and self.frame_hasher.is_similar(fingerprint, self._last_sent_fingerprint)):
+                return unchanged()
+            
+            boxes = self._delta_boxes(frame) if verification else None
+            if boxes is not None and not boxes:
+                return unchanged()
+            
+            reference_step = self._last_sent_step
+            self._last_sent_fingerprint = fingerprint
+            self._last_sent_step = self._step
+            if frame is not None:
+                self.frame_buffer.push(self._step, frame)
             
-            buffered = BytesIO()
-            screenshot.save(buffered, format="PNG", optimize=True)
-            img_str = base64.b64encode(buffered.getvalue()).decode()
+            encode_start = time.perf_counter()
+            if boxes:
+                crops = [screenshot.crop(box) for box in boxes]
+                encoded = await asyncio.to_thread(lambda: [encoder.encode(crop) for crop in crops])
+            else:
+                self._last_keyframe_step = self._step
+                self._keyframe_requested = False
+                encoded = [await asyncio.to_thread(encoder.encode, screenshot)]
+            encode_ms = (time.perf_counter() - encode_start) * 1000
+            self._record_frame(FrameStats(
+                step=self._step, format=encoder.format, capture_ms=capture_ms,
+                resize_ms=resize_ms, encode_ms=encode_ms,
+                encoded_bytes=sum(len(data) for data in encoded)
+            ))
             
-            return ToolResult(base64_image=img_str)
+            if boxes:
+                regions = tuple(
+                    FrameRegion(
+                        x=left, y=top, width=right - left, height=bottom - top,
+                        base64_image=base64.b64encode(data).decode(),
+                        media_type=encoder.media_type,
+                    )
+                    for (left, top, right, bottom), data in zip(boxes, encoded)
+                )
+                return ToolResult(
+                    output=(f"{self.DELTA_PREFIX}: {len(regions)} changed region(s) since step {reference_step}. "
+                            "The rest of the screen is unchanged; take a screenshot for a full frame."),
+                    regions=regions,
+                )
+            img_str = base64.b64encode(encoded[0]).decode()
+            return ToolResult(base64_image=img_str, media_type=encoder.media_type)
         except Exception as e:
             return ToolResult(error=f"Screenshot failed: {str(e)}")
 
+    def _record_frame(self, stats: FrameStats):
+        """Keep the frame statistics and trace the capture/resize/encode phases"""
+        self.frame_stats.append(stats)
+        self.tracer.record("capture", stats.capture_ms, step=stats.step, backend=self.backend.name)
+        self.tracer.record("resize", stats.resize_ms, step=stats.step)
+        if not stats.skipped:
+            self.tracer.record("encode", stats.encode_ms, step=stats.step, format=stats.format,
+                               image_bytes=stats.encoded_bytes)
+
+    def _delta_boxes(self, frame: Optional[np.ndarray]) -> Optional[List[tuple[int, int, int, int]]]:
+        """
+        Changed boxes relative to the last sent frame, or None if a keyframe is due
+        """
+        reference = self.frame_buffer.latest()
+        if (frame is None or reference is None or self._keyframe_requested
+                or reference[1].shape != frame.shape
+                or self._step - self._last_keyframe_step >= self.keyframe_interval):
+            return None
+        boxes = find_changed_regions(reference[1], frame)
+        changed_area = sum((right - left) * (bottom - top) for left, top, right, bottom in boxes)
+        if changed_area > self.delta_max_area * self.width * self.height:
+            return None
+        return boxes
+
+    def _capture_frame(self, image: Optional[Image.Image] = None) -> tuple[Image.Image, FrameFingerprint, Optional[np.ndarray], float, float]:
+        """Grab the screen, scale it to the virtual resolution and fingerprint it (blocking)"""
+        capture_start = time.perf_counter()
+        screenshot = image if image is not None else self.backend.grab()
+        resize_start = time.perf_counter()
+        screenshot = self.encoder.resize(screenshot, (self.width, self.height))
+        fingerprint = self.frame_hasher.fingerprint(screenshot)
+        frame = np.asarray(screenshot.convert("RGB")) if self.delta_mode else None
+        resize_end = time.perf_counter()
+        return (
+            screenshot,
+            fingerprint,
+            frame,
+            (resize_start - capture_start) * 1000,
+            (resize_end - resize_start) * 1000,
+        )
+
+    def frame_stats_summary(self) -> Dict[str, Any]:
+        """Aggregate recorded frame timings and sizes"""
+        stats = list(self.frame_stats)
+        sent = [s for s in stats if not s.skipped]
+        if not stats:
+            return {"frames": 0}
+
+        def mean(values: List[float]) -> float:
+            return round(sum(values) / len(values), 2) if values else 0.0
+
+        return {
+            "frames": len(stats),
+            "sent": len(sent),
+            "skipped": len(stats) - len(sent),
+            "format": self.encoder.format,
+            "backend": self.backend.name,
+            "backend_p95_capture_ms": self.backend.capture_summary().get("p95_ms", 0.0),
+            "avg_capture_ms": mean([s.capture_ms for s in stats]),
+            "avg_resize_ms": mean([s.resize_ms for s in stats]),
+            "avg_encode_ms": mean([s.encode_ms for s in sent]),
+            "avg_bytes": mean([s.encoded_bytes for s in sent]),
+            "total_bytes": sum(s.encoded_bytes for s in sent),
+        }
+
     def _get_action_description(self, action: Action, text: Optional[str],
                               coordinate: Optional[tuple[int, int] | List[int]]) -> str:
         """Generate human-readable description of pending action"""
@@ -278,6 +1458,244 @@ class ComputerTool:
             return "Get current cursor position"
         return f"Unknown action: {action}"
 
+class ComputerBatchTool:
+    """
+    Custom tool that runs several computer input actions in one call
+    
+    Lets the model send e.g. move, click, type and enter as one tool call,
+    paying the confirmation delay and the verification screenshot once.
+    """
+    name = "computer_batch"
+    
+    def __init__(self, computer_tool: ComputerTool):
+        self.computer_tool = computer_tool
+
+    def to_params(self):
+        """Return tool parameters for API configuration"""
+        return {
+            "name": self.name,
+            "description": (
+                "Run several input actions of the computer tool back to back (for example "
+                "mouse_move, left_click, type, key enter). Coordinates use the same scaled "
+                "resolution as the computer tool. One screenshot is returned after the last "
+                "action unless screenshot is false (it defaults to the session screenshot policy)."
+            ),
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    "actions": {
+                        "type": "array",
+                        "description": "Ordered list of actions to perform",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "action": {"type": "string", "enum": list(BATCH_ACTIONS)},
+                                "text": {"type": "string"},
+                                "coordinate": {
+                                    "type": "array",
+                                    "items": {"type": "integer"},
+                                    "minItems": 2,
+                                    "maxItems": 2,
+                                },
+                            },
+                            "required": ["action"],
+                        },
+                    },
+                    "screenshot": {"type": "boolean"},
+                },
+                "required": ["actions"],
+            },
+        }
+
+    async def __call__(self, actions: List[Dict[str, Any]], screenshot: Optional[bool] = None, **kwargs):
+        """Execute the batch on the wrapped ComputerTool"""
+        return await self.computer_tool.run_batch(actions, screenshot=screenshot)
+
+@dataclass(frozen=True)
+class EditRecord:
+    """
+    Reverse diff of one edit
+    
+    The edit replaced old text with new_content[start:new_end]; old_text holds
+    the zlib-compressed original span. new_digest identifies the file content
+    right after the edit, so undo can detect later external changes.
+    """
+    start: int
+    new_end: int
+    old_text: bytes
+    new_digest: str
+    created: bool = False
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory used by the record"""
+        return len(self.old_text) + len(self.new_digest) + 64
+
+def _content_digest(content: str) -> str:
+    """Short digest of file content"""
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+def _common_prefix_length(first: str, second: str) -> int:
+    """Length of the common prefix (binary search over C-level slice comparisons)"""
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[:middle] == second[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _common_suffix_length(first: str, second: str, limit: int) -> int:
+    """Length of the common suffix, at most limit characters"""
+    low, high = 0, min(len(first), len(second), limit)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[len(first) - middle:] == second[len(second) - middle:]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+class EditHistory:
+    """
+    Memory-bounded undo history for EditTool
+    
+    Each edit is stored as a compressed reverse diff (only the replaced span of
+    the old content). When the total size exceeds `max_bytes`, the oldest
+    records of the least recently edited files are evicted first; each file
+    keeps at most `max_entries_per_path` records.
+    """
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024, max_entries_per_path: int = 100):
+        self.max_bytes = max_bytes
+        self.max_entries_per_path = max_entries_per_path
+        self.nbytes = 0
+        self.evicted = 0
+        self._records: OrderedDict[str, deque[EditRecord]] = OrderedDict()
+
+    def record(self, path: str, old_content: Optional[str], new_content: str):
+        """Store the reverse diff of an edit (old_content None means the file was created)"""
+        if old_content is None:
+            record = EditRecord(start=0, new_end=len(new_content), old_text=b"",
+                                new_digest=_content_digest(new_content), created=True)
+        else:
+            start = _common_prefix_length(old_content, new_content)
+            suffix = _common_suffix_length(old_content, new_content,
+                                           min(len(old_content), len(new_content)) - start)
+            record = EditRecord(
+                start=start,
+                new_end=len(new_content) - suffix,
+                old_text=zlib.compress(old_content[start:len(old_content) - suffix].encode("utf-8")),
+                new_digest=_content_digest(new_content),
+            )
+        records = self._records.setdefault(path, deque())
+        self._records.move_to_end(path)
+        records.append(record)
+        self.nbytes += record.nbytes
+        if len(records) > self.max_entries_per_path:
+            self.nbytes -= records.popleft().nbytes
+            self.evicted += 1
+        self._evict()
+
+    def undo(self, path: str, current_content: str) -> Optional[str]:
+        """
+        Revert the latest edit of path and return the previous content
+        
+        Returns None if the edit created the file (the caller removes it).
+        Raises ToolError if there is nothing to undo or the file changed since.
+        """
+        records = self._records.get(path)
+        if not records:
+            raise ToolError(f"No edit history for {path}")
+        record = records[-1]
+        if _content_digest(current_content) != record.new_digest:
+            raise ToolError(f"{path} was modified after the last edit; cannot undo")
+        records.pop()
+        self.nbytes -= record.nbytes
+        if records:
+            self._records.move_to_end(path)
+        else:
+            del self._records[path]
+        if record.created:
+            return None
+        old_text = zlib.decompress(record.old_text).decode("utf-8")
+        return current_content[:record.start] + old_text + current_content[record.new_end:]
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Current size of the history"""
+        return {
+            "paths": len(self._records),
+            "entries": sum(len(records) for records in self._records.values()),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "evicted": self.evicted,
+        }
+
+    def _evict(self):
+        """Drop oldest records of least recently used paths until under max_bytes"""
+        while self.nbytes > self.max_bytes and self._records:
+            path, records = next(iter(self._records.items()))
+            self.nbytes -= records.popleft().nbytes
+            self.evicted += 1
+            if not records:
+                del self._records[path]
+
+class LineIndex:
+    """
+    Sparse line-offset index of a text file
+    
+    The file is scanned once through a memory map and the byte offset of every
+    `stride`-th line start is kept, so reading a line range seeks to the
+    nearest checkpoint and reads only the requested lines. `key` (mtime and
+    size) tells when the index is stale.
+    """
+    def __init__(self, path: Path, stride: int = 256, chunk_size: int = 16 * 1024 * 1024):
+        self.path = path
+        self.stride = stride
+        stat = path.stat()
+        self.key = (stat.st_mtime_ns, stat.st_size)
+        self.checkpoints = array("Q", [0])
+        self.line_count = 0
+        if stat.st_size:
+            self._build(stat.st_size, chunk_size)
+
+    def _build(self, size: int, chunk_size: int):
+        """Scan the file for newlines and record checkpoint offsets"""
+        newline_count = 0
+        with open(self.path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            data = np.frombuffer(mapped, dtype=np.uint8)
+            try:
+                for offset in range(0, size, chunk_size):
+                    newlines = np.flatnonzero(data[offset:offset + chunk_size] == 10) + offset
+                    # Newline number j (0-based) starts line j + 2; keep lines 1, 1 + stride, ...
+                    first = -(-(newline_count + 1) // self.stride) * self.stride - 1
+                    self.checkpoints.extend((newlines[first - newline_count::self.stride] + 1).tolist())
+                    newline_count += len(newlines)
+                ends_with_newline = data[-1] == 10
+            finally:
+                del data
+        self.line_count = newline_count + (0 if ends_with_newline else 1)
+        if ends_with_newline and self.checkpoints[-1] == size:
+            self.checkpoints.pop()
+
+    def read_lines(self, start: int, end: int) -> List[str]:
+        """Return lines start..end (1-based, inclusive) without line endings"""
+        end = min(end, self.line_count)
+        if start > end:
+            return []
+        checkpoint = (start - 1) // self.stride
+        lines = []
+        with open(self.path, "rb") as file:
+            file.seek(self.checkpoints[checkpoint])
+            for _ in range(start - 1 - checkpoint * self.stride):
+                file.readline()
+            for _ in range(end - start + 1):
+                raw = file.readline()
+                if raw.endswith(b"\n"):
+                    raw = raw[:-2] if raw.endswith(b"\r\n") else raw[:-1]
+                lines.append(raw.decode("utf-8", errors="replace"))
+        return lines
+
 class EditTool:
     """
     File editing tool for text manipulation
@@ -287,16 +1705,36 @@ class EditTool:
     - Creating new files
     - String replacement
     - Line insertion
-    - Edit history tracking
+    - Undoing the last edit of a file
     
-    All operations maintain file history for potential undo operations
+    All edits are recorded in a memory-bounded EditHistory of reverse diffs.
+    Views are served from cached LineIndex objects, so large files are never
+    read whole; output is limited to `max_view_lines` lines of at most
+    `max_line_chars` characters.
+    
+    Edit results show only `context_lines` lines around the change (the whole
+    file with `full_edit_output=True`) together with a content hash. Views
+    show the same hash when the file was last written by this tool, else a
+    hash of the shown lines. Repeating a view of a file whose mtime and size
+    did not change returns a short "unchanged" note.
     """
     name = "str_replace_editor"
     api_type = "text_editor_20241022"
     
-    def __init__(self):
+    def __init__(self, history: Optional[EditHistory] = None, max_view_lines: int = 2000,
+                 max_line_chars: int = 2000, max_indexes: int = 32, context_lines: int = 4,
+                 full_edit_output: bool = False):
         """Initialize with empty file history"""
-        self._file_history = {}
+        self.history = history or EditHistory()
+        self.max_view_lines = max_view_lines
+        self.max_line_chars = max_line_chars
+        self.max_indexes = max_indexes
+        self.context_lines = context_lines
+        self.full_edit_output = full_edit_output
+        self._line_indexes: OrderedDict[str, LineIndex] = OrderedDict()
+        self._lock = threading.Lock()
+        self._digests: Dict[str, tuple] = {}
+        self._last_views: Dict[str, tuple] = {}
 
     def to_params(self):
         """Return tool parameters for API configuration"""
@@ -309,14 +1747,22 @@ class EditTool:
                        old_str: Optional[str] = None, new_str: Optional[str] = None,
                        insert_line: Optional[int] = None, view_range: Optional[List[int]] = None,
                        **kwargs):
+        """Execute a file operation (see run)"""
+        return self.run(command, path, file_text, old_str, new_str, insert_line, view_range)
+
+    def run(self, command: Command, path: str, file_text: Optional[str] = None,
+            old_str: Optional[str] = None, new_str: Optional[str] = None,
+            insert_line: Optional[int] = None, view_range: Optional[List[int]] = None,
+            **kwargs) -> ToolResult:
         """
-        Execute file editing operations
+        Execute file editing operations (blocking; views may run in worker threads)
         
         Handles:
         - File viewing (with optional line range)
         - File creation
         - String replacement (with uniqueness validation)
         - Line insertion
+        - Undo of the last edit
         
         All operations include error checking and history tracking
         """
@@ -330,12 +1776,7 @@ class EditTool:
 
             # Handle different commands
             if command == "view":
-                content = path_obj.read_text(encoding='utf-8')
-                if view_range:
-                    lines = content.splitlines()
-                    start, end = view_range
-                    content = '\n'.join(lines[start-1:end])
-                return ToolResult(output=self._format_output(content, path))
+                return ToolResult(output=self._view(path_obj, view_range))
             
             elif command == "create":
                 if not file_text:
@@ -343,8 +1784,9 @@ class EditTool:
                 if path_obj.exists():
                     raise ToolError(f"File already exists: {path}")
                 path_obj.write_text(file_text, encoding='utf-8')
-                self._file_history[path] = [file_text]
-                return ToolResult(output=f"File created at {path}")
+                self.history.record(path, None, file_text)
+                self._remember_digest(path_obj, file_text)
+                return ToolResult(output=f"File created at {path} (hash {self._digests[path][1]})")
 
             elif command == "str_replace":
                 if not old_str:
@@ -356,9 +1798,9 @@ class EditTool:
                 if occurrences > 1:
                     raise ToolError(f"Multiple occurrences ({occurrences}) of '{old_str}' found")
                 new_content = content.replace(old_str, new_str or "")
-                self._file_history[path] = self._file_history.get(path, []) + [content]
                 path_obj.write_text(new_content, encoding='utf-8')
-                return ToolResult(output=self._format_output(new_content, path))
+                self.history.record(path, content, new_content)
+                return ToolResult(output=self._format_edit(content, new_content, path_obj))
 
             elif command == "insert":
                 if insert_line is None or not new_str:
@@ -368,10 +1810,24 @@ class EditTool:
                 if not (0 <= insert_line <= len(lines)):
                     raise ToolError(f"Invalid line number: {insert_line}")
                 lines.insert(insert_line, new_str)
-                new_content = '\n'.join(lines)
-                self._file_history[path] = self._file_history.get(path, []) + [content]
+                new_content = '\n'.join(lines) + ('\n' if content.endswith('\n') else '')
                 path_obj.write_text(new_content, encoding='utf-8')
-                return ToolResult(output=self._format_output(new_content, path))
+                self.history.record(path, content, new_content)
+                return ToolResult(output=self._format_edit(content, new_content, path_obj))
+
+            elif command == "undo_edit":
+                content = path_obj.read_text(encoding='utf-8') if path_obj.exists() else ""
+                previous = self.history.undo(path, content)
+                usage = self.history.memory_usage()
+                note = f"(edit history: {usage['entries']} entries, {usage['bytes'] / 1024:.1f} KB)"
+                if previous is None:
+                    path_obj.unlink()
+                    self._digests.pop(path, None)
+                    self._last_views.pop(path, None)
+                    return ToolResult(output=f"Undid creation of {path}; file removed {note}")
+                path_obj.write_text(previous, encoding='utf-8')
+                return ToolResult(output=f"Last edit to {path} undone {note}\n"
+                                         + self._format_edit(content, previous, path_obj))
 
             raise ToolError(f"Invalid command: {command}")
             
@@ -380,28 +1836,1426 @@ class EditTool:
                 raise
             raise ToolError(f"File operation failed: {str(e)}")
 
-    def _format_output(self, content: str, path: str) -> str:
+    def _view(self, path_obj: Path, view_range: Optional[List[int]]) -> str:
+        """Format the requested line range of a file, bounded to max_view_lines"""
+        index = self._line_index(path_obj)
+        start, end = 1, index.line_count
+        if view_range:
+            if len(view_range) != 2:
+                raise ToolError(f"view_range must be [start, end], got {view_range}")
+            start, end = int(view_range[0]), int(view_range[1])
+            if end == -1:
+                end = index.line_count
+            if start < 1 or end < start or start > max(index.line_count, 1):
+                raise ToolError(f"Invalid view_range {view_range} for a file with {index.line_count} lines")
+            end = min(end, index.line_count)
+
+        shown_end = min(end, start + self.max_view_lines - 1)
+        # The index key (mtime, size) was just checked, so no hash of the whole file is needed
+        view_key = (start, shown_end, index.key)
+        if self._last_views.get(str(path_obj)) == view_key:
+            return f"{path_obj} lines {start}-{shown_end} unchanged since your last view"
+        self._last_views[str(path_obj)] = view_key
+        shown = index.read_lines(start, shown_end)
+        cached = self._digests.get(str(path_obj))
+        if cached and cached[0] == index.key:
+            # Hash of the last content written by this tool, as in the edit results
+            digest = cached[1]
+        else:
+            # Changed outside the tool: hash the shown lines only, the file may be large
+            span_digest = _content_digest("\n".join(shown))
+            digest = f"{span_digest} of lines {start}-{shown_end}"
+        lines = [
+            line if len(line) <= self.max_line_chars else line[:self.max_line_chars] + " ... [line truncated]"
+            for line in shown
+        ]
+        output = self._format_output('\n'.join(lines), str(path_obj), start_line=start, digest=digest)
+        if shown_end < end:
+            output += (f"\n... {end - shown_end} more lines (file has {index.line_count}); "
+                       f"use view_range [{shown_end + 1}, {min(end, shown_end + self.max_view_lines)}] to continue")
+        return output
+
+    def _line_index(self, path_obj: Path) -> LineIndex:
+        """Return the cached line index of a file, rebuilding it if the file changed"""
+        key = str(path_obj)
+        stat = path_obj.stat()
+        with self._lock:
+            index = self._line_indexes.get(key)
+        if index is None or index.key != (stat.st_mtime_ns, stat.st_size):
+            index = LineIndex(path_obj)
+        with self._lock:
+            self._line_indexes[key] = index
+            self._line_indexes.move_to_end(key)
+            while len(self._line_indexes) > self.max_indexes:
+                self._line_indexes.popitem(last=False)
+        return index
+
+    def _format_edit(self, old_content: str, new_content: str, path_obj: Path) -> str:
+        """Format the changed lines of an edit with context_lines of context and the new hash"""
+        path = str(path_obj)
+        digest = self._remember_digest(path_obj, new_content)
+        self._last_views.pop(path, None)
+        if self.full_edit_output:
+            return self._format_output(new_content, path, digest=digest)
+
+        prefix = _common_prefix_length(old_content, new_content)
+        suffix = _common_suffix_length(old_content, new_content, min(len(old_content), len(new_content)) - prefix)
+        change_end = len(new_content) - suffix
+        if change_end > prefix and new_content[change_end - 1] == "\n":
+            change_end -= 1
+        first_changed = new_content.count("\n", 0, prefix) + 1
+        last_changed = max(first_changed, new_content.count("\n", 0, change_end) + 1)
+        lines = new_content.splitlines()
+        # Lines deleted at the end of the file leave the change past the last remaining line
+        line_count = max(len(lines), 1)
+        deleted_at_end = first_changed > line_count
+        first_changed, last_changed = min(first_changed, line_count), min(last_changed, line_count)
+        start = max(1, first_changed - self.context_lines)
+        end = min(len(lines), last_changed + self.context_lines, start + self.max_view_lines - 1)
+        if deleted_at_end:
+            changed = "lines removed at the end of the file"
+        elif first_changed == last_changed:
+            changed = f"line {first_changed} changed"
+        else:
+            changed = f"lines {first_changed}-{last_changed} changed"
+        output = (f"Edited {path}: {changed}, "
+                  f"file now has {len(lines)} lines (hash {digest}). Showing lines {start}-{end}:\n"
+                  + '\n'.join(f"{i:6}\t{line}" for i, line in enumerate(lines[start - 1:end], start)))
+        if end < last_changed and not deleted_at_end:
+            output += f"\n... {last_changed - end} more changed lines; use view_range [{end + 1}, {last_changed}] to see them"
+        return output
+
+    def _remember_digest(self, path_obj: Path, content: str) -> str:
+        """Cache the hash of content just written to path_obj"""
+        stat = path_obj.stat()
+        digest = _content_digest(content)
+        self._digests[str(path_obj)] = ((stat.st_mtime_ns, stat.st_size), digest)
+        return digest
+
+    def forget_views(self):
+        """Forget previous views, e.g. after they were dropped from the conversation"""
+        self._last_views.clear()
+
+    def _format_output(self, content: str, path: str, start_line: int = 1, digest: Optional[str] = None) -> str:
         """Format file content with line numbers for display"""
-        numbered_lines = [f"{i+1:6}\t{line}" for i, line in enumerate(content.splitlines())]
-        return f"Content of {path}:\n" + '\n'.join(numbered_lines)
+        numbered_lines = [f"{i+start_line:6}\t{line}" for i, line in enumerate(content.splitlines())]
+        header = f"Content of {path} (hash {digest}):" if digest else f"Content of {path}:"
+        return header + "\n" + '\n'.join(numbered_lines)
+
+class ConversationHistory:
+    """
+    Token-aware compaction of the agent conversation
+    
+    Before each request the message list is compacted in place:
+    - only the last `max_images` images are kept, older ones are replaced
+      with a short text placeholder; this happens in batches, once
+      `image_batch` images have piled up past the limit, so the prompt-cache
+      prefix changes once every `image_batch` images instead of every turn;
+      a delta screenshot counts as one image however many regions it has,
+      and the newest full screenshot is kept while the deltas after it refer
+      to it
+    - when the estimated size exceeds `token_budget`, the oldest
+      assistant/tool-result turns are removed until the estimate drops below
+      `target_ratio` of the budget, and replaced with a compact text summary
+      appended to the first user message (or a plain note if `summarize`
+      is False)
+    
+    Compacting down to a lower watermark keeps the message prefix stable for
+    many turns instead of trimming a little on every request.
+    """
+    IMAGE_PLACEHOLDER = "[earlier screenshot omitted to save context]"
+    SUMMARY_TAG = "conversation_summary"
+    SUMMARY_HEADER = "Summary of earlier steps:"
+    # Approximate characters per token for English text and JSON
+    CHARS_PER_TOKEN = 4
+    # Fallback estimate for an image whose size cannot be read (a WXGA frame)
+    DEFAULT_IMAGE_TOKENS = 1365
+    MAX_IMAGE_TOKENS = 1600
+    # Older summary text is trimmed once the summary grows past this size
+    MAX_SUMMARY_CHARS = 6000
+
+    def __init__(self, max_images: Optional[int] = 3, token_budget: Optional[int] = 100_000,
+                 target_ratio: float = 0.6, keep_recent_turns: int = 4, summarize: bool = True,
+                 summarizer: Optional[Callable[[List[Dict[str, Any]]], str]] = None, image_batch: int = 3):
+        self.max_images = max_images
+        self.image_batch = max(image_batch, 1)
+        self.token_budget = token_budget
+        self.target_ratio = target_ratio
+        self.keep_recent_turns = keep_recent_turns
+        self.summarize = summarize
+        self.summarizer = summarizer or self._default_summary
+        self.images_pruned = 0
+        self.turns_summarized = 0
+        # Tool calls of the removed turns, so TurnCache keys do not depend on when compaction happened
+        self.dropped_actions: List[list] = []
+
+    @classmethod
+    def estimate_tokens(cls, message: Any) -> int:
+        """Roughly estimate the input tokens used by a message"""
+        message = _as_dict(message)
+        content = message.get("content", "")
+        if isinstance(content, str):
+            return len(content) // cls.CHARS_PER_TOKEN + 4
+        return sum(cls._block_tokens(block) for block in content) + 4
+
+    @classmethod
+    def _block_tokens(cls, block: Any) -> int:
+        """Estimate tokens for a single content block"""
+        block = _as_dict(block)
+        block_type = block.get("type")
+        if block_type == "text":
+            return len(block.get("text", "")) // cls.CHARS_PER_TOKEN + 1
+        if block_type == "image":
+            return cls._image_tokens(block.get("source", {}))
+        if block_type == "tool_use":
+            return len(json.dumps(block.get("input", {}))) // cls.CHARS_PER_TOKEN + 10
+        if block_type == "tool_result":
+            content = block.get("content", "")
+            if isinstance(content, str):
+                return len(content) // cls.CHARS_PER_TOKEN + 10
+            return sum(cls._block_tokens(item) for item in content) + 10
+        return len(json.dumps(block, default=str)) // cls.CHARS_PER_TOKEN
+
+    @classmethod
+    def _image_tokens(cls, source: Dict[str, Any]) -> int:
+        """Estimate image tokens as width * height / 750 from the encoded image header"""
+        if source.get("type") == "blob":
+            if source.get("width") and source.get("height"):
+                return min(source["width"] * source["height"] // 750 + 1, cls.MAX_IMAGE_TOKENS)
+            return cls.DEFAULT_IMAGE_TOKENS
+        try:
+            header = base64.b64decode(source["data"][:4096])
+            width, height = Image.open(BytesIO(header)).size
+            return min(width * height // 750 + 1, cls.MAX_IMAGE_TOKENS)
+        except Exception:
+            return cls.DEFAULT_IMAGE_TOKENS
+
+    def total_tokens(self, messages: List[Any]) -> int:
+        """Estimate the input tokens of a whole message list"""
+        return sum(self.estimate_tokens(message) for message in messages)
+
+    def compact(self, messages: List[Any]) -> int:
+        """
+        Compact messages in place and return the resulting token estimate
+        """
+        if self.max_images is not None:
+            self._prune_images(messages)
+        total = self.total_tokens(messages)
+        if self.token_budget is not None and total > self.token_budget:
+            self._drop_old_turns(messages, int(self.token_budget * self.target_ratio))
+            total = self.total_tokens(messages)
+        return total
+
+    def _prune_images(self, messages: List[Any]):
+        """Replace all but the newest max_images images with placeholders, once image_batch are over the limit"""
+        frames = [(slots, delta) for _, slots, delta in self._screenshots(messages)]
+        excess = len(frames) - self.max_images
+        if excess < self.image_batch:
+            return
+        keyframes = [slots for slots, delta in frames if not delta]
+        for slots, _ in frames[:excess]:
+            if keyframes and slots is keyframes[-1]:
+                continue
+            for blocks, index in slots:
+                blocks[index] = {"type": "text", "text": self.IMAGE_PLACEHOLDER}
+                self.images_pruned += 1
+
+    @staticmethod
+    def _screenshots(messages: List[Any]) -> List[tuple[Any, List[tuple[List[Any], int]], bool]]:
+        """
+        Screenshots in messages, oldest first
+        
+        One entry per screenshot: the message holding it, the (blocks, index)
+        slots of its images and whether it is a delta (several region images
+        form one delta screenshot).
+        """
+        frames = []
+        for message in messages:
+            content = message.get("content") if isinstance(message, dict) else None
+            if not isinstance(content, list):
+                continue
+            for index, block in enumerate(content):
+                if not isinstance(block, dict):
+                    continue
+                if block.get("type") == "image":
+                    frames.append((message, [(content, index)], False))
+                elif block.get("type") == "tool_result" and isinstance(block.get("content"), list):
+                    items = block["content"]
+                    slots = [(items, item_index) for item_index, item in enumerate(items)
+                             if isinstance(item, dict) and item.get("type") == "image"]
+                    if slots:
+                        delta = any(isinstance(item, dict) and item.get("type") == "text"
+                                    and item.get("text", "").startswith(ComputerTool.DELTA_PREFIX) for item in items)
+                        frames.append((message, slots, delta))
+        return frames
+
+    def _drop_old_turns(self, messages: List[Any], target_tokens: int):
+        """
+        Remove the oldest assistant/user turn pairs after the first message until under target
+        
+        The turn of the newest full screenshot is kept while delta screenshots
+        after it remain, since their crops only make sense on top of it.
+        """
+        screenshots = self._screenshots(messages)
+        keyframes = [position for position, (_, _, delta) in enumerate(screenshots) if not delta]
+        protected = None
+        if keyframes and any(delta for _, _, delta in screenshots[keyframes[-1] + 1:]):
+            protected = screenshots[keyframes[-1]][0]
+
+        dropped: List[Any] = []
+        tokens = [self.estimate_tokens(message) for message in messages]
+        total = sum(tokens)
+        position, min_length = 1, 1 + 2 * self.keep_recent_turns
+        while len(messages) > min_length and total > target_tokens:
+            if any(message is protected for message in messages[position:position + 2]):
+                position += 2
+                min_length += 2
+                continue
+            dropped.extend(messages[position:position + 2])
+            total -= sum(tokens[position:position + 2])
+            del messages[position:position + 2], tokens[position:position + 2]
+        if not dropped:
+            return
+        self.turns_summarized += len(dropped) // 2
+        self.dropped_actions.extend(TurnCache.actions(dropped))
+
+        first = messages[0]
+        if isinstance(first.get("content"), str):
+            first["content"] = [{"type": "text", "text": first["content"]}]
+        previous = ""
+        for block in list(first["content"]):
+            text = block.get("text", "") if isinstance(block, dict) else ""
+            if text.startswith(f"<{self.SUMMARY_TAG}>"):
+                previous = "\n".join(line for line in text.split("\n")[1:-1] if line != self.SUMMARY_HEADER)
+                first["content"].remove(block)
+        if self.summarize:
+            summary = self.summarizer(dropped)
+        else:
+            summary = f"{len(dropped) // 2} earlier turn(s) were removed to save context."
+        summary = f"{previous}\n{summary}".strip()[-self.MAX_SUMMARY_CHARS:]
+        first["content"].append({
+            "type": "text",
+            "text": f"<{self.SUMMARY_TAG}>\n{self.SUMMARY_HEADER}\n{summary}\n</{self.SUMMARY_TAG}>"
+        })
+
+    @staticmethod
+    def _default_summary(messages: List[Any]) -> str:
+        """Summarize removed turns as one line per assistant note, action and result"""
+        def clip(text: str, limit: int = 160) -> str:
+            text = " ".join(text.split())
+            return text if len(text) <= limit else text[:limit] + "..."
+
+        lines = []
+        for message in messages:
+            for block in _as_dict(message).get("content", []):
+                block = _as_dict(block)
+                if block.get("type") == "text" and block.get("text") != ConversationHistory.IMAGE_PLACEHOLDER:
+                    lines.append(f"- note: {clip(block['text'])}")
+                elif block.get("type") == "tool_use":
+                    lines.append(f"- action: {block.get('name')} {clip(json.dumps(block.get('input', {})))}")
+                elif block.get("type") == "tool_result":
+                    texts = [item.get("text", "") for item in block.get("content", [])
+                             if isinstance(item, dict) and item.get("type") == "text"
+                             and item.get("text") != ConversationHistory.IMAGE_PLACEHOLDER]
+                    status = "error" if block.get("is_error") else "result"
+                    if texts:
+                        lines.append(f"  {status}: {clip(' '.join(texts))}")
+        return "\n".join(lines)
+
+@dataclass
+class UsageStats:
+    """
+    Accumulated token usage reported by the API
+    
+    Tracks regular input, prompt-cache writes and reads, and output tokens
+    over all requests of a session.
+    """
+    requests: int = 0
+    input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    output_tokens: int = 0
+
+    def record(self, usage: Any):
+        """Add the usage block of one response"""
+        self.requests += 1
+        for name in ("input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens", "output_tokens"):
+            setattr(self, name, getattr(self, name) + (getattr(usage, name, None) or 0))
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        """Share of prompt tokens that were served from the cache"""
+        prompt_tokens = self.input_tokens + self.cache_creation_input_tokens + self.cache_read_input_tokens
+        return self.cache_read_input_tokens / prompt_tokens if prompt_tokens else 0.0
+
+    @staticmethod
+    def describe(usage: Any) -> str:
+        """One-line description of a response usage block"""
+        return (f"input={getattr(usage, 'input_tokens', 0) or 0} "
+                f"cache_read={getattr(usage, 'cache_read_input_tokens', 0) or 0} "
+                f"cache_write={getattr(usage, 'cache_creation_input_tokens', 0) or 0} "
+                f"output={getattr(usage, 'output_tokens', 0) or 0}")
+
+    def summary(self) -> str:
+        """One-line description of the accumulated usage"""
+        return (f"{self.requests} requests, {self.describe(self)}, "
+                f"cache hit ratio {self.cache_hit_ratio:.0%}")
+
+class BudgetExceeded(Exception):
+    """Raised by the conversation loop when a SessionBudget limit is reached or the model is stuck"""
+
+@dataclass
+class SessionBudget:
+    """
+    Step, wall-clock and token limits of one session, with what has been used
+    
+    Steps are executed tool calls. Input tokens count every prompt token the
+    API reported (regular input, cache writes and cache reads), output tokens
+    the generated ones; both are measured from the usage at `restart`, so a
+    budget can be reused for the next task on the same client. None disables
+    a limit.
+    """
+    max_steps: Optional[int] = 200
+    max_seconds: Optional[float] = 3600.0
+    max_input_tokens: Optional[int] = 5_000_000
+    max_output_tokens: Optional[int] = 200_000
+    steps: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    input_tokens_at_start: int = 0
+    output_tokens_at_start: int = 0
+
+    @staticmethod
+    def _prompt_tokens(usage: UsageStats) -> int:
+        return usage.input_tokens + usage.cache_creation_input_tokens + usage.cache_read_input_tokens
+
+    def restart(self, usage: Optional[UsageStats] = None):
+        """Start counting a new task from the current usage"""
+        self.steps = 0
+        self.started_at = time.monotonic()
+        self.input_tokens_at_start = self._prompt_tokens(usage) if usage is not None else 0
+        self.output_tokens_at_start = usage.output_tokens if usage is not None else 0
+
+    def _usage(self, usage: UsageStats) -> List[tuple[str, float, Optional[float]]]:
+        """(name, used, limit) of every budget"""
+        return [
+            ("steps", self.steps, self.max_steps),
+            ("seconds", time.monotonic() - self.started_at, self.max_seconds),
+            ("input tokens", self._prompt_tokens(usage) - self.input_tokens_at_start, self.max_input_tokens),
+            ("output tokens", usage.output_tokens - self.output_tokens_at_start, self.max_output_tokens),
+        ]
+
+    def exceeded(self, usage: UsageStats) -> Optional[str]:
+        """Why the session has to stop, or None while every budget has room left"""
+        for name, used, limit in self._usage(usage):
+            if limit is not None and used >= limit:
+                return f"{name} budget exhausted ({used:,.0f} of {limit:,.0f})"
+        return None
+
+    def report(self, usage: UsageStats) -> str:
+        """One-line description of the used and available budgets"""
+        return ", ".join(
+            f"{name} {used:,.0f}/{limit:,.0f} ({used / limit:.0%})" if limit else f"{name} {used:,.0f} (unlimited)"
+            for name, used, limit in self._usage(usage)
+        )
+
+class LoopDetector:
+    """
+    Spots the model repeating the same turns while the screen does not change
+    
+    Each turn is recorded as its tool calls plus the fingerprint of the last
+    screen sent to the model. When the latest 1 to `max_period` turns have
+    been repeated `hint_after` times in a row on near-identical screens,
+    `record` answers "hint" (the loop adds a corrective note for the model);
+    from `abort_after` repetitions it answers "abort".
+    """
+    HINT = ("<system>You have repeated the same {period} step(s) {repeats} times and the screen did not change. "
+            "This approach is not working: take a screenshot to check the current state, then try different "
+            "coordinates or a different action, or finish if the task is already done.</system>")
+
+    def __init__(self, similar: Callable[[FrameFingerprint, FrameFingerprint], bool],
+                 hint_after: int = 3, abort_after: int = 5, max_period: int = 3):
+        self.similar = similar
+        self.hint_after = hint_after
+        self.abort_after = abort_after
+        self.max_period = max_period
+        self.hints = 0
+        self._turns: deque[tuple[str, Optional[FrameFingerprint]]] = deque(maxlen=abort_after * max_period)
+
+    def reset(self):
+        self.hints = 0
+        self._turns.clear()
+
+    def _same(self, first: tuple[str, Optional[FrameFingerprint]], second: tuple[str, Optional[FrameFingerprint]]) -> bool:
+        if first[0] != second[0]:
+            return False
+        if first[1] is None or second[1] is None:
+            return first[1] is second[1]
+        return self.similar(first[1], second[1])
+
+    def record(self, tool_calls: List[Dict[str, Any]],
+               screen: Optional[FrameFingerprint]) -> tuple[Literal["ok", "hint", "abort"], int, int]:
+        """Add a turn and return the verdict with the period and repetitions of the longest loop"""
+        actions = json.dumps([[call.get("name"), call.get("input")] for call in tool_calls], sort_keys=True, default=str)
+        self._turns.append((actions, screen))
+        turns = list(self._turns)
+        best_period, best_repeats = 1, 1
+        for period in range(1, self.max_period + 1):
+            block = turns[-period:]
+            repeats = 1
+            while len(turns) >= (repeats + 1) * period and all(
+                    self._same(turns[-(repeats + 1) * period + index], block[index]) for index in range(period)):
+                repeats += 1
+            if repeats > best_repeats:
+                best_period, best_repeats = period, repeats
+        if best_repeats >= self.abort_after:
+            return "abort", best_period, best_repeats
+        if best_repeats >= self.hint_after:
+            self.hints += 1
+            return "hint", best_period, best_repeats
+        return "ok", best_period, best_repeats
+
+TURN_CACHE_DIR = Path(__file__).resolve().parent / "turn_cache"
+
+def _evict_lru_files(sizes: Dict[Path, int], max_bytes: int) -> int:
+    """Delete least recently used (oldest mtime) files of sizes until they fit in max_bytes; returns how many"""
+    total = sum(sizes.values())
+    if total <= max_bytes:
+        return 0
+    for path in [path for path in sizes if not path.exists()]:
+        total -= sizes.pop(path)
+    evicted = 0
+    for path in sorted(sizes, key=lambda p: p.stat().st_mtime):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= sizes.pop(path)
+        evicted += 1
+    return evicted
+
+class TurnCache:
+    """
+    On-disk record/replay cache of model turns
+    
+    A turn is keyed by the instruction (first user message without the
+    compaction summary) and the tool calls made so far, including those of
+    turns ConversationHistory removed; each entry also stores the fingerprint of the last screen sent
+    to the model. In "replay" mode a request whose key matches and whose screen
+    is at least `screen_similarity` alike (share of fingerprint blocks within
+    `block_tolerance` gray levels) is answered from the cache; otherwise the
+    live model is used and its response recorded. "record" mode only records.
+    The least recently used entries are deleted above `max_bytes`.
+    """
+    def __init__(self, directory: str | Path = TURN_CACHE_DIR, mode: Literal["record", "replay"] = "replay",
+                 screen_similarity: float = 0.98, block_tolerance: int = 12, max_bytes: int = 256 * 1024 * 1024):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown turn cache mode: {mode}")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.mode = mode
+        self.screen_similarity = screen_similarity
+        self.block_tolerance = block_tolerance
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._sizes: Dict[Path, int] = {path: path.stat().st_size for path in self.directory.glob("*.json")}
+
+    @classmethod
+    def key(cls, messages: List[Any], dropped_actions: List[list] = ()) -> str:
+        """
+        Fingerprint of the instruction and the tool calls made so far
+        
+        dropped_actions are the tool calls of turns removed by compaction
+        (ConversationHistory.dropped_actions); the summary compaction appends
+        to the first message is ignored, so the key is the same whether or not
+        the conversation was compacted.
+        """
+        instruction = ""
+        content = _as_dict(messages[0]).get("content", "") if messages else ""
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        for block in content:
+            block = _as_dict(block)
+            text = block.get("text", "") if block.get("type") == "text" else ""
+            if not text.startswith(f"<{ConversationHistory.SUMMARY_TAG}>"):
+                instruction += text
+        actions = [*dropped_actions, *cls.actions(messages[1:])]
+        payload = json.dumps({"instruction": instruction, "actions": actions}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def actions(messages: List[Any]) -> List[list]:
+        """[name, input] of every tool call in the assistant messages"""
+        actions = []
+        for message in messages:
+            message = _as_dict(message)
+            if message.get("role") != "assistant" or isinstance(message.get("content"), str):
+                continue
+            for block in message.get("content", []):
+                block = _as_dict(block)
+                if block.get("type") == "tool_use":
+                    actions.append([block.get("name"), block.get("input")])
+        return actions
+
+    def lookup(self, key: str, screen: Optional[FrameFingerprint]) -> Optional[Dict[str, Any]]:
+        """Cached response for key recorded on a similar screen, or None"""
+        if self.mode != "replay":
+            return None
+        for path in sorted(self.directory.glob(f"{key}-*.json"), key=lambda p: p.stat().st_mtime, reverse=True):
+            try:
+                entry = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            if self._screen_matches(entry.get("screen"), screen):
+                self.hits += 1
+                os.utime(path)
+                return entry["response"]
+        self.misses += 1
+        return None
+
+    def store(self, key: str, screen: Optional[FrameFingerprint], response: Any):
+        """Record the response of a live request"""
+        screen_data = None
+        if screen is not None:
+            screen_data = {"grid": list(screen.grid), "thumbnail": base64.b64encode(screen.thumbnail).decode()}
+        entry = {"key": key, "created": datetime.now().isoformat(timespec="seconds"),
+                 "screen": screen_data, "response": _as_dict(response)}
+        screen_id = screen.digest[:12] if screen is not None else "noscreen"
+        path = self.directory / f"{key}-{screen_id}.json"
+        data = json.dumps(entry, default=str)
+        path.write_text(data, encoding="utf-8")
+        self._sizes[path] = len(data)
+        self.stores += 1
+        self._evict()
+
+    def _screen_matches(self, stored: Optional[Dict[str, Any]], screen: Optional[FrameFingerprint]) -> bool:
+        if stored is None or screen is None:
+            return stored is None and screen is None
+        if tuple(stored["grid"]) != screen.grid:
+            return False
+        recorded = np.frombuffer(base64.b64decode(stored["thumbnail"]), dtype=np.uint8).astype(np.int16)
+        current = np.frombuffer(screen.thumbnail, dtype=np.uint8).astype(np.int16)
+        return float(np.mean(np.abs(recorded - current) <= self.block_tolerance)) >= self.screen_similarity
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        self.evictions += _evict_lru_files(self._sizes, self.max_bytes)
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of replay lookups answered from the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self) -> str:
+        """One-line description of the cache activity"""
+        return (f"{self.mode}: {self.hits} hits, {self.misses} misses (hit rate {self.hit_rate:.0%}), "
+                f"{self.stores} stored, {self.evictions} evicted, "
+                f"{sum(self._sizes.values()) / 1024 / 1024:.1f} MB in {len(self._sizes)} entries")
+
+IMAGE_BLOB_DIR = Path(__file__).resolve().parent / "image_blobs"
+SESSION_DIR = Path(__file__).resolve().parent / "sessions"
+
+class ImageBlobStore:
+    """
+    Content-addressed on-disk store of encoded screenshots
+    
+    Tool results keep a small "blob" image source (digest, media type and
+    pixel size) in the message list instead of the base64 data, and `expand`
+    swaps the base64 data back in on the copy of the messages sent with a
+    request. Only the images of the request being built are held in memory,
+    and checkpointed sessions stay small. Blobs are named by the SHA-256 of
+    their bytes, so identical frames are stored once and shared by sessions.
+    The base64 form of recently used blobs is kept in a small LRU; the least
+    recently used blobs are deleted above `max_bytes`.
+    """
+    MISSING_PLACEHOLDER = "[screenshot no longer available]"
+
+    def __init__(self, directory: str | Path = IMAGE_BLOB_DIR, max_bytes: int = 512 * 1024 * 1024,
+                 cache_size: int = 4):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.cache_size = cache_size
+        self.stores = 0
+        self.reuses = 0
+        self.missing = 0
+        self.evictions = 0
+        self._encoded: OrderedDict[str, str] = OrderedDict()
+        self._sizes: Dict[Path, int] = {path: path.stat().st_size for path in self.directory.glob("*/*")
+                                        if "." not in path.name}
+
+    def _path(self, digest: str) -> Path:
+        return self.directory / digest[:2] / digest[2:]
+
+    def put(self, data: bytes, media_type: str, encoded: Optional[str] = None) -> Dict[str, Any]:
+        """Store encoded image bytes and return the blob image source referencing them"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if path.exists():
+            os.utime(path)
+            self.reuses += 1
+        else:
+            path.parent.mkdir(exist_ok=True)
+            temporary = path.parent / f".{path.name}.{os.getpid()}.tmp"
+            temporary.write_bytes(data)
+            os.replace(temporary, path)
+            self._sizes[path] = len(data)
+            self.stores += 1
+            self._evict()
+        if encoded is not None:
+            self._remember(digest, encoded)
+        try:
+            width, height = Image.open(BytesIO(data)).size
+        except Exception:
+            width = height = None
+        return {"type": "blob", "media_type": media_type, "digest": digest, "width": width, "height": height}
+
+    def put_base64(self, encoded: str, media_type: str) -> Dict[str, Any]:
+        """Store a base64 encoded image (as produced by ComputerTool)"""
+        return self.put(base64.b64decode(encoded), media_type, encoded)
+
+    def data(self, digest: str) -> Optional[str]:
+        """Base64 data of a blob, or None if it was deleted"""
+        encoded = self._encoded.get(digest)
+        if encoded is not None:
+            self._encoded.move_to_end(digest)
+            return encoded
+        try:
+            raw = self._path(digest).read_bytes()
+        except FileNotFoundError:
+            self.missing += 1
+            return None
+        encoded = base64.b64encode(raw).decode()
+        self._remember(digest, encoded)
+        return encoded
+
+    def expand(self, messages: List[Any]) -> List[Any]:
+        """Messages with blob image sources replaced by base64 data; messages without blobs are not copied"""
+        expanded = []
+        for message in messages:
+            content = message.get("content") if isinstance(message, dict) else None
+            blocks = self._expand_blocks(content) if isinstance(content, list) else None
+            expanded.append(message if blocks is None else {**message, "content": blocks})
+        return expanded
+
+    def _expand_blocks(self, blocks: List[Any]) -> Optional[List[Any]]:
+        """Expanded copy of a content list, or None if it holds no blob sources"""
+        result = None
+        for index, block in enumerate(blocks):
+            if not isinstance(block, dict):
+                continue
+            replacement = None
+            if block.get("type") == "image" and block.get("source", {}).get("type") == "blob":
+                source = block["source"]
+                data = self.data(source["digest"])
+                if data is None:
+                    replacement = {"type": "text", "text": self.MISSING_PLACEHOLDER}
+                else:
+                    replacement = {**block, "source": {"type": "base64", "media_type": source["media_type"], "data": data}}
+            elif block.get("type") == "tool_result" and isinstance(block.get("content"), list):
+                content = self._expand_blocks(block["content"])
+                if content is not None:
+                    replacement = {**block, "content": content}
+            if replacement is not None:
+                if result is None:
+                    result = list(blocks)
+                result[index] = replacement
+        return result
+
+    def _remember(self, digest: str, encoded: str):
+        self._encoded[digest] = encoded
+        self._encoded.move_to_end(digest)
+        while len(self._encoded) > self.cache_size:
+            self._encoded.popitem(last=False)
+
+    def _evict(self):
+        """Delete least recently used blobs until the store fits in max_bytes"""
+        self.evictions += _evict_lru_files(self._sizes, self.max_bytes)
+
+    def summary(self) -> str:
+        """One-line description of the store activity"""
+        return (f"{self.stores} stored, {self.reuses} reused, {self.missing} missing, {self.evictions} evicted, "
+                f"{sum(self._sizes.values()) / 1024 / 1024:.1f} MB in {len(self._sizes)} blobs")
+
+class SessionCheckpoint:
+    """
+    Incremental on-disk record of a session, used to resume it after a crash or Ctrl+C
+    
+    `sessions/<session_id>/messages.jsonl` gets one line per message as it is
+    added to the conversation (with an ImageBlobStore the images are blob
+    references, so lines stay small) and `meta.json` the instructions and
+    status. `resume` reloads the messages and repairs an interrupted turn:
+    tool calls without results are answered with an error, since it is not
+    known whether they ran, and the model is told the screen may have changed.
+    """
+    INTERRUPTED = ("The session was interrupted before this tool call finished, so it may or may not have run. "
+                   "Take a screenshot to check the current state.")
+    RESUMED = "<system>The session was resumed after an interruption; the screen may have changed since the last screenshot.</system>"
+
+    def __init__(self, session_id: Optional[str] = None, directory: str | Path = SESSION_DIR):
+        self.session_id = session_id or f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.urandom(3).hex()}"
+        self.path = Path(directory) / self.session_id
+        self.messages_path = self.path / "messages.jsonl"
+        self.meta_path = self.path / "meta.json"
+        self._meta: Dict[str, Any] = {}
+
+    def exists(self) -> bool:
+        return self.messages_path.exists()
+
+    @property
+    def status(self) -> Optional[str]:
+        """running, finished or interrupted once the session started or resumed"""
+        return self._meta.get("status")
+
+    def start(self, messages: List[Any]):
+        """Write the initial messages of a new session"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        first = _as_dict(messages[0]) if messages else {}
+        instructions = " ".join(block.get("text", "") for block in first.get("content", []) if isinstance(block, dict))
+        self._meta = {"session_id": self.session_id, "created": datetime.now().isoformat(timespec="seconds"),
+                      "instructions": instructions[:1000], "status": "running", "messages": 0}
+        self._rewrite(messages)
+
+    def append(self, message: Any):
+        """Add one message to the checkpoint"""
+        with open(self.messages_path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(self._jsonable(message), default=str) + "\n")
+        self._meta["messages"] = self._meta.get("messages", 0) + 1
+        self._write_meta()
+
+    def finish(self, status: str):
+        """Record how the session ended (finished, interrupted or failed)"""
+        if self._meta:
+            self._meta["status"] = status
+            self._write_meta()
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Checkpointed messages; a line cut short by a crash is ignored"""
+        messages = []
+        for line in self.messages_path.read_text(encoding="utf-8").splitlines():
+            try:
+                messages.append(json.loads(line))
+            except ValueError:
+                break
+        return messages
+
+    def resume(self) -> List[Dict[str, Any]]:
+        """Messages to continue the session with, repaired and written back"""
+        if not self.exists():
+            raise ValueError(f"No checkpoint for session {self.session_id} in {self.path.parent}")
+        if self.meta_path.exists():
+            self._meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+        messages = self.load()
+        if not messages:
+            raise ValueError(f"Checkpoint of session {self.session_id} is empty")
+        last = messages[-1]
+        calls = [block for block in last.get("content", []) if isinstance(block, dict) and block.get("type") == "tool_use"]
+        if last.get("role") == "assistant" and calls:
+            messages.append({"role": "user", "content": [
+                {"type": "tool_result", "tool_use_id": call.get("id"), "is_error": True,
+                 "content": [{"type": "text", "text": self.INTERRUPTED}]}
+                for call in calls
+            ]})
+        if messages[-1].get("role") == "user":
+            content = messages[-1]["content"]
+            if isinstance(content, str):
+                content = messages[-1]["content"] = [{"type": "text", "text": content}]
+            content.append({"type": "text", "text": self.RESUMED})
+            self._meta["status"] = "running"
+            self._meta["resumed"] = self._meta.get("resumed", 0) + 1
+        self._rewrite(messages)
+        return messages
+
+    @staticmethod
+    def _jsonable(message: Any) -> Dict[str, Any]:
+        """Message as plain JSON data (SDK content blocks without their unset fields)"""
+        message = _as_dict(message)
+        content = message.get("content")
+        if isinstance(content, list):
+            content = [block.model_dump(mode="json", exclude_none=True) if hasattr(block, "model_dump") else block
+                       for block in content]
+        return {**message, "content": content}
+
+    def _rewrite(self, messages: List[Any]):
+        """Replace the message log atomically"""
+        temporary = self.messages_path.with_suffix(".tmp")
+        temporary.write_text("".join(json.dumps(self._jsonable(message), default=str) + "\n" for message in messages),
+                             encoding="utf-8")
+        os.replace(temporary, self.messages_path)
+        self._meta["messages"] = len(messages)
+        self._write_meta()
+
+    def _write_meta(self):
+        self._meta["updated"] = datetime.now().isoformat(timespec="seconds")
+        self.meta_path.write_text(json.dumps(self._meta, indent=2), encoding="utf-8")
+
+@dataclass(frozen=True)
+class ClientConfig:
+    """
+    HTTP settings for the shared async Anthropic client
+    
+    Retries use the SDK's exponential backoff, which honours the retry-after
+    headers of 429 and 5xx responses. base_url can point at a local server
+    for testing.
+    """
+    timeout: float = 120.0
+    connect_timeout: float = 10.0
+    max_retries: int = 4
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    base_url: Optional[str] = None
+
+class RateLimitGate:
+    """
+    Pauses new requests while the API reports an exhausted rate limit
+    
+    Reads the anthropic-ratelimit-*-remaining / *-reset response headers; when
+    a limit is at zero, requests made through any session sharing the gate
+    wait until the reported reset time.
+    """
+    LIMITS = ("requests", "tokens", "input-tokens", "output-tokens")
+
+    def __init__(self, max_wait: float = 60.0):
+        self.max_wait = max_wait
+        self._resume_at = 0.0
+
+    def update(self, headers: Any):
+        """Record the rate limit state reported by a response"""
+        for limit in self.LIMITS:
+            remaining = headers.get(f"anthropic-ratelimit-{limit}-remaining")
+            reset = headers.get(f"anthropic-ratelimit-{limit}-reset")
+            if remaining is None or reset is None:
+                continue
+            try:
+                if int(remaining) > 0:
+                    continue
+                reset_at = datetime.fromisoformat(reset.replace("Z", "+00:00")).timestamp()
+            except ValueError:
+                continue
+            self._resume_at = max(self._resume_at, reset_at)
+
+    async def wait(self):
+        """Sleep until the most recent exhausted limit resets (capped at max_wait)"""
+        delay = min(self._resume_at - time.time(), self.max_wait)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+_shared_clients: Dict[tuple, tuple[anthropic.AsyncAnthropic, RateLimitGate]] = {}
+
+def _current_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+def get_shared_client(api_key: str, config: Optional[ClientConfig] = None) -> tuple[anthropic.AsyncAnthropic, RateLimitGate]:
+    """
+    Return the shared async client (and its rate limit gate) for api_key and config
+    
+    The client keeps a pooled HTTP transport, so all sessions created with the
+    same key and configuration share connections. Pooled connections belong
+    to the event loop they were opened on, so there is one client per running
+    loop; clients of loops that have been closed are dropped.
+    """
+    config = config or ClientConfig()
+    loop = _current_loop()
+    for stale in [key for key in _shared_clients if key[2] is not None and key[2].is_closed()]:
+        del _shared_clients[stale]
+    key = (api_key, config, loop)
+    if key not in _shared_clients:
+        # The SDK re-exports its HTTP types; DEFAULT_CONNECTION_LIMITS gives the Limits class without importing it
+        limits = type(anthropic.DEFAULT_CONNECTION_LIMITS)(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+        )
+        client = anthropic.AsyncAnthropic(
+            api_key=api_key,
+            base_url=config.base_url,
+            max_retries=config.max_retries,
+            timeout=anthropic.Timeout(config.timeout, connect=config.connect_timeout),
+            http_client=anthropic.DefaultAsyncHttpxClient(limits=limits),
+        )
+        _shared_clients[key] = (client, RateLimitGate())
+    return _shared_clients[key]
+
+async def close_shared_clients():
+    """Close the shared clients of the running event loop and their connection pools"""
+    loop = _current_loop()
+    clients = [_shared_clients.pop(key) for key in [key for key in _shared_clients if key[2] in (loop, None)]]
+    for client, _ in clients:
+        await client.close()
+
+def _plain_log(text: str, color: Optional[str] = None, **kwargs):
+    """Log without colors, with the same signature as termcolor.cprint"""
+    print(text, **kwargs)
+
+def _as_dict(value: Any) -> Dict[str, Any]:
+    """Return API objects (SDK models or plain dicts) as dicts"""
+    if isinstance(value, dict):
+        return value
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return {}
+
+def _import_agent_module(name: str) -> Any:
+    """
+    Import a module that sits next to this file, such as get_cordinates
+    
+    It is loaded by path, so it does not matter whether this directory is on
+    sys.path (e.g. when use_yourself is imported from the project root).
+    """
+    import sys
+    import importlib.util
+    if name in sys.modules:
+        return sys.modules[name]
+    path = Path(__file__).resolve().with_name(f"{name}.py")
+    if not path.exists():
+        raise ImportError(f"{path} not found", name=name, path=str(path))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
+
+def locate_input_coordinates(computer_tool: ComputerTool, template: str = INPUT_TEMPLATE) -> str:
+    """
+    Virtual coordinates of the input box found by its saved template, or the COORDINATES fallback
+    
+    Failing to import get_cordinates is an installation error and is raised;
+    only a missing template or a failed search fall back to COORDINATES.
+    """
+    TemplateLocator = _import_agent_module("get_cordinates").TemplateLocator
+    try:
+        locator = TemplateLocator()
+        if not locator.has_template(template):
+            return COORDINATES
+        image = computer_tool.backend.grab()
+        match = locator.locate(template, image)
+    except Exception as e:
+        print(f"Could not locate the input box template: {str(e)}")
+        return COORDINATES
+    if match is None:
+        print(f"Input box template '{template}' not found on screen, using {COORDINATES}")
+        return COORDINATES
+    x = int(match.x * computer_tool.width / image.width)
+    y = int(match.y * computer_tool.height / image.height)
+    print(f"Located input box at x={x}, y={y} (score {match.score:.2f}, {match.elapsed_ms:.0f} ms"
+          f"{', cached' if match.cached else ''})")
+    return f"x={x}, y={y}"
+
+class ToolDispatcher:
+    """
+    Schedules the tool calls of one assistant turn by the resource they use
+    
+    - computer and computer_batch calls share the screen and run strictly in order
+    - file views run concurrently, waiting only for earlier writes to the same file
+    - file writes wait for all earlier calls on the same file
+    - any other call waits for every earlier call
+    
+    results() returns the results in submission (tool_use) order.
+    """
+    SCREEN_TOOLS = ("computer", "computer_batch")
+    READ_COMMANDS = ("view",)
+
+    def __init__(self, run_call: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]):
+        self.run_call = run_call
+        self.tasks: List[asyncio.Task] = []
+        self._screen: Optional[asyncio.Task] = None
+        self._writes: Dict[str, asyncio.Task] = {}
+        self._reads: Dict[str, List[asyncio.Task]] = {}
+        self._barrier: Optional[asyncio.Task] = None
+
+    @classmethod
+    def resource(cls, tool_call: Dict[str, Any]) -> tuple[str, Optional[str]]:
+        """("screen" | "read" | "write" | "exclusive", file path) of a tool call"""
+        name = tool_call.get("name")
+        tool_input = tool_call.get("input") or {}
+        if name in cls.SCREEN_TOOLS:
+            return "screen", None
+        if name == EditTool.name and isinstance(tool_input.get("path"), str):
+            path = os.path.normpath(tool_input["path"])
+            return ("read" if tool_input.get("command") in cls.READ_COMMANDS else "write"), path
+        return "exclusive", None
+
+    def submit(self, tool_call: Dict[str, Any]) -> asyncio.Task:
+        """Start the call once the earlier calls it depends on have finished"""
+        kind, path = self.resource(tool_call)
+        if kind == "screen":
+            dependencies = [self._screen] if self._screen else []
+        elif kind == "read":
+            dependencies = [self._writes[path]] if path in self._writes else []
+        elif kind == "write":
+            dependencies = ([self._writes[path]] if path in self._writes else []) + self._reads.pop(path, [])
+        else:
+            dependencies = list(self.tasks)
+        if self._barrier is not None and kind != "exclusive":
+            dependencies.append(self._barrier)
+
+        async def run():
+            if dependencies:
+                await asyncio.wait(dependencies)
+            return await self.run_call(tool_call)
+
+        task = asyncio.create_task(run())
+        self.tasks.append(task)
+        if kind == "screen":
+            self._screen = task
+        elif kind == "read":
+            self._reads.setdefault(path, []).append(task)
+        elif kind == "write":
+            self._writes[path] = task
+        else:
+            self._barrier = task
+        return task
+
+    async def results(self) -> List[Dict[str, Any]]:
+        """Wait for all calls and return their results in submission order"""
+        return list(await asyncio.gather(*self.tasks))
+
+    def cancel(self):
+        """Cancel calls that have not finished"""
+        for task in self.tasks:
+            task.cancel()
 
 class ComputerControlAPI:
     """
     Main API class for computer control interface
     
     Manages:
-    - Communication with Anthropic's Claude API
+    - Communication with Anthropic's Claude API through a shared async client
     - Tool coordination (ComputerTool and EditTool)
     - Conversation flow and message handling
+    - Conversation history compaction
+    - Prompt caching of the stable request prefix
     - Tool execution and result processing
+    
+    The system prompt and tool definitions are built once per session so every
+    request shares an identical prefix. Cache breakpoints are placed on the
+    system prompt, the tool list and the last message, and the cache usage
+    reported by each response is accumulated in `usage`.
+    
+    With stream=True the response is streamed: plan text is printed as it
+    arrives and each tool call starts as soon as its input is complete.
+    
+    tool_call_delay is the pause after each computer action before the next
+    tool call when the computer tool does not wait for the screen to settle;
+    file edits are never delayed.
+    
+    Turns, model requests, history compaction and tool calls are traced as
+    spans on `tracer`, which is shared with the computer tool.
+    
+    With a TurnCache, turns are recorded to disk and (in replay mode) served
+    from it when the instruction, prior tool calls and screen match.
+    
+    The input box coordinates put into the system prompt are located on the
+    current screen from the saved template (see get_cordinates.py) unless
+    given as input_coordinates.
+    
+    With an ImageBlobStore, screenshots are kept in the message list as blob
+    references and only expanded to base64 on the copy sent with a request.
+    
+    The conversation loops count every turn against `budget` and feed it to a
+    LoopDetector (see track_turn); they stop with BudgetExceeded when a
+    limit is reached or the model is stuck.
     """
-    def __init__(self, api_key: str, model: str = "claude-3-5-sonnet-20241022"):
+    BETA_FLAGS = "computer-use-2024-10-22,prompt-caching-2024-07-31"
+    CACHE_CONTROL = {"type": "ephemeral"}
+
+    def __init__(self, api_key: str, model: str = "claude-3-5-sonnet-20241022",
+                 history: Optional[ConversationHistory] = None, max_tokens: int = 4096,
+                 stream: bool = False, client_config: Optional[ClientConfig] = None,
+                 computer_tool: Optional[ComputerTool] = None, tool_call_delay: float = 0.5,
+                 tracer: Optional[Tracer] = None, turn_cache: Optional[TurnCache] = None,
+                 input_coordinates: Optional[str] = None, blob_store: Optional[ImageBlobStore] = None,
+                 budget: Optional[SessionBudget] = None, loop_detector: Optional[LoopDetector] = None):
         """Initialize API with authentication and tools"""
-        self.client = anthropic.Anthropic(api_key=api_key)
+        self.client, self.rate_limits = get_shared_client(api_key, client_config)
         self.model = model
-        self.computer_tool = ComputerTool()
+        self.max_tokens = max_tokens
+        self.stream = stream
+        self.tool_call_delay = tool_call_delay
+        self.computer_tool = computer_tool or ComputerTool()
+        self.tracer = tracer or self.computer_tool.tracer
+        self.turn_cache = turn_cache
+        self.blob_store = blob_store
+        self.computer_tool.tracer = self.tracer
+        self.batch_tool = ComputerBatchTool(self.computer_tool)
         self.edit_tool = EditTool()
+        self._tool_map = {
+            self.computer_tool.name: self.computer_tool,
+            self.batch_tool.name: self.batch_tool,
+            self.edit_tool.name: self.edit_tool,
+        }
+        self.history = history or ConversationHistory()
+        self.usage = UsageStats()
+        self.budget = budget or SessionBudget()
+        self.loop_detector = loop_detector or LoopDetector(self.computer_tool.frame_hasher.is_similar)
+        self._fixed_coordinates = input_coordinates is not None
+        self.input_coordinates = input_coordinates or locate_input_coordinates(self.computer_tool)
+        
+        # Stable request prefix, built once per session
+        self.system_prompt = self._get_system_prompt()
+        self.system = [{"type": "text", "text": self.system_prompt, "cache_control": self.CACHE_CONTROL}]
+        self.tools = [self.computer_tool.to_params(), self.batch_tool.to_params(), self.edit_tool.to_params()]
+        self.tools[-1] = {**self.tools[-1], "cache_control": self.CACHE_CONTROL}
+
+    def new_session(self):
+        """
+        Start over for the next instructions while keeping the client, tools and caches warm
+
+        Token usage, history counters and remembered file views are reset, and
+        the input box is located again (unless its coordinates were given);
+        the system prompt only changes when the box moved or the date changed.
+        """
+        self.usage = UsageStats()
+        self.reset_conversation()
+        if not self._fixed_coordinates:
+            self.input_coordinates = locate_input_coordinates(self.computer_tool)
+        system_prompt = self._get_system_prompt()
+        if system_prompt != self.system_prompt:
+            self.system_prompt = system_prompt
+            self.system = [{"type": "text", "text": system_prompt, "cache_control": self.CACHE_CONTROL}]
+        
+    def reset_conversation(self):
+        """
+        Clear every piece of state that belongs to one conversation
+        
+        Budget and loop detection start over, history counters and remembered
+        file views are dropped, and the computer tool forgets the frames it sent,
+        so the next screenshot is a full keyframe.
+        """
+        self.budget.restart(self.usage)
+        self.loop_detector.reset()
+        self.history.images_pruned = self.history.turns_summarized = 0
+        self.history.dropped_actions.clear()
+        self.edit_tool.forget_views()
+        self.computer_tool.forget_frames()
+
+    def track_turn(self, tool_calls: List[Dict[str, Any]], tool_results: List[Dict[str, Any]],
+                   log: Callable[..., None]) -> Optional[str]:
+        """
+        Count an executed turn against the budget and watch for stuck loops
+        
+        Appends a corrective hint to tool_results when the model keeps
+        repeating itself on an unchanged screen. Returns why the session has to
+        stop (a budget is exhausted or the loop went on after the hints), else None.
+        """
+        self.budget.steps += len(tool_calls)
+        verdict, period, repeats = self.loop_detector.record(tool_calls, self.computer_tool._last_sent_fingerprint)
+        if verdict == "abort":
+            return f"stuck: the same {period} step(s) were repeated {repeats} times without the screen changing"
+        if verdict == "hint":
+            log(f"\n[Stuck-loop hint: {period} step(s) repeated {repeats} times]", "magenta")
+            tool_results.append({"type": "text", "text": LoopDetector.HINT.format(period=period, repeats=repeats)})
+        return self.budget.exceeded(self.usage)
+
+    def _build_request(self, messages: List[Any]) -> Dict[str, Any]:
+        """Compact the history in place and build the request parameters"""
+        summarized = self.history.turns_summarized
+        with self.tracer.span("compact", messages=len(messages)) as span:
+            span.attributes["estimated_tokens"] = self.history.compact(messages)
+        if self.history.turns_summarized != summarized:
+            # Earlier file views may be gone, so "unchanged" answers would mislead
+            self.edit_tool.forget_views()
+        if self.blob_store is not None:
+            with self.tracer.span("expand_images"):
+                messages = self.blob_store.expand(messages)
+        return {
+            "model": self.model,
+            "messages": cast("List[MessageParam]", self._with_cache_breakpoint(messages)),
+            "system": self.system,
+            "tools": self.tools,
+            "max_tokens": self.max_tokens,
+            "extra_headers": {"anthropic-beta": self.BETA_FLAGS},
+        }
+
+    async def _create_message(self, messages: List[Any]):
+        """
+        Send the conversation to the API
+        
+        Compacts the history in place, marks the last message as a cache
+        breakpoint (on a copy, so stored messages stay unmarked) and records
+        the reported usage.
+        """
+        request = self._build_request(messages)
+        await self.rate_limits.wait()
+        raw = await self.client.beta.messages.with_raw_response.create(**request)
+        self.rate_limits.update(raw.headers)
+        response = await raw.parse()
+        self.usage.record(response.usage)
+        return response
+
+    async def _stream_message(self, messages: List[Any], on_text: Callable[[str], None],
+                              on_tool_use: Callable[[Any], None]):
+        """
+        Stream the response to the conversation
+        
+        on_text receives text deltas as they arrive and on_tool_use receives each
+        tool_use block as soon as its input JSON is complete, so tools started
+        from on_tool_use run while the rest of the response is still being
+        generated. Returns the final message.
+        """
+        request = self._build_request(messages)
+        await self.rate_limits.wait()
+        async with self.client.beta.messages.stream(**request) as stream:
+            response_headers = getattr(getattr(stream, "response", None), "headers", None)
+            if response_headers is not None:
+                self.rate_limits.update(response_headers)
+            async for event in stream:
+                if event.type == "text":
+                    on_text(event.text)
+                elif event.type == "content_block_stop":
+                    block = stream.current_message_snapshot.content[event.index]
+                    if block.type == "tool_use":
+                        on_tool_use(block)
+            response = await stream.get_final_message()
+        self.usage.record(response.usage)
+        return response
+
+    async def _run_turn(self, messages: List[Any], log: Callable[..., None]) -> tuple[Any, List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Request one assistant turn and execute its tool calls
         
+        In streaming mode each tool call is started as soon as it is complete
+        in the stream. Calls are scheduled by a ToolDispatcher: screen actions
+        run one at a time in order, independent file views run concurrently.
+        Returns the response, the tool calls and their formatted results (in
+        tool_use order).
+        """
+        with self.tracer.span("turn", messages=len(messages)) as turn:
+            tool_calls: List[Dict[str, Any]] = []
+            dispatcher = ToolDispatcher(lambda tool_call: self._run_tool_call(tool_call, log))
+
+            def start_tool(block: Any):
+                tool_call = {"name": block.name, "input": block.input, "id": block.id}
+                tool_calls.append(tool_call)
+                log(f"\n[Planning: {block.name} - {block.input}]", "yellow")
+                dispatcher.submit(tool_call)
+
+            cache_key = screen = cached = None
+            if self.turn_cache is not None:
+                cache_key = self.turn_cache.key(messages, self.history.dropped_actions)
+                screen = self.computer_tool._last_sent_fingerprint
+                cached = self.turn_cache.lookup(cache_key, screen)
+                turn.attributes["cache_hit"] = cached is not None
+
+            if cached is not None:
+                from anthropic.types.beta import BetaMessage
+                response = BetaMessage.model_validate(cached)
+                log("\n[Turn replayed from cache]", "magenta")
+            elif self.stream:
+                log("\nAssistant's Plan:", "green")
+                try:
+                    with self.tracer.span("model", stream=True) as span:
+                        response = await self._stream_message(
+                            messages,
+                            on_text=lambda text: log(text, "white", end="", flush=True),
+                            on_tool_use=start_tool,
+                        )
+                        span.attributes.update(self._usage_attributes(response.usage))
+                except BaseException:
+                    dispatcher.cancel()
+                    raise
+                log(f"\nTokens: {UsageStats.describe(response.usage)}", "blue")
+            else:
+                with self.tracer.span("model", stream=False) as span:
+                    response = await self._create_message(messages)
+                    span.attributes.update(self._usage_attributes(response.usage))
+                log(f"Tokens: {UsageStats.describe(response.usage)}", "blue")
+
+            if cached is not None or not self.stream:
+                log("\nAssistant's Plan:", "green")
+                for block in response.content:
+                    if hasattr(block, 'text'):
+                        log(f"\n{block.text}", "white")
+                    if hasattr(block, 'type') and block.type == 'tool_use':
+                        start_tool(block)
+            if cache_key is not None and cached is None:
+                self.turn_cache.store(cache_key, screen, response)
+
+            tool_results = await dispatcher.results()
+            turn.attributes["tool_calls"] = len(tool_calls)
+            return response, tool_calls, tool_results
+
+    async def _run_tool_call(self, tool_call: Dict[str, Any], log: Callable[..., None]) -> Dict[str, Any]:
+        """Execute a single tool call and return its formatted tool_result block"""
+        try:
+            tool_name = tool_call.get("name")
+            tool_input = tool_call.get("input", {})
+            
+            # Select appropriate tool
+            tool = self._tool_map.get(tool_name)
+            if tool is None:
+                raise ToolError(f"Unknown tool: {tool_name}")
+            
+            log(f"\nExecuting {tool_name} with input: {tool_input}", "cyan")
+            
+            # Execute tool; file views are blocking reads and run in a worker thread
+            with self.tracer.span("tool", tool=tool_name, action=tool_input.get("action")) as span:
+                if ToolDispatcher.resource(tool_call)[0] == "read":
+                    result = await asyncio.to_thread(self.edit_tool.run, **tool_input)
+                else:
+                    result = await tool(**tool_input)
+                span.attributes.update(image_bytes=self._image_bytes(result), is_error=bool(result.error))
+            
+            # Show results to user
+            if result.error:
+                log(f"\nError: {result.error}", "red")
+            elif result.output:
+                log(f"\nResult: {result.output}", "green")
+            
+            # Small delay between screen actions, unless the tool already waited for the screen to settle
+            if (tool is not self.edit_tool and self.tool_call_delay
+                    and self.computer_tool.settle_detector is None):
+                with self.tracer.span("tool_delay"):
+                    await asyncio.sleep(self.tool_call_delay)
+            
+            return {
+                "type": "tool_result",
+                "tool_use_id": tool_call.get("id"),
+                "is_error": bool(result.error),
+                "content": self._format_tool_result(result)
+            }
+            
+        except Exception as e:
+            log(f"\nError executing tool: {str(e)}", "red")
+            return {
+                "type": "tool_result",
+                "tool_use_id": tool_call.get("id"),
+                "is_error": True,
+                "content": [{"type": "text", "text": f"Tool execution failed: {str(e)}"}]
+            }
+
+    @staticmethod
+    def _usage_attributes(usage: Any) -> Dict[str, int]:
+        """Token counts of a response usage block, for tracing"""
+        return {name: getattr(usage, name, 0) or 0 for name in
+                ("input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens", "output_tokens")}
+
+    @staticmethod
+    def _image_bytes(result: ToolResult) -> int:
+        """Decoded size of the images carried by a tool result"""
+        images = [result.base64_image] if result.base64_image else []
+        images += [region.base64_image for region in result.regions or ()]
+        return sum(len(image) * 3 // 4 for image in images)
+
+    def _with_cache_breakpoint(self, messages: List[Any]) -> List[Any]:
+        """Return messages with a cache breakpoint on the last content block"""
+        if not messages:
+            return messages
+        last = messages[-1]
+        content = last.get("content") if isinstance(last, dict) else None
+        if not isinstance(content, list) or not content or not isinstance(content[-1], dict):
+            return messages
+        marked_block = {**content[-1], "cache_control": self.CACHE_CONTROL}
+        return messages[:-1] + [{**last, "content": content[:-1] + [marked_block]}]
+
     async def run_conversation(self):
         """
         Main conversation loop
@@ -416,9 +3270,9 @@ class ComputerControlAPI:
         Includes error handling and graceful shutdown
         """
         messages = []
-        system = self._get_system_prompt()
         print("\nComputer Control Assistant Initialized")
-        print("Display configured for WXGA resolution (1280x800)")
+        print(f"Display configured for {self.computer_tool.target} resolution "
+              f"({self.computer_tool.width}x{self.computer_tool.height})")
         
         try:
             while True:
@@ -427,39 +3281,16 @@ class ComputerControlAPI:
                     user_input = input("\nWhat would you like me to do? (type 'exit' to quit): ").strip()
                     if user_input.lower() == 'exit':
                         break
+                    # The time spent waiting for the task does not count against the budget
+                    self.budget.restart(self.usage)
                     messages.append({
                         "role": "user",
                         "content": [{"type": "text", "text": user_input}]
                     })
 
                 print("\nProcessing request...")
-                # Get API response
-                response = self.client.beta.messages.create(
-                    model=self.model,
-                    messages=cast(List[MessageParam], messages),
-                    system=system,
-                    tools=[self.computer_tool.to_params(), self.edit_tool.to_params()],
-                    max_tokens=4096,
-                    extra_headers={"anthropic-beta": "computer-use-2024-10-22"}
-                )
-
-                # Process assistant's response
-                tool_calls = []
-                print("\nAssistant's Plan:")
-                
-                # Handle response content
-                for block in response.content:
-                    # Print text responses
-                    if hasattr(block, 'text'):
-                        print(f"\n{block.text}")
-                    # Collect tool calls
-                    if hasattr(block, 'type') and block.type == 'tool_use':
-                        tool_calls.append({
-                            "name": block.name,
-                            "input": block.input,
-                            "id": block.id
-                        })
-                        print(f"\n[Planning: {block.name} - {block.input}]")
+                # Get API response and execute the requested tools
+                response, tool_calls, tool_results = await self._run_turn(messages, _plain_log)
 
                 messages.append({
                     "role": "assistant",
@@ -472,56 +3303,20 @@ class ComputerControlAPI:
                     if user_continue != 'yes':
                         break
                     messages = []
+                    self.reset_conversation()
                     continue
 
-                # Execute tools and collect results
-                tool_results = []
-                for tool_call in tool_calls:
-                    try:
-                        tool_name = tool_call.get("name")
-                        tool_input = tool_call.get("input", {})
-                        
-                        # Select appropriate tool
-                        tool = self.computer_tool if tool_name == "computer" else self.edit_tool
-                        
-                        print(f"\nExecuting {tool_name} with input: {tool_input}")
-                        
-                        # Execute tool
-                        result = await tool(**tool_input)
-                        
-                        # Format and collect results
-                        formatted_result = {
-                            "type": "tool_result",
-                            "tool_use_id": tool_call.get("id"),
-                            "is_error": bool(result.error),
-                            "content": self._format_tool_result(result)
-                        }
-                        
-                        tool_results.append(formatted_result)
-                        
-                        # Show results to user
-                        if result.error:
-                            print(f"\nError: {result.error}")
-                        elif result.output:
-                            print(f"\nResult: {result.output}")
-                        
-                        # Small delay between actions
-                        await asyncio.sleep(0.5)
-                        
-                    except Exception as e:
-                        print(f"\nError executing tool: {str(e)}")
-                        tool_results.append({
-                            "type": "tool_result",
-                            "tool_use_id": tool_call.get("id"),
-                            "is_error": True,
-                            "content": [{"type": "text", "text": f"Tool execution failed: {str(e)}"}]
-                        })
-
+                stop = self.track_turn(tool_calls, tool_results, _plain_log)
                 if tool_results:
                     messages.append({
                         "role": "user",
                         "content": tool_results
                     })
+                if stop:
+                    print(f"\nStopping this task: {stop}")
+                    print(f"Budget: {self.budget.report(self.usage)}")
+                    messages = []
+                    self.reset_conversation()
 
         except KeyboardInterrupt:
             print("\nOperation cancelled by user")
@@ -531,6 +3326,11 @@ class ComputerControlAPI:
                 import traceback
                 traceback.print_exc()
         finally:
+            print(f"\nToken usage: {self.usage.summary()}")
+            print(f"Budget: {self.budget.report(self.usage)}; stuck-loop hints: {self.loop_detector.hints}")
+            print(f"\nPhase timings:\n{self.tracer.format_summary()}")
+            self.tracer.close()
+            self.computer_tool.backend.close()
             print("\nThank you for using Computer Control Assistant!")
 
     def _format_tool_result(self, result: ToolResult) -> List[Dict[str, Any]]:
@@ -549,35 +3349,57 @@ class ComputerControlAPI:
         if result.base64_image:
             content.append({
                 "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/png",
-                    "data": result.base64_image
-                }
+                "source": self._image_source(result.base64_image, result.media_type or "image/png")
+            })
+        
+        for region in result.regions or ():
+            content.append({
+                "type": "text",
+                "text": f"Region at x={region.x}, y={region.y} ({region.width}x{region.height}):"
+            })
+            content.append({
+                "type": "image",
+                "source": self._image_source(region.base64_image, region.media_type)
             })
             
         return content
 
+    def _image_source(self, data: str, media_type: str) -> Dict[str, Any]:
+        """Image source for a tool result: a blob reference with a blob store, else inline base64"""
+        if self.blob_store is not None:
+            return self.blob_store.put_base64(data, media_type)
+        return {"type": "base64", "media_type": media_type, "data": data}
+
+    def _screenshot_policy_note(self) -> str:
+        """Describe when screenshots are returned, for the system prompt"""
+        return {
+            ScreenshotPolicy.ALWAYS: "A screenshot is returned after every action and every batch.",
+            ScreenshotPolicy.END_OF_BATCH: "Single actions return no screenshot; batches return one at the end.",
+            ScreenshotPolicy.ON_REQUEST: "Screenshots are only returned when you take one (screenshot action, or computer_batch with screenshot true).",
+        }[self.computer_tool.screenshot_policy]
+
     def _get_system_prompt(self) -> str:
         """Generate system prompt with current configuration and capabilities"""
         return f"""<SYSTEM_CAPABILITY>
         * YOU ARE USING A CODE EDITOR CALLED CURSOR VERY SIMILAR TO VS CODE. PLEASE INSTRUCT THE AGENT ON THE RIGHT PANEL. you must enter your instructions in the right bottom of the screen. you will be instructing an AI agent there to do what is being asked
         You are not allowed to do file operations. you are only allowed to use the cursor code editor in the window that you see. insert your instructions to the agent there at the bottom right where it says edit code
-        this is the cordinates of the text input box you will be using "x=736, y=673" then you can use enter key
+        this is the cordinates of the text input box you will be using "{self.input_coordinates}" then you can use enter key
         you are only allowed to move to this particular coordinate to input your instructions.
         do not generate code or try to modify file system. simply go to the coordinate and insert insttuctions for cursor agent in plain english as instructed. 
         here are the steps you should take:
-        1- go to the coordinate {COORDINATES}
+        1- go to the coordinate {self.input_coordinates}
         2- click into the text input box (you can only write a single line of insttuctions do not use new lines until you are done with your instructions. only at the very end you use new line(enter key) to submit your instructions)
         3- type in your instructions
         4- press enter to submit your instructions
 * You are utilizing a Windows {platform.machine()} machine.
 * You can control the computer through mouse movements, clicks, and keyboard input.
-* The display is configured for WXGA resolution (1280x800) for consistency.
-* All coordinates you receive and send should be in WXGA resolution - they will be automatically scaled.
+* The display is configured for {self.computer_tool.target} resolution ({self.computer_tool.width}x{self.computer_tool.height}) for consistency.
+* All coordinates you receive and send should be in {self.computer_tool.target} resolution - they will be automatically scaled.
 * After each action you'll receive a screenshot to confirm the result.
 * Each action requires user confirmation via Enter key before execution.
 * You can use both keyboard.send() for special keys and type() for text input.
+* Use the computer_batch tool to send several input actions at once (e.g. move, click, type, enter) with a single screenshot at the end.
+* {self._screenshot_policy_note()}
 </SYSTEM_CAPABILITY>
 
 <IMPORTANT>
@@ -603,140 +3425,149 @@ class ComputerControlAPI:
 The current date is {datetime.now().strftime('%A, %B %d, %Y')}.
 """
 
-async def use_yourself(instructions: str, wait_time: Optional[float] = 0.0, api_key: Optional[str] = None, debug: bool = False) -> None:
+async def run_instructions(api: ComputerControlAPI, instructions: str,
+                           log: Callable[..., None] = _plain_log,
+                           checkpoint: Optional[SessionCheckpoint] = None) -> List[Dict[str, Any]]:
     """
-    Run the computer assistant with given instructions
-    
-    Args:
-        instructions (str): The instructions for the computer assistant to follow
-        wait_time (Optional[float]): Wait time before actions in seconds. None for no wait. Defaults to 5.0
-        api_key (Optional[str]): Anthropic API key. If None, will try to get from environment
-        debug (bool): Enable debug mode for detailed error messages
+    Let the model work on instructions until it stops calling tools
+
+    The restricted input box coordinates are appended to the instructions.
+    With a checkpoint every message is saved as it is added; if the
+    checkpoint already exists the session continues from it and instructions
+    are ignored. The turns are counted against api.budget, which raises
+    BudgetExceeded when a limit is reached or the model is stuck. Returns the
+    messages of the session; errors of the loop propagate.
     """
-    from termcolor import cprint
-
-    # ADD THE RESTRICTED COORDINATES TO INSTRUCTIONS
-    instructions = f"{instructions}\n\nONLY USE THIS COORDINATES {COORDINATES} TO INPUT YOUR INSTRUCTIONS"
-
-    try:
-        # Display warning message
-        cprint("""NOTE: Please be very careful running this script!! this runs locally on your machine(NO SANDBOX) 
-        There is an artificial delay in script before each action so you can review them. 
-        KEEP A WATCHFUL EYE ON IT! AND STOP THE SCRIPT DURING WAIT TIME IF IT TRIES TO DO SOMETHING YOU DONT WANT. 
-        BY RUNNING THIS SCRIPT YOU ASSUME THE RESPONSIBILITY OF THE OUTCOMES""", "red")
+    api.budget.restart(api.usage)
+    api.loop_detector.reset()
+    if checkpoint is not None and checkpoint.exists():
+        messages = checkpoint.resume()
+        log(f"\nResuming session {checkpoint.session_id} after {len(messages)} messages", "magenta")
+        if messages[-1].get("role") == "assistant":
+            log("The session had already finished.", "green")
+            return messages
+    else:
+        # ADD THE RESTRICTED COORDINATES TO INSTRUCTIONS
+        instructions = f"{instructions}\n\nONLY USE THIS COORDINATES {api.input_coordinates} TO INPUT YOUR INSTRUCTIONS"
 
-        # Configure global wait time
-        global WAIT_BEFORE_ACTION
-        WAIT_BEFORE_ACTION = wait_time
-
-        # Configure PyAutoGUI safety features
-        pyautogui.FAILSAFE = True
-        pyautogui.PAUSE = 0.1
-
-        # Get API key
-        final_api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
-        if not final_api_key:
-            raise ValueError("API key must be provided either as parameter or in ANTHROPIC_API_KEY environment variable")
-
-        cprint(f"Initializing computer assistant...", "cyan")
-        cprint(f"Wait time set to: {WAIT_BEFORE_ACTION if WAIT_BEFORE_ACTION is not None else 'No wait'}", "cyan")
-
-        # Initialize API
-        api = ComputerControlAPI(api_key=final_api_key)
-        
         # Create initial message with instructions
         messages = [{
             "role": "user",
             "content": [{"type": "text", "text": instructions}]
         }]
+        if checkpoint is not None:
+            checkpoint.start(messages)
 
-        # Run conversation with initial instructions
-        while True:
-            try:
-                response = api.client.beta.messages.create(
-                    model=api.model,
-                    messages=cast(List[MessageParam], messages),
-                    system=api._get_system_prompt(),
-                    tools=[api.computer_tool.to_params(), api.edit_tool.to_params()],
-                    max_tokens=4096,
-                    extra_headers={"anthropic-beta": "computer-use-2024-10-22"}
-                )
-
-                tool_calls = []
-                cprint("\nAssistant's Plan:", "green")
+    def add(message: Dict[str, Any]):
+        messages.append(message)
+        if checkpoint is not None:
+            checkpoint.append(message)
 
-                # Process response content
-                for block in response.content:
-                    if hasattr(block, 'text'):
-                        cprint(f"\n{block.text}", "white")
-                    if hasattr(block, 'type') and block.type == 'tool_use':
-                        tool_calls.append({
-                            "name": block.name,
-                            "input": block.input,
-                            "id": block.id
-                        })
-                        cprint(f"\n[Planning: {block.name} - {block.input}]", "yellow")
+    # Run conversation with initial instructions
+    try:
+        with api.tracer.span("session", instructions=str(messages[0]["content"])[:200]):
+            while True:
+                response, tool_calls, tool_results = await api._run_turn(messages, log)
 
-                messages.append({
+                add({
                     "role": "assistant",
                     "content": response.content
                 })
 
                 if not tool_calls:
-                    cprint("\nNo more actions to perform. Ending session.", "green")
+                    log("\nNo more actions to perform. Ending session.", "green")
                     break
 
-                # Execute tools and collect results
-                tool_results = []
-                for tool_call in tool_calls:
-                    try:
-                        tool_name = tool_call.get("name")
-                        tool_input = tool_call.get("input", {})
-                        
-                        tool = api.computer_tool if tool_name == "computer" else api.edit_tool
-                        
-                        cprint(f"\nExecuting {tool_name} with input: {tool_input}", "cyan")
-                        
-                        result = await tool(**tool_input)
-                        
-                        formatted_result = {
-                            "type": "tool_result",
-                            "tool_use_id": tool_call.get("id"),
-                            "is_error": bool(result.error),
-                            "content": api._format_tool_result(result)
-                        }
-                        
-                        tool_results.append(formatted_result)
-                        
-                        if result.error:
-                            cprint(f"\nError: {result.error}", "red")
-                        elif result.output:
-                            cprint(f"\nResult: {result.output}", "green")
-                        
-                        await asyncio.sleep(0.5)
-                        
-                    except Exception as e:
-                        error_msg = f"\nError executing tool: {str(e)}"
-                        cprint(error_msg, "red")
-                        tool_results.append({
-                            "type": "tool_result",
-                            "tool_use_id": tool_call.get("id"),
-                            "is_error": True,
-                            "content": [{"type": "text", "text": f"Tool execution failed: {str(e)}"}]
-                        })
-
+                stop = api.track_turn(tool_calls, tool_results, log)
                 if tool_results:
-                    messages.append({
+                    add({
                         "role": "user",
                         "content": tool_results
                     })
+                if stop:
+                    raise BudgetExceeded(stop)
+    except BaseException:
+        if checkpoint is not None:
+            checkpoint.finish("interrupted")
+        raise
+    if checkpoint is not None:
+        checkpoint.finish("finished")
+    return messages
+
+async def use_yourself(instructions: str, wait_time: Optional[float] = 0.0, api_key: Optional[str] = None, debug: bool = False,
+                       stream: bool = False, target: str = "WXGA",
+                       screenshot_policy: ScreenshotPolicy = ScreenshotPolicy.ALWAYS, backend: str = "auto",
+                       trace_path: Optional[str] = None,
+                       turn_cache: Optional[Literal["record", "replay"]] = None,
+                       action_policy: Optional[ActionPolicy] = None, resume: Optional[str] = None,
+                       budget: Optional[SessionBudget] = None) -> bool:
+    """
+    Run the computer assistant with given instructions
+    
+    Errors are reported rather than raised; the return value tells whether the
+    session finished its instructions (False after an error, a budget stop or
+    a cancel), so callers such as run_sessions.py can set an exit status.
+    
+    Args:
+        instructions (str): The instructions for the computer assistant to follow
+        wait_time (Optional[float]): Wait time before pointer, text and submit actions in seconds. None or 0 for no wait
+        api_key (Optional[str]): Anthropic API key. If None, will try to get from environment
+        debug (bool): Enable debug mode for detailed error messages
+        stream (bool): Stream responses and start each action as soon as it is complete
+        target (str): Virtual resolution the model works in (a MAX_SCALING_TARGETS key)
+        screenshot_policy (ScreenshotPolicy): When verification screenshots are taken (always, end_of_batch, on_request)
+        backend (str): Display backend for capture and input (auto, mss, pyautogui, fake)
+        trace_path (Optional[str]): JSONL file the timing spans of the session are appended to
+        turn_cache (Optional[str]): "record" model turns to the on-disk cache, or "replay" matching ones from it
+        action_policy (Optional[ActionPolicy]): Which action classes wait for review (overrides wait_time)
+        resume (Optional[str]): Id of a checkpointed session to continue instead of starting on instructions
+        budget (Optional[SessionBudget]): Step, time and token limits of the session (default SessionBudget())
+    
+    Returns:
+        bool: True if the session ran to completion
+    """
+    from termcolor import cprint
 
-            except Exception as e:
-                cprint(f"\nError in conversation loop: {str(e)}", "red")
-                if debug:
-                    import traceback
-                    traceback.print_exc()
-                break
+    api: Optional[ComputerControlAPI] = None
+    finished = False
+    checkpoint = SessionCheckpoint(resume)
+    try:
+        if resume and not checkpoint.exists():
+            raise ValueError(f"No checkpoint for session {resume} in {checkpoint.path.parent}")
+
+        # Display warning message
+        cprint(SAFETY_NOTICE, "red")
+
+        # Review delays for this session only
+        action_policy = action_policy or ActionPolicy(wait=wait_time)
+
+        # Get API key
+        final_api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
+        if not final_api_key:
+            raise ValueError("API key must be provided either as parameter or in ANTHROPIC_API_KEY environment variable")
+
+        cprint(f"Initializing computer assistant...", "cyan")
+        cprint(f"Wait time set to: {action_policy.describe()}", "cyan")
+
+        # Initialize API
+        api = ComputerControlAPI(api_key=final_api_key, stream=stream,
+                                 computer_tool=ComputerTool(target=target, screenshot_policy=screenshot_policy,
+                                                            backend=backend, action_policy=action_policy),
+                                 tracer=Tracer(trace_path),
+                                 turn_cache=TurnCache(mode=turn_cache) if turn_cache else None,
+                                 blob_store=ImageBlobStore(), budget=budget)
+
+        cprint(f"Session {checkpoint.session_id} (checkpointed in {checkpoint.path})", "cyan")
+        try:
+            await run_instructions(api, instructions, cprint, checkpoint)
+            finished = True
+        except BudgetExceeded as e:
+            cprint(f"\nStopping the session: {str(e)}", "yellow")
+        except Exception as e:
+            cprint(f"\nError in conversation loop: {str(e)}", "red")
+            if debug:
+                import traceback
+                traceback.print_exc()
 
     except KeyboardInterrupt:
         cprint("\nOperation cancelled by user", "yellow")
@@ -746,11 +3577,136 @@ async def use_yourself(instructions: str, wait_time: Optional[float] = 0.0, api_
             import traceback
             traceback.print_exc()
     finally:
+        if api is not None:
+            cprint(f"\nToken usage: {api.usage.summary()}", "blue")
+            cprint(f"Budget: {api.budget.report(api.usage)}; stuck-loop hints: {api.loop_detector.hints}", "blue")
+            if api.computer_tool.settle_detector is not None:
+                cprint(f"Settle times: {api.computer_tool.settle_detector.summary()}", "blue")
+            cprint(f"Capture latency: {api.computer_tool.backend.capture_summary()}", "blue")
+            if api.turn_cache is not None:
+                cprint(f"Turn cache: {api.turn_cache.summary()}", "blue")
+            if api.blob_store is not None:
+                cprint(f"Image blobs: {api.blob_store.summary()}", "blue")
+            cprint(f"\nPhase timings:\n{api.tracer.format_summary()}", "blue")
+            api.tracer.close()
+            api.computer_tool.backend.close()
+        if checkpoint.status not in (None, "finished"):
+            cprint(f"\nResume this session with use_yourself(..., resume=\"{checkpoint.session_id}\") "
+                   f"or python use_yourself.py --resume {checkpoint.session_id}", "yellow")
         cprint("\nComputer Assistant session ended", "green")
+    return finished
 
 
 
 # Global debug flag
 DEBUG = False  # Set to True for detailed error messages
 
+def measure_startup(module: str = "use_yourself") -> tuple[float, List[tuple[float, str]]]:
+    """
+    Import time of module in a fresh interpreter, from `python -X importtime`
+
+    Returns the cumulative time in ms and the (ms, name) of the modules it
+    imports directly, slowest first.
+    """
+    import subprocess
+    import sys
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=Path(__file__).resolve().parent, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed: {result.stderr.strip().splitlines()[-1]}")
+
+    # Lines look like "import time: <self us> | <cumulative us> | <indented name>", children before parents
+    total_ms: Optional[float] = None
+    children: List[tuple[float, str]] = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        cumulative_ms = int(parts[1]) / 1000
+        depth = (len(parts[2]) - len(parts[2].lstrip()) - 1) // 2
+        name = parts[2].strip()
+        if depth == 0 and name == module:
+            total_ms = cumulative_ms
+        elif depth == 1:
+            children.append((cumulative_ms, name))
+        elif depth == 0:
+            children.clear()
+    if total_ms is None:
+        raise RuntimeError(f"{module} was not imported (already loaded by site?)")
+    return total_ms, sorted(children, reverse=True)
+
+def check_startup(budget_ms: float = STARTUP_BUDGET_MS, module: str = "use_yourself", runs: int = 3) -> bool:
+    """
+    Print the import time of module and its slowest imports, and whether it fits budget_ms
+
+    The fastest of runs measurements is used; the first one also pays for
+    writing the bytecode cache.
+    """
+    total_ms, children = min(measure_startup(module) for _ in range(runs))
+    within = total_ms <= budget_ms
+    cprint(f"import {module}: {total_ms:.1f} ms (budget {budget_ms:.0f} ms)", "green" if within else "red")
+    for cumulative_ms, name in children[:8]:
+        print(f"  {cumulative_ms:8.1f} ms  {name}")
+    return within
+
+def add_budget_arguments(parser: Any):
+    """Command line options for the SessionBudget limits (0 disables a limit)"""
+    defaults = SessionBudget()
+    parser.add_argument("--max-steps", type=int, default=defaults.max_steps, help="Tool calls per session")
+    parser.add_argument("--max-seconds", type=float, default=defaults.max_seconds, help="Wall-clock seconds per session")
+    parser.add_argument("--max-input-tokens", type=int, default=defaults.max_input_tokens,
+                        help="Prompt tokens per session (including cached ones)")
+    parser.add_argument("--max-output-tokens", type=int, default=defaults.max_output_tokens,
+                        help="Generated tokens per session")
+
+def budget_from_arguments(args: Any) -> SessionBudget:
+    """SessionBudget from the options added by add_budget_arguments"""
+    return SessionBudget(max_steps=args.max_steps or None, max_seconds=args.max_seconds or None,
+                         max_input_tokens=args.max_input_tokens or None, max_output_tokens=args.max_output_tokens or None)
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Let the computer-use assistant operate this machine to drive the Cursor agent")
+    parser.add_argument("instructions", nargs="?", help="Instructions for the session (default: interactive prompt)")
+    parser.add_argument("--wait-time", type=float, default=DEFAULT_WAIT_BEFORE_ACTION,
+                        help="Seconds to review each risky action before it runs")
+    parser.add_argument("--stream", action="store_true", help="Stream model responses")
+    parser.add_argument("--target", default="WXGA", choices=list(MAX_SCALING_TARGETS),
+                        help="Virtual resolution used by the model")
+    parser.add_argument("--backend", default="auto", choices=["auto", *DISPLAY_BACKENDS],
+                        help="Display backend for capture and input")
+    parser.add_argument("--screenshot-policy", default=ScreenshotPolicy.ALWAYS,
+                        choices=[policy.value for policy in ScreenshotPolicy],
+                        help="When verification screenshots are taken")
+    parser.add_argument("--trace", metavar="PATH", help="Append timing spans to this JSONL file")
+    parser.add_argument("--turn-cache", choices=["record", "replay"], help="Record or replay model turns")
+    parser.add_argument("--resume", metavar="SESSION_ID", help="Continue a checkpointed session")
+    add_budget_arguments(parser)
+    parser.add_argument("--debug", action="store_true", help="Print tracebacks of errors")
+    parser.add_argument("--check-startup", nargs="?", type=float, const=STARTUP_BUDGET_MS, metavar="BUDGET_MS",
+                        help=f"Measure the import time of this module and fail above the budget "
+                             f"(default {STARTUP_BUDGET_MS:.0f} ms)")
+    args = parser.parse_args()
+
+    if args.check_startup is not None:
+        sys.exit(0 if check_startup(args.check_startup) else 1)
+
+    instructions = args.instructions or ""
+    if not instructions and not args.resume:
+        instructions = input("What would you like me to do? ").strip()
+        if not instructions:
+            parser.error("no instructions given")
+
+    finished = asyncio.run(use_yourself(instructions, wait_time=args.wait_time, debug=args.debug, stream=args.stream,
+                                        target=args.target, screenshot_policy=args.screenshot_policy,
+                                        backend=args.backend, trace_path=args.trace, turn_cache=args.turn_cache,
+                                        resume=args.resume, budget=budget_from_arguments(args)))
+    sys.exit(0 if finished else 1)
+
+if __name__ == "__main__":
+    main()
+
 
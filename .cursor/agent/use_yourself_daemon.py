@@ -0,0 +1,463 @@
+# Long-running use_yourself daemon: keeps the client, tools and display backend warm
+# and runs instruction jobs submitted over a Unix domain socket, one at a time
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import functools
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional
+
+from termcolor import cprint
+
+from use_yourself import (DEFAULT_WAIT_BEFORE_ACTION, MAX_SCALING_TARGETS, SAFETY_NOTICE, ActionPolicy,
+                          ComputerControlAPI, ComputerTool, ImageBlobStore, ScreenshotPolicy, SessionCheckpoint,
+                          Tracer, TurnCache, add_budget_arguments, budget_from_arguments, close_shared_clients,
+                          run_instructions)
+
+DEFAULT_SOCKET = Path(os.getenv("XDG_RUNTIME_DIR") or tempfile.gettempdir()) / f"use_yourself-{getattr(os, 'getuid', lambda: 0)()}.sock"
+
+JobStatus = Literal["queued", "running", "done", "failed", "cancelled"]
+FINISHED: tuple[str, ...] = ("done", "failed", "cancelled")
+
+@dataclass
+class DaemonJob:
+    """Instructions queued on the daemon, with their progress and recent output"""
+    instructions: str
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+    status: JobStatus = "queued"
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    usage: Optional[str] = None
+    budget: Optional[str] = None
+    session_id: Optional[str] = None  # checkpoint of the run, see SessionCheckpoint
+    ended: bool = False  # the final event was delivered to the watchers
+    output_tail: deque = field(default_factory=lambda: deque(maxlen=500))
+    subscribers: List[asyncio.Queue] = field(default_factory=list)
+
+    @property
+    def duration(self) -> Optional[float]:
+        """Run time in seconds, once started"""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    def describe(self) -> Dict[str, Any]:
+        """JSON-ready status of the job"""
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "instructions": self.instructions[:200],
+            "submitted_at": self.submitted_at,
+            "duration": round(self.duration, 1) if self.duration is not None else None,
+            "error": self.error,
+            "usage": self.usage,
+            "budget": self.budget,
+            "session_id": self.session_id,
+        }
+
+class _JobOutput(io.TextIOBase):
+    """
+    Output sink of one job
+
+    Text is echoed to the daemon's own stdout and published to the job's
+    watchers. Tools may print from worker threads, so publishing goes through
+    the event loop.
+    """
+    def __init__(self, daemon: "AgentDaemon", job: DaemonJob, echo: Any):
+        self.daemon = daemon
+        self.job = job
+        self.echo = echo
+
+    def write(self, text: str) -> int:
+        if text:
+            self.echo.write(text)
+            self.daemon.publish(self.job, {"event": "output", "text": text})
+        return len(text)
+
+    def flush(self):
+        self.echo.flush()
+
+# Output sink of the job whose task (or worker thread, see asyncio.to_thread) is running
+_job_output: contextvars.ContextVar[Optional[_JobOutput]] = contextvars.ContextVar("job_output", default=None)
+
+class _TaskStdout(io.TextIOBase):
+    """
+    sys.stdout while the daemon serves
+
+    The tools print their progress, so a job's output cannot be passed to them
+    as an argument; instead each write goes to the sink of the job running in
+    the writing context, and anything else (client handlers, the worker) to
+    the real stdout. Unlike swapping sys.stdout per job, output of other
+    coroutines never lands in a job.
+    """
+    def __init__(self, stdout: Any):
+        self.stdout = stdout
+
+    def write(self, text: str) -> int:
+        return (_job_output.get() or self.stdout).write(text)
+
+    def flush(self):
+        self.stdout.flush()
+
+class AgentDaemon:
+    """
+    Runs queued instruction jobs on one warm ComputerControlAPI
+
+    Handles:
+    - A Unix domain socket (mode 0600) speaking newline-delimited JSON
+    - A job queue processed one job at a time, since jobs share the screen
+    - Per-job status, cancellation and streamed output for watchers
+    - Resetting the conversation state between jobs (ComputerControlAPI.new_session)
+    - A SessionCheckpoint per job, so an interrupted job can be continued
+      with use_yourself(..., resume=session_id)
+
+    Requests are single JSON lines with a "command": submit (instructions,
+    follow), status (job_id optional), watch (job_id), cancel (job_id) or
+    shutdown. Replies are JSON lines; watchers get "output" events and a
+    final "finished" event with the job status.
+    """
+    def __init__(self, api: ComputerControlAPI, socket_path: Path = DEFAULT_SOCKET, max_jobs: int = 200):
+        self.api = api
+        self.socket_path = Path(socket_path)
+        self.max_jobs = max_jobs
+        self.jobs: Dict[str, DaemonJob] = {}
+        self._queue: asyncio.Queue[DaemonJob] = asyncio.Queue()
+        self._running: Optional[asyncio.Task] = None
+        self._stopped = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stdout: Any = sys.stdout  # the daemon's own stdout, which job output is echoed to
+
+    def submit(self, instructions: str) -> DaemonJob:
+        """Queue instructions for the worker"""
+        if not instructions.strip():
+            raise ValueError("Instructions are empty")
+        job = DaemonJob(instructions=instructions)
+        self.jobs[job.job_id] = job
+        self._queue.put_nowait(job)
+        self._forget_old_jobs()
+        return job
+
+    def cancel(self, job_id: str) -> DaemonJob:
+        """Cancel a queued or running job"""
+        job = self._job(job_id)
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            self.publish(job, {"event": "finished", "job": job.describe()})
+        elif job.status == "running" and self._running is not None:
+            self._running.cancel()
+        return job
+
+    def publish(self, job: DaemonJob, event: Dict[str, Any]):
+        """Send event to the watchers of job (safe to call from any thread)"""
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._deliver, job, event)
+
+    def _deliver(self, job: DaemonJob, event: Dict[str, Any]):
+        if event["event"] == "output":
+            job.output_tail.append(event["text"])
+        elif event["event"] == "finished":
+            job.ended = True
+        for queue in job.subscribers:
+            queue.put_nowait(event)
+
+    async def serve(self):
+        """Listen on the socket and run jobs until a shutdown request"""
+        if not hasattr(asyncio, "start_unix_server"):
+            raise RuntimeError("The daemon needs Unix domain sockets, which this platform does not support")
+        self._loop = asyncio.get_running_loop()
+        self._remove_stale_socket()
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        # Anyone who can connect can drive this machine, so the socket is private to the user
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self._handle_client, path=str(self.socket_path))
+        finally:
+            os.umask(umask)
+        worker = asyncio.create_task(self._worker())
+        cprint(f"Daemon listening on {self.socket_path}", "green")
+        try:
+            self._stdout = sys.stdout
+            with contextlib.redirect_stdout(_TaskStdout(self._stdout)):
+                async with server:
+                    try:
+                        await self._stopped.wait()
+                    finally:
+                        # Finish every job, so that watchers get their final event before the server closes
+                        for job in list(self.jobs.values()):
+                            if job.status == "queued":
+                                self.cancel(job.job_id)
+                        worker.cancel()
+                        await asyncio.gather(worker, return_exceptions=True)
+                        await asyncio.sleep(0)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                self.socket_path.unlink()
+            cprint("Daemon stopped", "yellow")
+
+    def stop(self):
+        self._stopped.set()
+
+    def _remove_stale_socket(self):
+        """Delete a socket file left by a daemon that is gone; refuse if one still answers"""
+        if not self.socket_path.exists():
+            return
+        import socket
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(self.socket_path))
+        except OSError:
+            self.socket_path.unlink()
+        else:
+            raise RuntimeError(f"A daemon is already listening on {self.socket_path}")
+        finally:
+            probe.close()
+
+    async def _worker(self):
+        """Run queued jobs one at a time"""
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.status != "queued":
+                    continue
+                self._running = asyncio.create_task(self._run_job(job))
+                try:
+                    # wait() instead of await, so cancelling the job does not cancel the worker
+                    await asyncio.wait({self._running})
+                finally:
+                    if not self._running.done():
+                        self._running.cancel()
+                    self._running = None
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job: DaemonJob):
+        """Run one job on the shared API with its output published to the watchers"""
+        job.status = "running"
+        job.started_at = time.time()
+        self.publish(job, {"event": "status", "job": job.describe()})
+        # This task runs in its own context, so the sink covers this job only
+        output = _JobOutput(self, job, self._stdout)
+        _job_output.set(output)
+        log = functools.partial(cprint, file=output)
+        checkpoint = SessionCheckpoint()
+        job.session_id = checkpoint.session_id
+        try:
+            log(f"[{job.job_id}] Starting job (session {checkpoint.session_id})", "cyan")
+            self.api.new_session()
+            await run_instructions(self.api, job.instructions, log, checkpoint)
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e) or type(e).__name__
+        finally:
+            job.finished_at = time.time()
+            job.usage = self.api.usage.summary()
+            job.budget = self.api.budget.report(self.api.usage)
+            color = "green" if job.status == "done" else "red"
+            cprint(f"[{job.job_id}] Job {job.status} in {job.duration:.1f}s ({job.usage})", color)
+            cprint(f"[{job.job_id}] Budget: {job.budget}", color)
+            self.publish(job, {"event": "finished", "job": job.describe()})
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer one request; submit with follow and watch stream until the job finishes"""
+        try:
+            line = await reader.readline()
+            try:
+                request = json.loads(line)
+                command = request["command"]
+                if command == "submit":
+                    job = self.submit(str(request["instructions"]))
+                    await self._send(writer, {"ok": True, "job": job.describe(), "queued": self._queue.qsize()})
+                    if request.get("follow"):
+                        await self._follow(job, writer)
+                elif command == "status":
+                    if request.get("job_id"):
+                        await self._send(writer, {"ok": True, "job": self._job(request["job_id"]).describe()})
+                    else:
+                        await self._send(writer, {"ok": True, "jobs": [job.describe() for job in self.jobs.values()]})
+                elif command == "watch":
+                    job = self._job(request["job_id"])
+                    await self._send(writer, {"ok": True, "job": job.describe()})
+                    await self._follow(job, writer)
+                elif command == "cancel":
+                    await self._send(writer, {"ok": True, "job": self.cancel(request["job_id"]).describe()})
+                elif command == "shutdown":
+                    await self._send(writer, {"ok": True})
+                    self.stop()
+                else:
+                    raise ValueError(f"Unknown command {command!r}")
+            except (ValueError, KeyError, TypeError) as e:
+                await self._send(writer, {"ok": False, "error": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _follow(self, job: DaemonJob, writer: asyncio.StreamWriter):
+        """Stream the recent and new output of job, then its final status"""
+        if job.ended:
+            await self._send(writer, {"event": "output", "text": "".join(job.output_tail)})
+            await self._send(writer, {"event": "finished", "job": job.describe()})
+            return
+        queue: asyncio.Queue = asyncio.Queue()
+        job.subscribers.append(queue)
+        try:
+            if job.output_tail:
+                await self._send(writer, {"event": "output", "text": "".join(job.output_tail)})
+            while True:
+                event = await queue.get()
+                await self._send(writer, event)
+                if event["event"] == "finished":
+                    break
+        finally:
+            job.subscribers.remove(queue)
+
+    async def _send(self, writer: asyncio.StreamWriter, message: Dict[str, Any]):
+        writer.write(json.dumps(message).encode() + b"\n")
+        await writer.drain()
+
+    def _job(self, job_id: str) -> DaemonJob:
+        if job_id not in self.jobs:
+            raise ValueError(f"Unknown job {job_id!r}")
+        return self.jobs[job_id]
+
+    def _forget_old_jobs(self):
+        """Drop the oldest finished jobs beyond max_jobs"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[job_id]
+
+async def request(payload: Dict[str, Any], socket_path: Path = DEFAULT_SOCKET) -> AsyncIterator[Dict[str, Any]]:
+    """Send one request to the daemon and yield its replies"""
+    try:
+        reader, writer = await asyncio.open_unix_connection(str(socket_path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        raise ConnectionError(f"No daemon listening on {socket_path}; start it with: python use_yourself_daemon.py serve")
+    try:
+        writer.write(json.dumps(payload).encode() + b"\n")
+        await writer.drain()
+        while line := await reader.readline():
+            yield json.loads(line)
+    finally:
+        writer.close()
+
+async def run_client(payload: Dict[str, Any], socket_path: Path) -> bool:
+    """Print the replies of one request; True unless it failed or a followed job did not finish as done"""
+    success = True
+    async for message in request(payload, socket_path):
+        if message.get("ok") is False:
+            cprint(f"Error: {message['error']}", "red")
+            success = False
+        elif message.get("event") == "output":
+            sys.stdout.write(message["text"])
+            sys.stdout.flush()
+        elif message.get("event") == "finished":
+            job = message["job"]
+            cprint(f"\nJob {job['job_id']} {job['status']} in {job['duration'] or 0:.1f}s"
+                   f"{': ' + job['error'] if job['error'] else ''}", "green" if job["status"] == "done" else "red")
+            if job.get("budget"):
+                print(f"Budget: {job['budget']}")
+            success = job["status"] == "done"
+        elif "jobs" in message:
+            for job in message["jobs"]:
+                print(f"{job['job_id']}  {job['status']:<9}  {job['instructions'][:60]}")
+        elif "job" in message and message.get("event") != "status":
+            job = message["job"]
+            print(f"Job {job['job_id']}: {job['status']}" + (f" ({message['queued']} queued)" if "queued" in message else ""))
+        elif payload["command"] == "shutdown":
+            print("Daemon shutting down")
+    return success
+
+async def serve(args: argparse.Namespace):
+    cprint(SAFETY_NOTICE, "red")
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        raise SystemExit("ANTHROPIC_API_KEY must be set")
+    action_policy = ActionPolicy(wait=args.wait_time)
+    cprint(f"Wait time set to: {action_policy.describe()}", "cyan")
+    api = ComputerControlAPI(api_key=api_key, stream=args.stream,
+                             computer_tool=ComputerTool(target=args.target, screenshot_policy=args.screenshot_policy,
+                                                        backend=args.backend, action_policy=action_policy),
+                             tracer=Tracer(args.trace),
+                             turn_cache=TurnCache(mode=args.turn_cache) if args.turn_cache else None,
+                             blob_store=ImageBlobStore(), budget=budget_from_arguments(args))
+    try:
+        await AgentDaemon(api, args.socket).serve()
+    finally:
+        cprint(f"\nPhase timings:\n{api.tracer.format_summary()}", "blue")
+        api.tracer.close()
+        api.computer_tool.backend.close()
+        await close_shared_clients()
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep use_yourself warm in the background and submit jobs to it")
+    parser.add_argument("--socket", type=Path, default=DEFAULT_SOCKET, help=f"Daemon socket (default {DEFAULT_SOCKET})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Run the daemon in the foreground")
+    serve_parser.add_argument("--wait-time", type=float, default=DEFAULT_WAIT_BEFORE_ACTION,
+                              help="Seconds to review each risky action before it runs")
+    serve_parser.add_argument("--stream", action="store_true", help="Stream model responses")
+    serve_parser.add_argument("--target", default="WXGA", choices=list(MAX_SCALING_TARGETS),
+                              help="Virtual resolution used by the model")
+    serve_parser.add_argument("--backend", default="auto", help="Display backend: auto, mss, pyautogui or fake")
+    serve_parser.add_argument("--screenshot-policy", default=ScreenshotPolicy.ALWAYS,
+                              choices=[policy.value for policy in ScreenshotPolicy])
+    serve_parser.add_argument("--trace", metavar="PATH", help="Append timing spans to this JSONL file")
+    serve_parser.add_argument("--turn-cache", choices=["record", "replay"], help="Record or replay model turns")
+    add_budget_arguments(serve_parser)
+
+    submit_parser = commands.add_parser("submit", help="Queue instructions and follow their progress")
+    submit_parser.add_argument("instructions", help="Instructions for the job")
+    submit_parser.add_argument("--detach", action="store_true", help="Only queue the job and print its id")
+    status_parser = commands.add_parser("status", help="Show all jobs or one job")
+    status_parser.add_argument("job_id", nargs="?")
+    watch_parser = commands.add_parser("watch", help="Follow the output of a job")
+    watch_parser.add_argument("job_id")
+    cancel_parser = commands.add_parser("cancel", help="Cancel a queued or running job")
+    cancel_parser.add_argument("job_id")
+    commands.add_parser("stop", help="Cancel the running job and shut the daemon down")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        with contextlib.suppress(KeyboardInterrupt):
+            asyncio.run(serve(args))
+        return
+
+    payloads = {
+        "submit": lambda: {"command": "submit", "instructions": args.instructions, "follow": not args.detach},
+        "status": lambda: {"command": "status", "job_id": args.job_id},
+        "watch": lambda: {"command": "watch", "job_id": args.job_id},
+        "cancel": lambda: {"command": "cancel", "job_id": args.job_id},
+        "stop": lambda: {"command": "shutdown"},
+    }
+    try:
+        success = asyncio.run(run_client(payloads[args.command](), args.socket))
+    except ConnectionError as e:
+        cprint(str(e), "red")
+        success = False
+    except KeyboardInterrupt:
+        cprint("\nStopped following; the job keeps running (cancel it with the cancel command)", "yellow")
+        success = False
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()